@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Benchmark: wall time and threads for many URLs, thread pool vs asyncio downloader
+
+Runs resolve -> page fetch/extraction -> download for every URL against a local
+stand-in for xhslink.com, xiaohongshu.com and the CDN that answers after a
+fixed latency. The synchronous downloader runs in a thread pool the size of
+--threads; the asyncio downloader runs on one event loop with its global and
+per-host limits. All URLs share one host here, so the per-host limit caps the
+asyncio run. The stand-in host is not paced by the host scheduler.
+
+Usage:
+    python benchmarks/bench_async_downloader.py [-n 500] [--threads 8]
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import download, aio
+from downloader.session import close_session
+
+VIDEO_BYTES = os.urandom(256 * 1024)
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves short links, note pages and video files after a simulated network latency"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None, include_body=True):
+        time.sleep(self.server.latency)
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def _route(self, include_body):
+        if self.path.startswith('/short/'):
+            note_id = self.path.rsplit('/', 1)[-1]
+            self._send(302, headers={'Location': f'/explore/{note_id}'}, include_body=include_body)
+        elif self.path.startswith('/explore/'):
+            note_id = self.path.rsplit('/', 1)[-1]
+            video_url = f"http://127.0.0.1:{self.server.server_address[1]}/video/{note_id}.mp4"
+            page = (
+                '<html><script>window.__INITIAL_STATE__={"note":{"video":{"media":{"stream":'
+                f'{{"h264":[{{"masterUrl":"{video_url}"}}]}}}}}}}};</script></html>'
+            ).encode('utf-8')
+            self._send(200, page, {'Content-Type': 'text/html'}, include_body)
+        elif self.path.startswith('/video/'):
+            self._send(200, VIDEO_BYTES, {'Content-Type': 'video/mp4'}, include_body)
+        else:
+            self._send(404, include_body=include_body)
+
+    def do_HEAD(self):
+        self._route(include_body=False)
+
+    def do_GET(self):
+        self._route(include_body=True)
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients closing idle keep-alive connections are expected
+        pass
+
+class ThreadCounter:
+    """Samples the peak number of live client threads (not stand-in server threads) in the background"""
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.01):
+            live = sum(1 for thread in threading.enumerate() if 'process_request' not in thread.name)
+            self.peak = max(self.peak, live)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+def run_threads(base, notes, output_dir, threads):
+    def one(n):
+        page_url = download.resolve_short_url(f"{base}/short/{n}")
+        streams, _ = download.extract_video_data(page_url)
+        return download.download_video(streams[0].url, f"video_{n}", output_dir)
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        paths = list(pool.map(one, notes))
+    close_session()
+    return sum(1 for path in paths if path)
+
+def run_asyncio(base, notes, output_dir):
+    async def one(downloader, n):
+        page_url = await downloader.resolve_short_url(f"{base}/short/{n}")
+        streams, _ = await downloader.extract_video_data(page_url)
+        return await downloader.download_video(streams[0].url, f"video_{n}")
+
+    async def run():
+        async with aio.AsyncDownloader(output_dir=output_dir) as downloader:
+            return await asyncio.gather(*(one(downloader, n) for n in notes))
+
+    return sum(1 for path in asyncio.run(run()) if path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the thread pool and asyncio downloaders')
+    parser.add_argument('-n', '--count', type=int, default=500, help='Number of URLs to process')
+    parser.add_argument('--threads', type=int, default=8, help='Thread pool size for the synchronous downloader')
+    parser.add_argument('--latency', type=float, default=0.05, help='Stand-in server latency per request in seconds')
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    server = StandInServer(('127.0.0.1', 0), StandInHandler)
+    server.latency = args.latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    workdir = tempfile.mkdtemp(prefix='bench_async_downloader_')
+    cwd = os.getcwd()
+    # The short-link and note caches live in the working directory
+    os.chdir(workdir)
+    try:
+        runs = (
+            (f'threads ({args.threads})', lambda notes: run_threads(base, notes, workdir, args.threads)),
+            ('asyncio', lambda notes: run_asyncio(base, notes, workdir)),
+        )
+        for offset, (label, run) in enumerate(runs):
+            # Distinct note IDs per run, so the second run gets no cache hits
+            notes = range(offset * 10 ** 6, offset * 10 ** 6 + args.count)
+            with ThreadCounter() as threads:
+                start = time.perf_counter()
+                downloaded = run(notes)
+                elapsed = time.perf_counter() - start
+            print(f"{label:12s}: {downloaded}/{args.count} videos in {elapsed:6.2f}s, "
+                  f"{args.count / elapsed:6.1f} URLs/s, peak {threads.peak} threads")
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark: process cold start of the entry points
+
+Measures, over several fresh interpreter launches:
+- time from spawn until the first log line is printed
+- resident memory when that line arrives, and the peak RSS at exit
+- cumulative import time of the main modules (python -X importtime)
+
+The main.py run uses an empty URL file, the cron case where nothing is
+queued and nothing should be imported beyond what the check needs.
+
+Usage:
+    python benchmarks/bench_cold_start.py [-n 10]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules whose import cost is tracked per release
+MODULES = ['main', 'downloader.download', 'uploader.upload', 'media.convert', 'media.scheduler']
+
+def rss_mb(pid):
+    """Current resident memory of a process from /proc, None where unavailable"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+def run_once(cmd, cwd, env):
+    """
+    Launch cmd and time its first line of output
+
+    Returns:
+        tuple: (seconds to first line, RSS MB at first line, peak RSS MB)
+    """
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    proc.stdout.readline()
+    first_line = time.perf_counter() - start
+    rss = rss_mb(proc.pid)
+    proc.stdout.read()
+    proc.stdout.close()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+    return first_line, rss, peak
+
+def import_time_ms(module, cwd, env):
+    """Cumulative import time of a module in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1]) / 1000
+    return None
+
+def summarize(label, runs):
+    first = [run[0] * 1000 for run in runs]
+    rss = [run[1] for run in runs if run[1] is not None]
+    peak = [run[2] for run in runs]
+    rss_text = f"{statistics.median(rss):6.1f} MB" if rss else "    n/a"
+    print(
+        f"{label:<28} first log line {statistics.median(first):7.1f} ms (min {min(first):.1f})  "
+        f"RSS {rss_text}  peak {statistics.median(peak):6.1f} MB"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure entry point start-up time and memory')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='Launches per entry point')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_cold_start_')
+    try:
+        url_file = os.path.join(work_dir, 'urls.txt')
+        open(url_file, 'w').close()
+
+        env = dict(os.environ, PYTHONPATH=REPO_DIR, PYTHONUNBUFFERED='1')
+        entry_points = [
+            ('main.py (empty urls.txt)', [sys.executable, os.path.join(REPO_DIR, 'main.py'),
+                                          '-u', url_file, '-d', os.path.join(work_dir, 'downloads')]),
+            ('python -m uploader --help', [sys.executable, '-m', 'uploader', '--help']),
+        ]
+
+        # One unmeasured launch so every run sees warm bytecode and page caches
+        for _, cmd in entry_points:
+            run_once(cmd, work_dir, env)
+
+        print(f"Python {sys.version.split()[0]}, {args.runs} launches each, median reported\n")
+        for label, cmd in entry_points:
+            summarize(label, [run_once(cmd, work_dir, env) for _ in range(args.runs)])
+
+        print("\nCumulative import time (median):")
+        for module in MODULES:
+            times = [import_time_ms(module, work_dir, env) for _ in range(args.runs)]
+            times = [t for t in times if t is not None]
+            if times:
+                print(f"  {module:<22} {statistics.median(times):7.1f} ms")
+            else:
+                print(f"  {module:<22}     failed")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Benchmark: TCP connections opened per 100 URLs by the downloader
+
+Runs resolve_short_url -> extract_video_data -> download_video against a local
+stand-in for xhslink.com, xiaohongshu.com and the CDN, once with bare requests
+calls (the old behaviour) and once with the shared pooled session.
+
+Usage:
+    python benchmarks/bench_connections.py [-n 100]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from downloader import download, ranged
+from downloader.session import get_session, close_session
+
+VIDEO_BYTES = os.urandom(256 * 1024)
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves short links, note pages and video files over keep-alive HTTP/1.1"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None, include_body=True):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def _route(self, include_body):
+        if self.path.startswith('/short/'):
+            note_id = self.path.rsplit('/', 1)[-1]
+            self._send(302, headers={'Location': f'/explore/{note_id}'}, include_body=include_body)
+        elif self.path.startswith('/explore/'):
+            note_id = self.path.rsplit('/', 1)[-1]
+            page = (
+                '<html><script>window.__INITIAL_STATE__={"note":{"video":{"media":{"stream":'
+                f'{{"h264":[{{"masterUrl":"http://127.0.0.1/video/{note_id}.mp4"}}]}}}}}}}};</script></html>'
+            ).encode('utf-8')
+            self._send(200, page, {'Content-Type': 'text/html'}, include_body)
+        elif self.path.startswith('/video/'):
+            self._send(200, VIDEO_BYTES, {'Content-Type': 'video/mp4'}, include_body)
+        else:
+            self._send(404, include_body=include_body)
+
+    def do_HEAD(self):
+        self._route(include_body=False)
+
+    def do_GET(self):
+        self._route(include_body=True)
+
+def run(server, count, output_dir, pooled):
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    server.connections = 0
+    # Without pooling every call goes through the module-level requests functions
+    # Ranged transfers look the session up in their own module, so it is swapped there too
+    download.get_session = ranged.get_session = get_session if pooled else (lambda: requests)
+    start = time.perf_counter()
+    for n in range(count):
+        page_url = download.resolve_short_url(f"{base}/short/{n}")
+        download.extract_video_data(page_url)
+        download.download_video(f"{base}/video/{n}.mp4", f"video_{n}", output_dir)
+    elapsed = time.perf_counter() - start
+    close_session()
+    return server.connections, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Count connections opened by the downloader')
+    parser.add_argument('-n', '--count', type=int, default=100, help='Number of URLs to process')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # The stand-in host is not paced by the host scheduler, so no politeness delays apply
+    output_dir = tempfile.mkdtemp(prefix='bench_connections_')
+    try:
+        for label, pooled in (('bare requests', False), ('pooled session', True)):
+            connections, elapsed = run(server, args.count, output_dir, pooled)
+            print(f"{label:15s}: {connections:4d} connections for {args.count} URLs ({elapsed:.2f}s)")
+    finally:
+        server.shutdown()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
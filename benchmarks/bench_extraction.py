@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-page CPU time of video/caption extraction
+
+Compares the regex scan (parse_video_page_regex, the old extract_video_data
+parsing) with the single-pass __INITIAL_STATE__ engine (parse_video_page).
+Pages come from a directory of saved note pages (*.html), or are generated
+with the same shape as real note pages when no directory is given.
+
+Usage:
+    python benchmarks/bench_extraction.py [--pages DIR] [--repeat 20]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader.download import parse_video_page, parse_video_page_regex
+from downloader.utils import extract_note_id
+
+def _note_id(rng):
+    return ''.join(rng.choice('0123456789abcdef') for _ in range(24))
+
+def _stream(rng, codec, width, height):
+    key = _note_id(rng)
+    return {
+        'videoCodec': codec, 'width': width, 'height': height, 'fps': 30,
+        'avgBitrate': rng.randint(800000, 4000000), 'size': rng.randint(2000000, 40000000),
+        'duration': rng.randint(10000, 180000), 'format': 'mp4',
+        'masterUrl': f"http://sns-video-bd.xhscdn.com/stream/110/259/01e{key}_259.mp4",
+        'backupUrls': [f"http://sns-bak-v1.xhscdn.com/stream/110/259/01e{key}_259.mp4"],
+    }
+
+def generate_page(seed, feed_size=300, comment_count=250):
+    """Build a note page with a detail note, a recommendation feed and a comment tree"""
+    rng = random.Random(seed)
+    note_id = _note_id(rng)
+    note = {
+        'noteId': note_id, 'type': 'video', 'title': f'Weekend trip to the coast {seed}',
+        'desc': 'Sunset walk by the sea #travel[话题]# #sunset[话题]# with friends',
+        'tagList': [{'id': _note_id(rng), 'name': 'travel', 'type': 'topic'},
+                    {'id': _note_id(rng), 'name': 'sunset', 'type': 'topic'}],
+        'interactInfo': {'likedCount': '1.2万', 'collectedCount': '3456', 'commentCount': str(comment_count)},
+        'imageList': [{'urlDefault': f"http://sns-webpic-qc.xhscdn.com/{_note_id(rng)}", 'width': 1080, 'height': 1920}],
+        'video': {'capa': {'duration': 42}, 'media': {'videoId': rng.randint(10**17, 10**18), 'stream': {
+            'h264': [_stream(rng, 'h264', 1080, 1920), _stream(rng, 'h264', 720, 1280)],
+            'h265': [_stream(rng, 'hevc', 1080, 1920)], 'h266': [], 'av1': []}}},
+    }
+    comments = []
+    for i in range(comment_count):
+        comments.append({
+            'id': _note_id(rng), 'content': f'comment {i} ' + 'lovely view ' * rng.randint(1, 12),
+            'userInfo': {'userId': _note_id(rng), 'nickname': f'user{i}', 'image': f"http://sns-avatar-qc.xhscdn.com/avatar/{_note_id(rng)}"},
+            'subComments': [{'id': _note_id(rng), 'content': 'reply ' * rng.randint(1, 6)} for _ in range(rng.randint(0, 3))],
+            'likeCount': str(rng.randint(0, 999)), 'status': None,
+        })
+    feeds = []
+    for i in range(feed_size):
+        feeds.append({'id': _note_id(rng), 'modelType': 'note', 'noteCard': {
+            'displayTitle': f'feed note {i}', 'type': rng.choice(['normal', 'video']),
+            'cover': {'urlDefault': f"http://sns-webpic-qc.xhscdn.com/{_note_id(rng)}", 'width': 1080, 'height': 1440},
+            'user': {'nickname': f'author{i}', 'avatar': f"http://sns-avatar-qc.xhscdn.com/avatar/{_note_id(rng)}"},
+            'interactInfo': {'liked': False, 'likedCount': str(rng.randint(0, 99999))}}})
+    state = {
+        'global': {'appSettings': {'notificationInterval': 30, 'prohibitedWords': []}},
+        'user': {'loggedIn': False, 'userInfo': {}},
+        'feed': {'feeds': feeds, 'isFetching': False},
+        'note': {'currentNoteId': note_id, 'firstNoteId': note_id,
+                 'noteDetailMap': {note_id: {'comments': {'list': comments, 'cursor': ''}, 'note': note}}},
+    }
+    blob = json.dumps(state, ensure_ascii=False).replace('/', '\\u002F').replace('"status": null', '"status":undefined')
+    filler = '<div class="feeds-container">' + '<section class="note-item"><a href="#">x</a></section>' * 400 + '</div>'
+    html = (
+        '<!doctype html><html><head><title>小红书</title></head><body>'
+        f'{filler}<div id="detail-title" class="title">{note["title"]}</div>'
+        f'<script>window.__INITIAL_STATE__={blob}</script></body></html>'
+    )
+    return f"https://www.xiaohongshu.com/explore/{note_id}", html
+
+def cpu_time(func, html, note_id, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        result = func(html, note_id) if note_id is not None else func(html)
+    return (time.process_time() - start) / repeat, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-page CPU time of video extraction')
+    parser.add_argument('--pages', help='Directory of saved note pages (*.html)')
+    parser.add_argument('--count', type=int, default=5, help='Synthetic pages to generate when --pages is not given')
+    parser.add_argument('--repeat', type=int, default=20, help='Parses per page')
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(args.pages, '*.html'))):
+            with open(path, 'r', encoding='utf-8') as f:
+                pages.append((os.path.basename(path), f.read()))
+    else:
+        pages = [generate_page(seed) for seed in range(args.count)]
+
+    totals = [0.0, 0.0]
+    for name, html in pages:
+        regex_time, (regex_urls, regex_caption) = cpu_time(parse_video_page_regex, html, None, args.repeat)
+        engine_time, (engine_urls, engine_caption) = cpu_time(parse_video_page, html, extract_note_id(name), args.repeat)
+        totals[0] += regex_time
+        totals[1] += engine_time
+        print(f"{len(html) / 1024:7.0f} KB  regex {regex_time * 1000:8.2f} ms  engine {engine_time * 1000:7.2f} ms  "
+              f"urls {len(regex_urls)} -> {len(engine_urls)}  caption {engine_caption!r}")
+
+    if pages:
+        print(f"mean per page: regex {totals[0] / len(pages) * 1000:.2f} ms, engine {totals[1] / len(pages) * 1000:.2f} ms "
+              f"({totals[0] / max(totals[1], 1e-9):.1f}x)")
+
+if __name__ == "__main__":
+    main()
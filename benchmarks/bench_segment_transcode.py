@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark: single-pass encode vs parallel segment encode of a long clip
+
+Generates a synthetic clip with ffmpeg's lavfi sources (testsrc2 video and a
+sine tone), then converts it with convert_video_format and with
+convert_video_segmented and compares wall time and output durations.
+Requires ffmpeg and ffprobe on PATH.
+
+Usage:
+    python benchmarks/bench_segment_transcode.py [--duration 300] [--segments N]
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media.convert import convert_video_format
+from media.probe import probe_media
+from media.segments import convert_video_segmented
+from media.utils import available_cores
+
+def generate_clip(path, duration):
+    """Render a 1280x720 30 fps test clip with a tone, keyframe every 2 seconds"""
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-g', '60', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-shortest', path
+    ], check=True)
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare single-pass and segmented transcoding')
+    parser.add_argument('--duration', type=int, default=300, help='Length of the synthetic clip in seconds')
+    parser.add_argument('--segments', type=int, default=None, help='Segments for the parallel encode (default: available cores)')
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg') or not shutil.which('ffprobe'):
+        print("ffmpeg and ffprobe are required")
+        sys.exit(1)
+
+    work_dir = tempfile.mkdtemp(prefix='bench_segments_')
+    try:
+        source = os.path.join(work_dir, 'source.mp4')
+        print(f"Generating {args.duration}s test clip...")
+        generate_clip(source, args.duration)
+
+        single, single_time = timed(convert_video_format, source, os.path.join(work_dir, 'single.mp4'))
+        segmented, segmented_time = timed(
+            convert_video_segmented, source, os.path.join(work_dir, 'segmented.mp4'),
+            segments=args.segments, min_duration=0
+        )
+
+        if not single or not segmented:
+            print("A conversion failed, see the log output above")
+            sys.exit(1)
+
+        single_info = probe_media(single)
+        segmented_info = probe_media(segmented)
+        print(f"cores: {available_cores()}, segments: {args.segments or available_cores()}")
+        print(f"single pass: {single_time:7.1f}s  output {single_info['duration']:.2f}s")
+        print(f"segmented  : {segmented_time:7.1f}s  output {segmented_info['duration']:.2f}s "
+              f"({single_time / segmented_time:.2f}x)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,36 @@
 #!/usr/bin/env python3
 """
-Main module for uploader package, providing command-line interface
+Main module for downloader package, providing command-line interface
 """
 import sys
 import argparse
-from .upload import upload_reel
 
 def main():
     """
-    Command-line entry point for the uploader
+    Command-line entry point for the downloader
     """
-    parser = argparse.ArgumentParser(description='Instagram Reels Uploader')
-    parser.add_argument('-v', '--video', required=True, help='Path to video file to upload')
-    parser.add_argument('-c', '--caption', default='#reels', help='Caption for the video')
+    parser = argparse.ArgumentParser(description='RedNote Video Downloader')
+    parser.add_argument('urls', nargs='+', help='RedNote note or short link URLs to download')
+    parser.add_argument('-o', '--output-dir', default='downloads', help='Directory for downloaded videos')
     parser.add_argument('-d', '--debug', action='store_true', help='Enable debug mode')
-    
+
     args = parser.parse_args()
-    
-    # Upload the video
-    upload_result = upload_reel(args.video, args.caption, debug=args.debug)
-    
-    if upload_result:
-        print(f"Upload successful! Media ID: {upload_result}")
-    else:
-        print("Upload failed!")
+
+    # Imported after parsing so --help and usage errors skip the requests import
+    from .download import download_video_from_url
+
+    # Download the videos
+    failed = 0
+    for url in args.urls:
+        video_path = download_video_from_url(url, args.output_dir, debug=args.debug)
+        if video_path:
+            print(f"Download successful! Saved to: {video_path}")
+        else:
+            print(f"Download failed: {url}")
+            failed += 1
+
+    if failed:
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Asyncio counterpart of the downloader, for resolving and fetching many notes at once
+
+aiohttp is optional and only imported when an AsyncDownloader is opened.
+"""
+import os
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+from .download import (
+    parse_video_page, make_video_filename, source_filename, forget_note, MAX_DOWNLOAD_ATTEMPTS
+)
+from .utils import extract_note_id, setup_logging
+from .session import DEFAULT_HEADERS, VIDEO_HEADERS
+from .cache import get_short_link_cache, get_note_cache
+from .hosts import get_host_scheduler
+from .streams import rank_streams
+from .ranged import IncompleteDownload, CHUNK_SIZE
+from media.mp4 import mp4_verdict
+from pipeline.metrics import timed, track
+
+# Requests in flight across all hosts
+MAX_CONCURRENCY = 200
+# Requests in flight per host, so one host is not flooded
+PER_HOST_CONCURRENCY = 8
+REQUEST_TIMEOUT = 30
+# Same retry policy as the pooled requests session
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+def _import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise ImportError("The asyncio downloader needs aiohttp, install it with: pip install aiohttp") from e
+    return aiohttp
+
+class AsyncDownloader:
+    """
+    Resolve short links, fetch note pages and download videos concurrently on one event loop
+
+    Requests are capped by a global and a per-host limit. The per-host gaps of
+    the host scheduler are awaited outside those limits, so a URL waiting for
+    its turn holds no slot and no thread. Extraction, captions, filenames and
+    caches are the ones of the synchronous downloader, so both return the same
+    results.
+
+    Use as an async context manager:
+
+        async with AsyncDownloader() as downloader:
+            paths = await downloader.download_many(urls)
+    """
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, per_host=PER_HOST_CONCURRENCY, output_dir='downloads'):
+        self.max_concurrency = max_concurrency
+        self.per_host = per_host
+        self.output_dir = output_dir
+        self._aiohttp = None
+        self._session = None
+        self._global = None
+        self._hosts = {}
+        # Numbers the files of notes whose ID cannot be read from the URL
+        self._unnamed = itertools.count(1)
+
+    async def __aenter__(self):
+        aiohttp = self._aiohttp = _import_aiohttp()
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.per_host)
+        headers = dict(DEFAULT_HEADERS)
+        # aiohttp only decodes brotli when the brotli package is installed
+        headers['Accept-Encoding'] = 'gzip, deflate'
+        self._session = aiohttp.ClientSession(
+            connector=connector, headers=headers,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=REQUEST_TIMEOUT, sock_read=REQUEST_TIMEOUT)
+        )
+        self._global = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+        self._session = None
+
+    @asynccontextmanager
+    async def _slot(self, url):
+        """Hold a global and a per-host request slot"""
+        host = urlparse(url).hostname
+        semaphore = self._hosts.get(host)
+        if semaphore is None:
+            semaphore = self._hosts[host] = asyncio.Semaphore(self.per_host)
+        async with self._global, semaphore:
+            yield
+
+    @asynccontextmanager
+    async def _request(self, method, url, **kwargs):
+        """Send a request, retrying connection errors and retryable statuses with backoff"""
+        for attempt in range(RETRIES + 1):
+            async with self._slot(url):
+                try:
+                    response = await self._session.request(method, url, **kwargs)
+                except (self._aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    if attempt == RETRIES:
+                        raise
+                    response = None
+                if response is not None:
+                    if response.status not in RETRY_STATUSES or attempt == RETRIES:
+                        try:
+                            yield response
+                        finally:
+                            response.release()
+                        return
+                    response.release()
+            await asyncio.sleep(BACKOFF_FACTOR * 2 ** attempt)
+
+    @timed('resolve', ok=lambda resolved_url: resolved_url is not None)
+    async def resolve_short_url(self, short_url, use_cache=True):
+        """Resolve a short URL to get the final destination URL"""
+        cache = get_short_link_cache() if use_cache else None
+        if cache:
+            found, resolved_url = cache.get(short_url)
+            if found:
+                logging.debug(f"Short URL cache hit: {short_url} -> {resolved_url}")
+                return resolved_url
+
+        try:
+            logging.debug(f"Resolving short URL: {short_url}")
+            await get_host_scheduler().wait_async(short_url)
+
+            async with self._request('HEAD', short_url, allow_redirects=True) as response:
+                status, resolved_url = response.status, str(response.url)
+
+            if status in (404, 410):
+                logging.error(f"Short URL no longer exists: {short_url}")
+                if cache:
+                    cache.put(short_url, None)
+                return None
+
+            note_found = extract_note_id(resolved_url) is not None
+            if not note_found and not 200 <= status < 300:
+                logging.error(f"Failed to resolve short URL: status {status}")
+                return None
+
+            logging.debug(f"Short URL resolved to: {resolved_url}")
+            if cache and note_found and 200 <= status < 300:
+                cache.put(short_url, resolved_url)
+            return resolved_url
+        except (self._aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Failed to resolve short URL: {e}")
+            return None
+
+    async def extract_video_data(self, page_url):
+        """Extract video URLs from a Xiaohongshu page"""
+        logging.info(f"Extracting video data from: {page_url}")
+
+        try:
+            await get_host_scheduler().wait_async(page_url)
+
+            with track('page_fetch') as timer:
+                async with self._request('GET', page_url) as response:
+                    logging.debug(f"Status code: {response.status}")
+                    body = await response.read()
+                    timer.add_bytes(len(body))
+                    html_content = body.decode(response.get_encoding(), errors='replace')
+                    if not response.ok:
+                        timer.fail()
+        except (self._aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error(f"Request failed: {e}")
+            return None, None
+
+        # Parsing is CPU work, keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(
+            None, parse_video_page, html_content, extract_note_id(page_url)
+        )
+
+    @timed('download', size='file')
+    async def download_video(self, url, filename=None):
+        """Download a video file from URL"""
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            filename = make_video_filename(filename or urlparse(url).path.split('/')[-1])
+            filepath = os.path.join(self.output_dir, filename)
+            part_file = f"{filepath}.part"
+
+            logging.info(f"Downloading: {filename}")
+
+            # Written in one stream, so a ranged download's progress map no longer applies
+            if os.path.exists(f"{part_file}.json"):
+                os.remove(f"{part_file}.json")
+            # Disk writes and the MP4 check block, keep them off the event loop
+            loop = asyncio.get_running_loop()
+            async with self._request('GET', url, headers=VIDEO_HEADERS) as response:
+                response.raise_for_status()
+                total_size = response.content_length
+                received = 0
+                f = await loop.run_in_executor(None, open, part_file, 'wb')
+                try:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        await loop.run_in_executor(None, f.write, chunk)
+                        received += len(chunk)
+                finally:
+                    await loop.run_in_executor(None, f.close)
+            if total_size and received != total_size:
+                raise IncompleteDownload(f"Received {received} of {total_size} bytes")
+            os.replace(part_file, filepath)
+
+            if await loop.run_in_executor(None, mp4_verdict, filepath) is False:
+                os.remove(filepath)
+                raise IncompleteDownload("MP4 is truncated or missing its moov index")
+
+            logging.info(f"Size: {os.path.getsize(filepath) / (1024 * 1024):.2f} MB")
+            logging.info(f"Download complete: {filepath}")
+            return filepath
+        except Exception as e:
+            logging.error(f"Download failed: {e}")
+            return None
+
+    async def prepare_video_source(self, url):
+        """
+        Resolve a URL to its ranked video streams and output filename without downloading
+
+        Returns:
+            tuple/None: (candidates, filename, note_id, cached) as download.prepare_video_source
+        """
+        if 'xhslink.com' in url or 't.cn' in url:
+            logging.info(f"Resolving short URL: {url}")
+            resolved_url = await self.resolve_short_url(url)
+            if not resolved_url:
+                logging.error("Failed to resolve short URL")
+                return None
+            url = resolved_url
+            logging.info(f"Resolved to: {url}")
+
+        note_id = extract_note_id(url)
+        note_cache = get_note_cache() if note_id else None
+        cached = note_cache.get(note_id) if note_cache else None
+
+        if cached:
+            streams, caption = cached
+            logging.info(f"Using cached extraction for note {note_id}")
+        else:
+            streams, caption = await self.extract_video_data(url)
+
+        if not streams:
+            logging.error("Failed to find any video URLs")
+            return None
+
+        if note_cache and not cached:
+            note_cache.put(note_id, streams, caption)
+
+        logging.info(f"Found {len(streams)} video URLs")
+        candidates = rank_streams(streams)
+        return candidates[:MAX_DOWNLOAD_ATTEMPTS], source_filename(url, caption), note_id, bool(cached)
+
+    async def download_video_from_url(self, url):
+        """Process a URL to extract and download video"""
+        source = await self.prepare_video_source(url)
+        if not source:
+            return None
+        candidates, filename, note_id, cached = source
+        # Notes without a caption all get a timestamp name, the note ID keeps their files apart
+        filename = f"{note_id}_{filename}" if note_id else f"url{next(self._unnamed)}_{filename}"
+
+        filepath = None
+        for stream in candidates:
+            filepath = await self.download_video(stream.url, filename)
+            if filepath:
+                break
+
+        if not filepath and cached:
+            # The cached stream URL may have been revoked, extract the page again next time
+            forget_note(note_id)
+        return filepath
+
+    async def download_many(self, urls):
+        """
+        Download the videos of many URLs concurrently
+
+        Returns:
+            dict: URL -> downloaded file path, or None where it failed
+        """
+        async def one(url):
+            try:
+                return await self.download_video_from_url(url)
+            except Exception as e:
+                logging.error(f"Failed to process {url}: {e}")
+                return None
+
+        # A URL listed twice would otherwise be downloaded twice into the same file
+        unique = list(dict.fromkeys(urls))
+        paths = await asyncio.gather(*(one(url) for url in unique))
+        return dict(zip(unique, paths))
+
+def download_videos(urls, output_dir='downloads', debug=False,
+                    max_concurrency=MAX_CONCURRENCY, per_host=PER_HOST_CONCURRENCY):
+    """
+    Download the videos of many URLs concurrently from synchronous code
+
+    Returns:
+        dict: URL -> downloaded file path, or None where it failed
+    """
+    setup_logging(debug)
+
+    async def run():
+        async with AsyncDownloader(max_concurrency, per_host, output_dir) as downloader:
+            return await downloader.download_many(list(urls))
+
+    return asyncio.run(run())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+On-disk caches for the downloader module
+"""
+import time
+import json
+import sqlite3
+import logging
+import threading
+from .utils import get_url_expiry, StreamRecord
+from pipeline.metrics import CACHE_LOOKUPS
+
+CACHE_FILE = 'downloader_cache.db'
+# Short links point at a fixed note, so resolutions stay valid for a long time
+SHORT_LINK_TTL = 7 * 24 * 3600
+# Dead links are remembered for less time in case they come back
+SHORT_LINK_NEGATIVE_TTL = 3600
+# Extracted stream URLs and captions of a note
+NOTE_TTL = 6 * 3600
+# Signed CDN URLs are dropped this long before they expire
+NOTE_EXPIRY_MARGIN = 300
+
+class ShortLinkCache:
+    """
+    Persistent short URL -> resolved note URL mapping with TTL and negative caching
+    """
+    def __init__(self, path=CACHE_FILE, ttl=SHORT_LINK_TTL, negative_ttl=SHORT_LINK_NEGATIVE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS short_links ('
+            'short_url TEXT PRIMARY KEY, resolved_url TEXT, expires_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def get(self, short_url):
+        """
+        Look up a short URL
+        
+        Returns:
+            tuple: (found, resolved_url) where resolved_url is None for a known dead link
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT resolved_url, expires_at FROM short_links WHERE short_url = ?', (short_url,)
+            ).fetchone()
+            
+            if row is None or row[1] < time.time():
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache='short_link', result='miss')
+                return False, None
+            
+            if row[0] is None:
+                self.negative_hits += 1
+                CACHE_LOOKUPS.inc(cache='short_link', result='negative_hit')
+            else:
+                self.hits += 1
+                CACHE_LOOKUPS.inc(cache='short_link', result='hit')
+            return True, row[0]
+
+    def put(self, short_url, resolved_url):
+        """
+        Store a resolution, or a dead link when resolved_url is None
+        """
+        ttl = self.ttl if resolved_url else self.negative_ttl
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO short_links (short_url, resolved_url, expires_at) VALUES (?, ?, ?)',
+                (short_url, resolved_url, time.time() + ttl)
+            )
+            self._conn.commit()
+
+    def purge_expired(self):
+        """
+        Delete expired entries and return how many were removed
+        """
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM short_links WHERE expires_at < ?', (time.time(),))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self):
+        """
+        Get the hit/miss counters for this process
+        """
+        return {'hits': self.hits, 'negative_hits': self.negative_hits, 'misses': self.misses}
+
+class NoteCache:
+    """
+    Persistent note ID -> extracted streams and caption mapping
+    
+    Entries expire after the TTL or shortly before the earliest signed CDN URL
+    they contain stops working, whichever comes first.
+    """
+    def __init__(self, path=CACHE_FILE, ttl=NOTE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS notes ('
+            'note_id TEXT PRIMARY KEY, video_urls TEXT NOT NULL, caption TEXT, expires_at REAL NOT NULL)'
+        )
+        self._conn.commit()
+
+    def get(self, note_id):
+        """
+        Look up a note
+        
+        Returns:
+            tuple/None: (streams, caption) if cached and not expired, None otherwise
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT video_urls, caption, expires_at FROM notes WHERE note_id = ?', (note_id,)
+            ).fetchone()
+            
+            if row is None or row[2] < time.time():
+                self.misses += 1
+                CACHE_LOOKUPS.inc(cache='note', result='miss')
+                return None
+            
+            self.hits += 1
+            CACHE_LOOKUPS.inc(cache='note', result='hit')
+            streams = [
+                StreamRecord(**entry) if isinstance(entry, dict) else StreamRecord(entry, None, None, None, None, None, None)
+                for entry in json.loads(row[0])
+            ]
+            return streams, row[1]
+
+    def put(self, note_id, streams, caption):
+        """
+        Store the extraction result of a note
+        """
+        expires_at = time.time() + self.ttl
+        for stream in streams:
+            url_expiry = get_url_expiry(stream.url)
+            if url_expiry:
+                expires_at = min(expires_at, url_expiry - NOTE_EXPIRY_MARGIN)
+        
+        if expires_at <= time.time():
+            return
+        
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO notes (note_id, video_urls, caption, expires_at) VALUES (?, ?, ?, ?)',
+                (note_id, json.dumps([stream._asdict() for stream in streams]), caption, expires_at)
+            )
+            self._conn.commit()
+
+    def delete(self, note_id):
+        """
+        Forget a note, e.g. after its cached stream URLs stopped working
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM notes WHERE note_id = ?', (note_id,))
+            self._conn.commit()
+
+    def purge_expired(self):
+        """
+        Delete expired entries and return how many were removed
+        """
+        with self._lock:
+            cursor = self._conn.execute('DELETE FROM notes WHERE expires_at < ?', (time.time(),))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self):
+        """
+        Get the hit/miss counters for this process
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+_short_link_cache = None
+_note_cache = None
+_cache_lock = threading.Lock()
+
+def get_short_link_cache():
+    """
+    Get the process-wide short-link cache, or None if the cache file cannot be opened
+    """
+    global _short_link_cache
+    with _cache_lock:
+        if _short_link_cache is None:
+            try:
+                _short_link_cache = ShortLinkCache()
+            except sqlite3.Error as e:
+                logging.warning(f"Short-link cache unavailable: {e}")
+                return None
+        return _short_link_cache
+
+def get_note_cache():
+    """
+    Get the process-wide note cache, or None if the cache file cannot be opened
+    """
+    global _note_cache
+    with _cache_lock:
+        if _note_cache is None:
+            try:
+                _note_cache = NoteCache()
+            except sqlite3.Error as e:
+                logging.warning(f"Note cache unavailable: {e}")
+                return None
+        return _note_cache
@@ -8,101 +8,102 @@ import time
 import json
 import logging
 import requests
-import random
 from urllib.parse import urlparse
-from .utils import clean_url, setup_logging, find_video_urls_in_text, find_video_urls_in_json
+from .utils import (
+    clean_url, setup_logging, find_video_urls_in_text, find_video_urls_in_json, extract_note_id,
+    is_valid_caption, format_caption, StreamRecord
+)
+from .extract import parse_initial_state
+from .session import get_session, VIDEO_HEADERS
+from .ranged import download_ranged, IncompleteDownload
+from .cache import get_short_link_cache, get_note_cache
+from .hosts import get_host_scheduler
+from pipeline.metrics import timed, track
+from .streams import rank_streams
+from media.mp4 import mp4_verdict
 
-def resolve_short_url(short_url):
+# Stream candidates tried per note before giving up
+MAX_DOWNLOAD_ATTEMPTS = 3
+
+@timed('resolve', ok=lambda resolved_url: resolved_url is not None)
+def resolve_short_url(short_url, use_cache=True):
     """Resolve a short URL to get the final destination URL"""
+    cache = get_short_link_cache() if use_cache else None
+    if cache:
+        found, resolved_url = cache.get(short_url)
+        if found:
+            logging.debug(f"Short URL cache hit: {short_url} -> {resolved_url}")
+            return resolved_url
+    
     try:
         logging.debug(f"Resolving short URL: {short_url}")
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Sec-Fetch-Dest': 'document',
-            'Sec-Fetch-Mode': 'navigate',
-            'Sec-Fetch-Site': 'none',
-            'Sec-Fetch-User': '?1',
-            'Cache-Control': 'max-age=0',
-            'sec-ch-ua': '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"',
-            'sec-ch-ua-mobile': '?0',
-            'sec-ch-ua-platform': '"Windows"',
-            'Referer': 'https://www.xiaohongshu.com/',
-            'Cookie': 'xhsTrackerId=cebd0c81-0c81-0c81-0c81-0c810c810c81; xhsuid=0c810c810c810c81; timestamp2=0c810c810c810c81; timestamp2.sig=0c810c810c810c81'
-        }
+        # Keep a random gap to the previous request to this host
+        get_host_scheduler().wait(short_url)
+        
+        response = get_session().head(short_url, allow_redirects=True, timeout=30)
         
-        # Add a random delay to mimic human behavior
-        time.sleep(random.uniform(1, 3))
+        if response.status_code in (404, 410):
+            # The link is dead, remember that so it is not retried on every pass
+            logging.error(f"Short URL no longer exists: {short_url}")
+            if cache:
+                cache.put(short_url, None)
+            return None
+        
+        note_found = extract_note_id(response.url) is not None
+        if not note_found and not 200 <= response.status_code < 300:
+            # Retries ran out on a server error or throttling, try again on a later pass
+            logging.error(f"Failed to resolve short URL: status {response.status_code}")
+            return None
         
-        response = requests.head(short_url, headers=headers, allow_redirects=True, timeout=30)
         logging.debug(f"Short URL resolved to: {response.url}")
+        # Only a note page that answered is remembered, not a captcha or login page or an error
+        if cache and note_found and 200 <= response.status_code < 300:
+            cache.put(short_url, response.url)
         return response.url
     except requests.RequestException as e:
         logging.error(f"Failed to resolve short URL: {e}")
         return None
 
+# Fallback patterns for pages without a parsable __INITIAL_STATE__
+JSON_BLOCK_PATTERNS = [re.compile(pattern, re.DOTALL) for pattern in [
+    r'<script>window\.__INITIAL_STATE__\s*=\s*({.*?});</script>',
+    r'<script>window\.__REDUX_STATE__\s*=\s*({.*?});</script>',
+    r'"video"\s*:\s*({.*?}),\s*"image"',
+    r'"stream"\s*:\s*({.*?})\s*}',
+    r'{"h265":(\[.*?\]),"h266"',
+    r'{"h264":(\[.*?\]),"h265"',
+    r'{"stream":({.*?}),"image"',
+]]
+
+STREAM_PATTERNS = [re.compile(pattern, re.DOTALL) for pattern in [
+    r'"stream"\s*:\s*({.*?}),\s*"image"',
+    r'"h265"\s*:\s*(\[.*?\]),\s*"h266"',
+    r'"h264"\s*:\s*(\[.*?\])'
+]]
+
+TITLE_PATTERN = re.compile(r'<div id="detail-title" class="title"[^>]*>(.*?)</div>', re.DOTALL)
+DESC_PATTERN = re.compile(r'<div id="detail-desc" class="desc"[^>]*>.*?<span class="note-text"[^>]*>.*?<span[^>]*>(.*?)</span>', re.DOTALL)
+HASHTAG_PATTERN = re.compile(r'<a[^>]*class="tag"[^>]*>#([^<]+)</a>')
+
 def extract_json_blocks(html_content):
     """Extract all potential JSON blocks from the HTML content"""
     json_blocks = []
     
     # Try to find JSON blocks with various patterns
-    patterns = [
-        r'<script>window\.__INITIAL_STATE__\s*=\s*({.*?});</script>',
-        r'<script>window\.__REDUX_STATE__\s*=\s*({.*?});</script>',
-        r'"video"\s*:\s*({.*?}),\s*"image"',
-        r'"stream"\s*:\s*({.*?})\s*}',
-        r'{"h265":(\[.*?\]),"h266"',
-        r'{"h264":(\[.*?\]),"h265"',
-        r'{"stream":({.*?}),"image"',
-    ]
-    
-    for pattern in patterns:
-        matches = re.finditer(pattern, html_content, re.DOTALL)
+    for pattern in JSON_BLOCK_PATTERNS:
+        matches = pattern.finditer(html_content)
         for match in matches:
             json_blocks.append(match.group(1))
     
     return json_blocks
 
-def is_valid_caption(caption):
-    """
-    Check if the caption is valid and not a default/invalid value
-    """
-    if not caption:
-        return False
-        
-    # List of invalid/default captions to filter out
-    invalid_captions = [
-        'xhs_www.xiaohongshu.com',
-        'hs_www.xiaohongshu.com',
-        'www.xiaohongshu.com',
-        'xiaohongshu.com',
-        'xhs_video_',
-        'xhs_'
-    ]
-    
-    # Check if caption matches any invalid pattern
-    for invalid in invalid_captions:
-        if invalid in caption:
-            return False
-    
-    # Check if caption is too short or just numbers
-    if len(caption) < 2 or caption.isdigit():
-        return False
-        
-    return True
-
 def extract_video_caption(html_content):
     """Extract video caption/title and hashtags from HTML"""
     caption = None
     hashtags = []
     
     # First try to get title from detail-title
-    title_pattern = r'<div id="detail-title" class="title"[^>]*>(.*?)</div>'
-    title_match = re.search(title_pattern, html_content, re.DOTALL)
+    title_match = TITLE_PATTERN.search(html_content)
     if title_match:
         caption = title_match.group(1).strip()
         if not is_valid_caption(caption):
@@ -110,133 +111,142 @@ def extract_video_caption(html_content):
     
     # If no valid title found, try to get caption from detail-desc
     if not caption:
-        desc_pattern = r'<div id="detail-desc" class="desc"[^>]*>.*?<span class="note-text"[^>]*>.*?<span[^>]*>(.*?)</span>'
-        desc_match = re.search(desc_pattern, html_content, re.DOTALL)
+        desc_match = DESC_PATTERN.search(html_content)
         if desc_match:
             caption = desc_match.group(1).strip()
             if not is_valid_caption(caption):
                 caption = None
     
     # Extract hashtags from tag links
-    hashtag_pattern = r'<a[^>]*class="tag"[^>]*>#([^<]+)</a>'
-    hashtag_matches = re.finditer(hashtag_pattern, html_content)
+    hashtag_matches = HASHTAG_PATTERN.finditer(html_content)
     for match in hashtag_matches:
         hashtag = match.group(1).strip()
         if hashtag:
             hashtags.append(f"#{hashtag}")
     
-    # If we have a valid caption or hashtags, combine them
-    if is_valid_caption(caption) or hashtags:
-        # Clean up caption
-        if caption:
-            # Remove any existing hashtags from caption
-            caption = re.sub(r'#\w+\s*', '', caption).strip()
-            # Remove any special characters that might cause issues
-            caption = re.sub(r'[\\/*?:"<>|]', '', caption)
-            # Replace multiple spaces with single space
-            caption = re.sub(r'\s+', ' ', caption).strip()
-        
-        # Combine caption and hashtags
-        if caption and hashtags:
-            final_caption = f"{caption} {' '.join(hashtags)}"
-        elif caption:
-            final_caption = caption
-        else:
-            final_caption = ' '.join(hashtags)
-        
+    final_caption = format_caption(caption, hashtags)
+    if final_caption:
         logging.debug(f"Found caption: {final_caption}")
-        return final_caption
+    return final_caption
+
+def parse_video_page_regex(html_content):
+    """Extract video streams and caption from page HTML by scanning it with regexes"""
+    # First, try direct regex extraction from raw HTML
+    video_urls = find_video_urls_in_text(html_content)
+    
+    # Extract all potential JSON blocks
+    json_blocks = extract_json_blocks(html_content)
+    logging.debug(f"Found {len(json_blocks)} potential JSON blocks")
     
-    return None
+    all_video_urls = set(video_urls)
+    
+    # Try to parse each JSON block
+    for i, block in enumerate(json_blocks):
+        try:
+            # Clean up the JSON string
+            block = block.replace('\\"', '"').replace("\\'", "'")
+            json_data = json.loads(block)
+            
+            # Find videos in this JSON block
+            found_streams = find_video_urls_in_json(json_data)
+            all_video_urls.update(stream.url for stream in found_streams)
+        except json.JSONDecodeError:
+            continue
+    
+    # Try to find stream data specifically in the HTML content
+    for pattern in STREAM_PATTERNS:
+        matches = pattern.search(html_content)
+        if matches:
+            try:
+                stream_data = matches.group(1)
+                clean_data = stream_data.replace('\\"', '"').replace("\\'", "'").replace('\\u002F', '/')
+                
+                # Try to extract video URLs directly from this data
+                more_urls = find_video_urls_in_text(clean_data)
+                all_video_urls.update(more_urls)
+            except Exception:
+                continue
+    
+    # Try to extract video caption/title for filename
+    caption = extract_video_caption(html_content)
+    
+    # The raw HTML carries no reliable per-URL metadata
+    return [StreamRecord(url, None, None, None, None, None, None) for url in all_video_urls], caption
+
+@timed('extract', ok=lambda result: bool(result[0]))
+def parse_video_page(html_content, note_id=None):
+    """
+    Extract video streams and caption from page HTML
+    
+    The embedded __INITIAL_STATE__ is decoded once and read directly; the regex
+    scan only runs when the state is missing or holds no video streams.
+    
+    Returns:
+        tuple: (streams, caption) where streams is a list of StreamRecord
+    """
+    result = parse_initial_state(html_content, note_id)
+    if result and result[0]:
+        streams, caption = result
+        if caption is None:
+            caption = extract_video_caption(html_content)
+        return streams, caption
+    
+    logging.debug("No video streams in __INITIAL_STATE__, falling back to regex scan")
+    return parse_video_page_regex(html_content)
 
 def extract_video_data(page_url):
     """Extract video URLs from a Xiaohongshu page"""
     logging.info(f"Extracting video data from: {page_url}")
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
-        'Accept-Language': 'en-US,en;q=0.9',
-        'Accept-Encoding': 'gzip, deflate, br',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
-        'Sec-Fetch-Dest': 'document',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-Site': 'none',
-        'Sec-Fetch-User': '?1',
-        'Cache-Control': 'max-age=0',
-        'sec-ch-ua': '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"',
-        'sec-ch-ua-mobile': '?0',
-        'sec-ch-ua-platform': '"Windows"',
-        'Referer': 'https://www.xiaohongshu.com/',
-        'Cookie': 'xhsTrackerId=cebd0c81-0c81-0c81-0c81-0c810c810c81; xhsuid=0c810c810c810c81; timestamp2=0c810c810c810c81; timestamp2.sig=0c810c810c810c81'
-    }
     
     try:
-        # Add a random delay to mimic human behavior
-        time.sleep(random.uniform(2, 5))
+        # Keep a random gap to the previous request to this host
+        get_host_scheduler().wait(page_url)
         
-        response = requests.get(page_url, headers=headers, timeout=30)
+        with track('page_fetch') as timer:
+            response = get_session().get(page_url, timeout=30)
+            timer.add_bytes(len(response.content))
+            if not response.ok:
+                timer.fail()
         logging.debug(f"Status code: {response.status_code}")
         
-        # First, try direct regex extraction from raw HTML
-        video_urls = find_video_urls_in_text(response.text)
-        
-        # Extract all potential JSON blocks
-        json_blocks = extract_json_blocks(response.text)
-        logging.debug(f"Found {len(json_blocks)} potential JSON blocks")
-        
-        all_video_urls = set(video_urls)
-        
-        # Try to parse each JSON block
-        for i, block in enumerate(json_blocks):
-            try:
-                # Clean up the JSON string
-                block = block.replace('\\"', '"').replace("\\'", "'")
-                json_data = json.loads(block)
-                
-                # Find videos in this JSON block
-                found_urls = find_video_urls_in_json(json_data)
-                all_video_urls.update(found_urls)
-            except json.JSONDecodeError:
-                continue
-        
-        # Try to find stream data specifically in the HTML content
-        stream_patterns = [
-            r'"stream"\s*:\s*({.*?}),\s*"image"',
-            r'"h265"\s*:\s*(\[.*?\]),\s*"h266"',
-            r'"h264"\s*:\s*(\[.*?\])'
-        ]
-        
-        for pattern in stream_patterns:
-            matches = re.search(pattern, response.text, re.DOTALL)
-            if matches:
-                try:
-                    stream_data = matches.group(1)
-                    clean_data = stream_data.replace('\\"', '"').replace("\\'", "'").replace('\\u002F', '/')
-                    
-                    # Try to extract video URLs directly from this data
-                    more_urls = find_video_urls_in_text(clean_data)
-                    all_video_urls.update(more_urls)
-                except Exception:
-                    continue
-        
-        # Try to extract video caption/title for filename
-        caption = extract_video_caption(response.text)
-        
-        return list(all_video_urls), caption
+        return parse_video_page(response.text, extract_note_id(page_url))
         
     except requests.RequestException as e:
         logging.error(f"Request failed: {e}")
         return None, None
 
+def make_video_filename(filename):
+    """Add the .mp4 extension and strip characters that are invalid in filenames"""
+    # Add file extension if missing
+    if not filename.endswith('.mp4'):
+        filename += '.mp4'
+    
+    # Make sure filename is valid
+    return re.sub(r'[\\/*?:"<>|]', '', filename)  # Remove invalid characters
+
+def iter_video_chunks(url, chunk_size=64 * 1024):
+    """
+    Stream a video from the CDN chunk by chunk over the shared session
+    
+    Raises:
+        IncompleteDownload: If the body ends before Content-Length bytes arrived
+        requests.RequestException: On HTTP errors
+    """
+    with get_session().get(url, headers=VIDEO_HEADERS, stream=True, timeout=30) as r:
+        r.raise_for_status()
+        total_size = int(r.headers.get('content-length', 0))
+        received = 0
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            if chunk:
+                received += len(chunk)
+                yield chunk
+        if total_size and received != total_size:
+            raise IncompleteDownload(f"Received {received} of {total_size} bytes")
+
+@timed('download', size='file')
 def download_video(url, filename=None, output_dir='downloads'):
     """Download a video file from URL"""
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Referer': 'https://www.xiaohongshu.com/'
-        }
-        
         # Create downloads directory if it doesn't exist
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
@@ -247,43 +257,36 @@ def download_video(url, filename=None, output_dir='downloads'):
             path_parts = parsed_url.path.split('/')
             filename = path_parts[-1]
         
-        # Add file extension if missing
-        if not filename.endswith('.mp4'):
-            filename += '.mp4'
-        
-        # Make sure filename is valid
-        filename = re.sub(r'[\\/*?:"<>|]', '', filename)  # Remove invalid characters
+        filename = make_video_filename(filename)
         
         filepath = os.path.join(output_dir, filename)
         
-        # Download with progress reporting
-        with requests.get(url, headers=headers, stream=True) as r:
-            r.raise_for_status()
-            total_size = int(r.headers.get('content-length', 0))
-            
-            logging.info(f"Downloading: {filename}")
-            logging.info(f"Size: {total_size / (1024 * 1024):.2f} MB")
-            
-            with open(filepath, 'wb') as f:
-                downloaded = 0
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0:
-                            progress = int(50 * downloaded / total_size)
-                            progress_bar = f"[{'=' * progress}{' ' * (50 - progress)}] {downloaded / total_size:.1%}"
-                            logging.debug(progress_bar)
-            
-            logging.info(f"Download complete: {filepath}")
-            return filepath
+        logging.info(f"Downloading: {filename}")
+        
+        # Parallel ranged download into a .part file, resumed if an earlier attempt was interrupted
+        download_ranged(url, filepath, headers=VIDEO_HEADERS)
+        
+        # A matching byte count can still hide a cut-off body, check the MP4 structure too
+        if mp4_verdict(filepath) is False:
+            os.remove(filepath)
+            raise IncompleteDownload("MP4 is truncated or missing its moov index")
+        
+        logging.info(f"Size: {os.path.getsize(filepath) / (1024 * 1024):.2f} MB")
+        logging.info(f"Download complete: {filepath}")
+        return filepath
             
     except Exception as e:
         logging.error(f"Download failed: {e}")
         return None
 
-def download_video_from_url(url, output_dir='downloads', debug=False):
-    """Process a URL to extract and download video"""
+def prepare_video_source(url, debug=False):
+    """
+    Resolve a URL to its ranked video streams and output filename without downloading
+    
+    Returns:
+        tuple/None: (candidates, filename, note_id, cached) where candidates are
+                    StreamRecords best first, or None if no video was found
+    """
     # Setup logging
     setup_logging(debug)
     
@@ -297,33 +300,91 @@ def download_video_from_url(url, output_dir='downloads', debug=False):
         url = resolved_url
         logging.info(f"Resolved to: {url}")
     
-    # Extract video data
-    video_urls, caption = extract_video_data(url)
+    # Reuse an earlier extraction of the same note if it has not expired
+    note_id = extract_note_id(url)
+    note_cache = get_note_cache() if note_id else None
+    cached = note_cache.get(note_id) if note_cache else None
+    
+    if cached:
+        streams, caption = cached
+        logging.info(f"Using cached extraction for note {note_id}")
+    else:
+        # Extract video data
+        streams, caption = extract_video_data(url)
     
-    if not video_urls or len(video_urls) == 0:
+    if not streams or len(streams) == 0:
         logging.error("Failed to find any video URLs")
         return None
     
-    logging.info(f"Found {len(video_urls)} video URLs")
+    if note_cache and not cached:
+        note_cache.put(note_id, streams, caption)
     
-    # Use the first video URL (highest quality usually)
-    selected_url = video_urls[0]
+    logging.info(f"Found {len(streams)} video URLs")
     
-    # Generate filename
+    # Prefer the variant closest to the Instagram target so less has to be downloaded and re-encoded
+    candidates = rank_streams(streams)
+    
+    return candidates[:MAX_DOWNLOAD_ATTEMPTS], source_filename(url, caption), note_id, bool(cached)
+
+def source_filename(url, caption):
+    """Pick the output filename (without extension) for a note from its caption or URL"""
     if caption and is_valid_caption(caption):
         # Use first 50 chars of caption for filename
-        filename = caption[:50]
-    else:
-        # Extract video ID from URL
-        match = re.search(r'/([^/]+)', url)
-        if match:
-            video_id = match.group(1)
-            if is_valid_caption(video_id):
-                filename = f"xhs_{video_id}"
-            else:
-                filename = f"xhs_video_{int(time.time())}"
-        else:
-            filename = f"xhs_video_{int(time.time())}"
-    
-    # Download the video
-    return download_video(selected_url, filename, output_dir)
\ No newline at end of file
+        return caption[:50]
+    # Extract video ID from URL
+    match = re.search(r'/([^/]+)', url)
+    if match:
+        video_id = match.group(1)
+        if is_valid_caption(video_id):
+            return f"xhs_{video_id}"
+    return f"xhs_video_{int(time.time())}"
+
+def resolve_note_id(url):
+    """
+    Get the note ID behind a URL, resolving short links through the cache
+    
+    Tracking parameters and different short links of the same note all map
+    to the same ID.
+    
+    Returns:
+        str/None: The note ID, or None if it cannot be determined
+    """
+    if 'xhslink.com' in url or 't.cn' in url:
+        url = resolve_short_url(url)
+        if not url:
+            return None
+    return extract_note_id(url)
+
+def forget_note(note_id):
+    """
+    Drop a note's cached extraction, e.g. after all its cached stream URLs failed
+    """
+    note_cache = get_note_cache() if note_id else None
+    if note_cache:
+        note_cache.delete(note_id)
+
+def download_video_from_url(url, output_dir='downloads', debug=False, prefix=''):
+    """
+    Process a URL to extract and download video
+    
+    Args:
+        prefix (str): Put before the filename, so concurrent downloads of notes
+                      with the same caption do not share a file
+    """
+    source = prepare_video_source(url, debug=debug)
+    if not source:
+        return None
+    candidates, filename, note_id, cached = source
+    filename = f"{prefix}{filename}"
+    
+    # Download the video, falling back to the next candidate if a URL fails
+    filepath = None
+    for stream in candidates:
+        filepath = download_video(stream.url, filename, output_dir)
+        if filepath:
+            break
+    
+    if not filepath and cached:
+        # The cached stream URL may have been revoked, extract the page again next time
+        forget_note(note_id)
+    return filepath
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Single-pass extraction of video streams and captions from a note page's __INITIAL_STATE__
+"""
+import re
+import json
+import logging
+from .utils import is_valid_caption, format_caption, find_video_urls_in_json
+
+INITIAL_STATE_MARKER = 'window.__INITIAL_STATE__'
+NOTE_DETAIL_KEY = '"noteDetailMap"'
+# Topic markers in note descriptions, e.g. "#travel[话题]#"
+TOPIC_PATTERN = re.compile(r'#[^#\s]+\[[^\]]*\]#')
+# A bare `undefined` value, which may still turn out to be inside a string
+UNDEFINED_PATTERN = re.compile(r'undefined(?=\s*[,}\]])')
+
+_decoder = json.JSONDecoder()
+
+def _state_bounds(html_content):
+    """Get the (start, end) offsets of the __INITIAL_STATE__ object literal"""
+    marker = html_content.find(INITIAL_STATE_MARKER)
+    if marker == -1:
+        return None
+    start = html_content.find('{', marker + len(INITIAL_STATE_MARKER))
+    end = html_content.find('</script>', start)
+    if start == -1 or end == -1:
+        return None
+    return start, end
+
+def _unescaped_quotes(blob, start, end):
+    """Count the string delimiters in blob[start:end], i.e. quotes after an even run of backslashes"""
+    count = blob.count('"', start, end)
+    sign, run = -1, '\\"'
+    while True:
+        escaped = blob.count(run, start, end)
+        if not escaped:
+            return count
+        count += sign * escaped
+        sign, run = -sign, '\\' + run
+
+def _null_undefined(blob):
+    """
+    Replace the bare `undefined` values of serialized JavaScript with null
+    
+    Only tokens outside string literals are replaced, so captions mentioning
+    "undefined" are untouched. Whether a token is inside a string follows from
+    the parity of the quotes before it, which str.count finds without walking
+    the blob in Python.
+    """
+    pieces = []
+    last = scanned = 0
+    inside = False
+    for match in UNDEFINED_PATTERN.finditer(blob):
+        position = match.start()
+        inside ^= _unescaped_quotes(blob, scanned, position) % 2 == 1
+        scanned = position
+        if inside:
+            continue
+        before = position - 1
+        while before > 0 and blob[before].isspace():
+            before -= 1
+        if blob[before] not in ':,[':
+            continue
+        pieces.append(blob[last:position])
+        pieces.append('null')
+        last = match.end()
+    pieces.append(blob[last:])
+    return ''.join(pieces)
+
+def _decode_object(html_content, start, end):
+    """Decode the JSON object starting at `start`, ignoring anything after it"""
+    blob = html_content[start:end]
+    # The state is serialized JavaScript, which may contain bare `undefined` values
+    if 'undefined' in blob:
+        blob = _null_undefined(blob)
+    return _decoder.raw_decode(blob)[0]
+
+def find_initial_state(html_content):
+    """
+    Locate and decode the whole __INITIAL_STATE__ object of a page
+    
+    Returns:
+        dict/None: Decoded state, or None if the page has none or it is not valid JSON
+    """
+    bounds = _state_bounds(html_content)
+    if bounds is None:
+        return None
+    try:
+        return _decode_object(html_content, *bounds)
+    except ValueError as e:
+        logging.debug(f"Could not decode __INITIAL_STATE__: {e}")
+        return None
+
+def find_note_detail_map(html_content, bounds=None):
+    """
+    Decode only the note.noteDetailMap part of the page state
+    
+    The recommendation feed and other page state are usually larger than the note
+    itself, so skipping them roughly halves the decode cost.
+    
+    Returns:
+        dict/None: Note ID -> note detail, or None if the map is missing or not valid JSON
+    """
+    bounds = bounds or _state_bounds(html_content)
+    if bounds is None:
+        return None
+    start, end = bounds
+    key = html_content.find(NOTE_DETAIL_KEY, start, end)
+    if key == -1:
+        return None
+    brace = html_content.find('{', key + len(NOTE_DETAIL_KEY), end)
+    if brace == -1:
+        return None
+    try:
+        detail_map = _decode_object(html_content, brace, end)
+    except ValueError as e:
+        logging.debug(f"Could not decode noteDetailMap: {e}")
+        return None
+    return detail_map if isinstance(detail_map, dict) else None
+
+def find_note(state, note_id=None):
+    """
+    Get the note object from the decoded state
+    
+    Args:
+        state (dict): Decoded __INITIAL_STATE__
+        note_id (str): Preferred note ID, if known from the URL
+    
+    Returns:
+        dict/None: Note object holding title, desc, tagList and video
+    """
+    note_state = state.get('note') if isinstance(state, dict) else None
+    if not isinstance(note_state, dict):
+        return None
+    
+    detail_map = note_state.get('noteDetailMap')
+    if isinstance(detail_map, dict) and detail_map:
+        for key in (note_id, note_state.get('currentNoteId'), note_state.get('firstNoteId')):
+            detail = detail_map.get(key) if key else None
+            if isinstance(detail, dict) and isinstance(detail.get('note'), dict):
+                return detail['note']
+        for detail in detail_map.values():
+            if isinstance(detail, dict) and isinstance(detail.get('note'), dict) and detail['note'].get('video'):
+                return detail['note']
+    
+    # Older page layouts keep the note directly under state.note
+    if isinstance(note_state.get('note'), dict):
+        return note_state['note']
+    if isinstance(note_state.get('video'), dict):
+        return note_state
+    return None
+
+def extract_note_streams(note):
+    """
+    Get the video streams of a note, in the order the page lists them
+    
+    Returns:
+        list: StreamRecord per unique URL
+    """
+    return find_video_urls_in_json(note)
+
+def extract_note_caption(note):
+    """
+    Build the caption of a note from its title, description and tags
+    
+    Returns:
+        str/None: Caption in the same format as the HTML caption extraction
+    """
+    caption = (note.get('title') or '').strip()
+    if not is_valid_caption(caption):
+        caption = TOPIC_PATTERN.sub('', note.get('desc') or '').strip()
+        if not is_valid_caption(caption):
+            caption = None
+    
+    hashtags = []
+    for tag in note.get('tagList') or []:
+        name = tag.get('name', '').strip() if isinstance(tag, dict) else ''
+        if name:
+            hashtags.append(f"#{name}")
+    
+    return format_caption(caption, hashtags)
+
+def parse_initial_state(html_content, note_id=None):
+    """
+    Extract video streams and caption from the page state in a single decode
+    
+    Returns:
+        tuple/None: (streams, caption), or None if the page has no usable state
+    """
+    bounds = _state_bounds(html_content)
+    if bounds is None:
+        return None
+    
+    note = None
+    detail_map = find_note_detail_map(html_content, bounds)
+    if detail_map:
+        note = find_note({'note': {'noteDetailMap': detail_map}}, note_id)
+    
+    if note is None:
+        # Unknown layout, decode the whole state instead
+        state = find_initial_state(html_content)
+        note = find_note(state, note_id) if state is not None else None
+    
+    if note is None:
+        return None
+    
+    return extract_note_streams(note), extract_note_caption(note)
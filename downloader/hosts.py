@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Per-host request pacing for the downloader
+"""
+import time
+import random
+import threading
+from urllib.parse import urlparse
+from pipeline.metrics import HOST_DELAY
+
+# Randomized gap in seconds between two requests to a host, to mimic human behaviour.
+# A host matches its own entry or that of a parent domain; other hosts (the CDN) are not paced.
+HOST_DELAYS = {
+    'xhslink.com': (1.0, 3.0),
+    'xiaohongshu.com': (2.0, 5.0),
+}
+
+class _HostState:
+    def __init__(self):
+        self.next_slot = 0.0
+        self.requests = 0
+        self.delayed = 0
+        self.total_delay = 0.0
+        self.max_delay = 0.0
+
+class HostScheduler:
+    """
+    Space out the requests to each host by a random gap, leaving other hosts alone
+
+    Each request reserves the next free slot of its host, at least a random
+    gap after the previous reservation, and waits only until then. Subdomains
+    share the slots of the domain they are configured under. Requests to
+    different hosts never wait for each other, the first request to a host
+    goes out at once, and callers that were busy elsewhere for longer than the
+    gap do not wait at all.
+    """
+    def __init__(self, delays=None):
+        self.delays = dict(HOST_DELAYS if delays is None else delays)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def configure(self, host, low, high=None):
+        """
+        Set the gap range of a host (and its subdomains); a range of 0 turns pacing off
+        """
+        with self._lock:
+            self.delays[host] = (low, low if high is None else high)
+
+    def delay_range(self, host):
+        """
+        Get the configured domain and gap range that apply to a host
+
+        Returns:
+            tuple: (domain, (low, high)), or (host, None) if it is not paced
+        """
+        host = (host or '').lower()
+        domain = host
+        while domain:
+            if domain in self.delays:
+                low, high = self.delays[domain]
+                return domain, ((low, high) if high > 0 else None)
+            domain = domain.partition('.')[2]
+        return host, None
+
+    def reserve(self, url):
+        """
+        Reserve the next request slot of a URL's host
+
+        Returns:
+            float: Seconds to wait before sending the request
+        """
+        host, delay_range = self.delay_range(urlparse(url).hostname)
+        now = time.monotonic()
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = _HostState()
+            state.requests += 1
+            if delay_range is None:
+                return 0.0
+            slot = max(now, state.next_slot)
+            state.next_slot = slot + random.uniform(*delay_range)
+            delay = slot - now
+            HOST_DELAY.observe(delay, host=host)
+            if delay > 0:
+                state.delayed += 1
+                state.total_delay += delay
+                state.max_delay = max(state.max_delay, delay)
+        return delay
+
+    def wait(self, url):
+        """
+        Block until a request to the URL's host may be sent
+
+        Returns:
+            float: Seconds waited
+        """
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    async def wait_async(self, url):
+        """
+        Wait on the event loop until a request to the URL's host may be sent
+
+        Returns:
+            float: Seconds waited
+        """
+        import asyncio
+
+        delay = self.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def stats(self):
+        """
+        Get the requests, delayed requests and delay totals of each paced domain or other host
+        """
+        with self._lock:
+            return {
+                host: {
+                    'requests': state.requests, 'delayed': state.delayed,
+                    'total_delay': state.total_delay, 'max_delay': state.max_delay,
+                }
+                for host, state in self._hosts.items()
+            }
+
+_host_scheduler = None
+_host_scheduler_lock = threading.Lock()
+
+def get_host_scheduler():
+    """
+    Get the downloader-wide host scheduler
+    """
+    global _host_scheduler
+    with _host_scheduler_lock:
+        if _host_scheduler is None:
+            _host_scheduler = HostScheduler()
+        return _host_scheduler
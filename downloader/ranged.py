@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Resumable, multi-connection ranged downloads
+"""
+import os
+import re
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .session import get_session
+
+# Parallel Range requests per file
+SEGMENTS = 4
+# Files smaller than this are not worth splitting
+MIN_SEGMENT_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# Persist the progress map after this many new bytes per segment
+PROGRESS_FLUSH_BYTES = 1024 * 1024
+# Attempts per segment before the whole download is given up (progress is kept)
+SEGMENT_RETRIES = 3
+
+class IncompleteDownload(Exception):
+    """Raised when a download ends before all bytes were received"""
+
+def probe_download(url, headers=None, session=None):
+    """
+    Find the size of a remote file and whether the server honours Range requests
+    
+    A server that ignores the Range header answers with the whole file, so that
+    response is handed back still open to be streamed instead of requesting the
+    file a second time. The caller must close it.
+    
+    Returns:
+        tuple: (total_size or None, supports_ranges, the open full response or None)
+    """
+    session = session or get_session()
+    probe_headers = dict(headers or {})
+    probe_headers['Range'] = 'bytes=0-0'
+    
+    r = session.get(url, headers=probe_headers, stream=True, timeout=30)
+    try:
+        r.raise_for_status()
+        if r.status_code == 206:
+            # Read the single byte so the connection goes back to the pool
+            r.content
+            r.close()
+            match = re.match(r'bytes\s+\d+-\d+/(\d+)', r.headers.get('content-range', ''))
+            return (int(match.group(1)), True, None) if match else (None, False, None)
+        length = r.headers.get('content-length')
+        return (int(length) if length else None), False, r
+    except Exception:
+        r.close()
+        raise
+
+def _load_progress(progress_file, total_size):
+    """Load the sidecar progress map if it belongs to a download of the same size"""
+    try:
+        with open(progress_file, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+        if progress.get('total_size') == total_size and progress.get('segments'):
+            return progress
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _save_progress(progress_file, progress):
+    """Write the progress map atomically"""
+    tmp_file = f"{progress_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(progress, f)
+    os.replace(tmp_file, progress_file)
+
+def _plan_segments(total_size, segments):
+    """Split [0, total_size) into contiguous inclusive byte ranges"""
+    count = max(1, min(segments, total_size // MIN_SEGMENT_SIZE))
+    size = total_size // count
+    plan = []
+    for i in range(count):
+        start = i * size
+        end = total_size - 1 if i == count - 1 else start + size - 1
+        plan.append({'start': start, 'end': end, 'done': 0})
+    return plan
+
+def _download_single(response, part_file):
+    """Stream a full (non-ranged) response over its one connection"""
+    with response:
+        response.raise_for_status()
+        downloaded = 0
+        with open(part_file, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    downloaded += len(chunk)
+        return downloaded
+
+def download_ranged(url, filepath, headers=None, segments=SEGMENTS, session=None):
+    """
+    Download a file with parallel Range requests, resuming any earlier partial attempt
+    
+    Data is written to `<filepath>.part` with a `<filepath>.part.json` sidecar that
+    records how far each segment got. The file is only renamed to `filepath` once
+    its size matches the server's Content-Length.
+    
+    Args:
+        url (str): File URL
+        filepath (str): Final destination path
+        headers (dict): Extra request headers
+        segments (int): Number of parallel connections
+        session (requests.Session): Session to use (defaults to the shared one)
+    
+    Returns:
+        str: filepath once the download is complete
+    
+    Raises:
+        IncompleteDownload: If the file could not be completed; progress is kept for a retry
+        requests.RequestException: On HTTP errors
+    """
+    session = session or get_session()
+    headers = dict(headers or {})
+    part_file = f"{filepath}.part"
+    progress_file = f"{filepath}.part.json"
+    
+    total_size, supports_ranges, response = probe_download(url, headers, session)
+    
+    if not supports_ranges or not total_size:
+        logging.debug("Server does not support ranges, downloading over one connection")
+        if response is None:
+            response = session.get(url, headers=headers, stream=True, timeout=30)
+        downloaded = _download_single(response, part_file)
+        if total_size and downloaded != total_size:
+            raise IncompleteDownload(f"Received {downloaded} of {total_size} bytes")
+        os.replace(part_file, filepath)
+        return filepath
+    
+    progress = _load_progress(progress_file, total_size) if os.path.exists(part_file) else None
+    if progress:
+        done = sum(segment['done'] for segment in progress['segments'])
+        logging.info(f"Resuming download at {done / total_size:.1%}")
+    else:
+        progress = {'total_size': total_size, 'segments': _plan_segments(total_size, segments)}
+        # Pre-size the part file so every segment can write at its own offset
+        with open(part_file, 'wb') as f:
+            f.truncate(total_size)
+        _save_progress(progress_file, progress)
+    
+    lock = threading.Lock()
+    
+    def fetch_segment(segment):
+        for attempt in range(SEGMENT_RETRIES):
+            start = segment['start'] + segment['done']
+            if start > segment['end']:
+                return True
+            
+            range_headers = dict(headers)
+            range_headers['Range'] = f"bytes={start}-{segment['end']}"
+            try:
+                with session.get(url, headers=range_headers, stream=True, timeout=30) as r:
+                    r.raise_for_status()
+                    if r.status_code != 206:
+                        raise IncompleteDownload(f"Expected a partial response, got {r.status_code}")
+                    
+                    with open(part_file, 'r+b') as f:
+                        f.seek(start)
+                        position = start
+                        unsaved = 0
+                        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                            # Never write past the end of this segment
+                            chunk = chunk[:segment['end'] + 1 - position]
+                            if not chunk:
+                                continue
+                            f.write(chunk)
+                            position += len(chunk)
+                            unsaved += len(chunk)
+                            
+                            if unsaved >= PROGRESS_FLUSH_BYTES:
+                                f.flush()
+                                with lock:
+                                    segment['done'] += unsaved
+                                    _save_progress(progress_file, progress)
+                                    done = sum(s['done'] for s in progress['segments'])
+                                logging.debug(f"Downloaded {done / total_size:.1%}")
+                                unsaved = 0
+                        
+                        f.flush()
+                        with lock:
+                            segment['done'] += unsaved
+                            _save_progress(progress_file, progress)
+                
+                if segment['start'] + segment['done'] > segment['end']:
+                    return True
+            except Exception as e:
+                logging.warning(f"Segment {segment['start']}-{segment['end']} failed (attempt {attempt + 1}/{SEGMENT_RETRIES}): {e}")
+        
+        return False
+    
+    pending = [segment for segment in progress['segments'] if segment['start'] + segment['done'] <= segment['end']]
+    if pending:
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            results = list(executor.map(fetch_segment, pending))
+        if not all(results):
+            raise IncompleteDownload("Some segments failed, progress saved for resume")
+    
+    received = sum(segment['done'] for segment in progress['segments'])
+    if received != total_size or os.path.getsize(part_file) != total_size:
+        raise IncompleteDownload(f"Received {received} of {total_size} bytes")
+    
+    os.replace(part_file, filepath)
+    os.remove(progress_file)
+    return filepath
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP session for the downloader module
+"""
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Browser-like headers sent with every page and short-link request
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+    'Cache-Control': 'max-age=0',
+    'sec-ch-ua': '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"',
+    'sec-ch-ua-mobile': '?0',
+    'sec-ch-ua-platform': '"Windows"',
+    'Referer': 'https://www.xiaohongshu.com/',
+    'Cookie': 'xhsTrackerId=cebd0c81-0c81-0c81-0c81-0c810c810c81; xhsuid=0c810c810c810c81; timestamp2=0c810c810c810c81; timestamp2.sig=0c810c810c810c81'
+}
+
+# Headers for fetching the video file itself from the CDN
+VIDEO_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Referer': 'https://www.xiaohongshu.com/'
+}
+
+# Number of hosts to keep pools for (xhslink.com, xiaohongshu.com, CDN edges)
+POOL_CONNECTIONS = 10
+# Connections kept alive per host, enough for concurrent download workers
+POOL_MAXSIZE = 16
+
+_session = None
+_session_lock = threading.Lock()
+
+def create_session(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, retries=3, backoff_factor=0.5):
+    """
+    Create an HTTP session with per-host connection pooling, keep-alive and retries
+    
+    Args:
+        pool_connections (int): Number of per-host pools to cache
+        pool_maxsize (int): Maximum kept-alive connections per host
+        retries (int): Retries for connection errors and retryable status codes
+        backoff_factor (float): Exponential backoff between retries in seconds
+    
+    Returns:
+        requests.Session: Configured session
+    """
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['HEAD', 'GET'],
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+def get_session():
+    """
+    Get the downloader-wide session, creating it on first use
+    
+    The same session is reused by every request and every job so connections to
+    xhslink.com, xiaohongshu.com and the CDN are only set up once.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+def close_session():
+    """
+    Close the shared session and release its pooled connections
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
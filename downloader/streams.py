@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Stream selection for choosing the video variant that needs the least transcoding
+"""
+import logging
+from media.convert import MAX_WIDTH, MAX_HEIGHT, MAX_FPS, MAX_VIDEO_BITRATE, ASPECT_RATIO, ASPECT_TOLERANCE
+
+# Instagram reels target produced by convert_video_format
+TARGET_CODEC = 'h264'
+TARGET_WIDTH = 1080
+TARGET_HEIGHT = 1920
+
+def transcode_rank(stream):
+    """
+    Estimate how much work a stream needs before it can be uploaded
+    
+    Uses the limits of media.convert.remux_plan, so a stream ranked 0 is
+    expected to be remuxed rather than re-encoded.
+    
+    Returns:
+        int: 0 if it already matches the target, 1 if unknown, 2 if it must be re-encoded
+    """
+    if stream.codec is None and stream.width is None and stream.height is None:
+        return 1
+    if stream.codec is not None and stream.codec != TARGET_CODEC:
+        return 2
+    if stream.width and stream.height:
+        if stream.width > MAX_WIDTH or stream.height > MAX_HEIGHT:
+            return 2
+        if abs(stream.width / stream.height - ASPECT_RATIO) > ASPECT_RATIO * ASPECT_TOLERANCE:
+            return 2
+    if stream.fps and stream.fps > MAX_FPS:
+        return 2
+    if stream.bitrate and stream.bitrate > MAX_VIDEO_BITRATE:
+        return 2
+    if stream.codec is None or not stream.width or not stream.height:
+        return 1
+    return 0
+
+def remux_expected(stream):
+    """
+    Check whether every limit of remux_plan is known to hold for a stream
+    
+    Unlike a rank of 0, a stream missing its frame rate or bitrate does not count,
+    since remux_plan may still reject it once the file is probed.
+    """
+    return transcode_rank(stream) == 0 and bool(stream.fps) and bool(stream.bitrate)
+
+def resolution_gap(stream):
+    """
+    How far a stream's resolution is from filling the target frame (0 is a perfect fit)
+    """
+    if not stream.width or not stream.height:
+        return 1.0
+    target_pixels = TARGET_WIDTH * TARGET_HEIGHT
+    return abs(1.0 - (stream.width * stream.height) / target_pixels)
+
+def stream_sort_key(stream, by_size=True):
+    """
+    Sort key ranking streams by transcoding work, then resolution fit, then bytes to download
+    
+    Args:
+        by_size (bool): Compare file sizes; otherwise bitrates, which rank the
+                        streams of one note the same way since they share a duration
+    """
+    weight = (stream.size if by_size else stream.bitrate) or float('inf')
+    return (transcode_rank(stream), round(resolution_gap(stream), 2), weight)
+
+def rank_streams(streams):
+    """
+    Order stream candidates from best to worst
+    
+    Master URLs stay ahead of their backups because the sort is stable.
+    
+    Args:
+        streams (list): StreamRecord candidates
+    
+    Returns:
+        list: Candidates ordered best first
+    """
+    # Sizes (bytes) and bitrates (bits per second) are not comparable, so one of them ranks all candidates
+    by_size = all(stream.size for stream in streams)
+    ranked = sorted(streams, key=lambda stream: stream_sort_key(stream, by_size))
+    if ranked:
+        best = ranked[0]
+        logging.info(
+            f"Selected stream: codec={best.codec} {best.width}x{best.height} "
+            f"fps={best.fps} bitrate={best.bitrate} size={best.size}"
+        )
+    return ranked
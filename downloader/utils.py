@@ -4,6 +4,8 @@ Utility functions for the downloader module
 """
 import re
 import logging
+from collections import namedtuple
+from urllib.parse import urlparse, parse_qs
 
 def setup_logging(debug=False):
     """Set up logging configuration"""
@@ -24,19 +26,114 @@ def clean_url(url):
     url = re.sub(r'(?<!:)\/\/', '/', url)
     return url
 
-def find_video_urls_in_text(text):
-    """Extract video URLs using regex patterns"""
-    # Create patterns to find video URLs
-    video_patterns = [
-        r'(https?://[^"\s]+\.xhscdn\.com/stream/[^"\s]+\.mp4)',
-        r'(http:\\u002F\\u002F[^"\\]+\.xhscdn\.com\\u002Fstream\\u002F[^"\\]+\.mp4)',
-        r'"masterUrl"\s*:\s*"([^"]+\.mp4)"',
-        r'"backupUrls"\s*:\s*\[\s*"([^"]+)"'
+def is_valid_caption(caption):
+    """
+    Check if the caption is valid and not a default/invalid value
+    """
+    if not caption:
+        return False
+        
+    # List of invalid/default captions to filter out
+    invalid_captions = [
+        'xhs_www.xiaohongshu.com',
+        'hs_www.xiaohongshu.com',
+        'www.xiaohongshu.com',
+        'xiaohongshu.com',
+        'xhs_video_',
+        'xhs_'
     ]
     
+    # Check if caption matches any invalid pattern
+    for invalid in invalid_captions:
+        if invalid in caption:
+            return False
+    
+    # Check if caption is too short or just numbers
+    if len(caption) < 2 or caption.isdigit():
+        return False
+        
+    return True
+
+def format_caption(caption, hashtags):
+    """
+    Clean a caption and append its hashtags
+    
+    Returns:
+        str/None: Final caption, or None if there is neither a valid caption nor hashtags
+    """
+    if not is_valid_caption(caption) and not hashtags:
+        return None
+    
+    # Clean up caption
+    if caption:
+        # Remove any existing hashtags from caption
+        caption = re.sub(r'#\w+\s*', '', caption).strip()
+        # Remove any special characters that might cause issues
+        caption = re.sub(r'[\\/*?:"<>|]', '', caption)
+        # Replace multiple spaces with single space
+        caption = re.sub(r'\s+', ' ', caption).strip()
+    
+    # Combine caption and hashtags
+    if caption and hashtags:
+        return f"{caption} {' '.join(hashtags)}"
+    elif caption:
+        return caption
+    return ' '.join(hashtags)
+
+def extract_note_id(url):
+    """
+    Get the canonical Xiaohongshu note ID from a note URL
+    
+    Handles /explore/<id>, /discovery/item/<id> and /user/profile/<user>/<id>
+    links, ignoring query strings such as xsec_token or tracking parameters.
+    
+    Returns:
+        str/None: Lowercase 24-character note ID, or None if the URL has none
+    """
+    if not url:
+        return None
+    path = urlparse(url).path
+    match = re.search(r'/(?:explore|discovery/item|user/profile/[0-9a-zA-Z]+)/([0-9a-fA-F]{24})(?:/|$)', path)
+    if not match:
+        # Fall back to any note-shaped path segment
+        match = re.search(r'/([0-9a-fA-F]{24})(?:/|$)', path)
+    return match.group(1).lower() if match else None
+
+def get_url_expiry(url):
+    """
+    Get the expiry time embedded in a signed CDN URL, if any
+    
+    Returns:
+        float/None: Unix timestamp after which the URL stops working
+    """
+    query = parse_qs(urlparse(url).query)
+    for key in ('Expires', 'expires', 'x-expires'):
+        if key in query:
+            try:
+                return float(query[key][0])
+            except ValueError:
+                pass
+    # Xiaohongshu signs CDN links with a hex timestamp in `t`
+    if 't' in query and 'sign' in query:
+        try:
+            return float(int(query['t'][0], 16))
+        except ValueError:
+            pass
+    return None
+
+# Patterns to find video URLs in raw page text
+VIDEO_URL_PATTERNS = [re.compile(pattern) for pattern in [
+    r'(https?://[^"\s]+\.xhscdn\.com/stream/[^"\s]+\.mp4)',
+    r'(http:\\u002F\\u002F[^"\\]+\.xhscdn\.com\\u002Fstream\\u002F[^"\\]+\.mp4)',
+    r'"masterUrl"\s*:\s*"([^"]+\.mp4)"',
+    r'"backupUrls"\s*:\s*\[\s*"([^"]+)"'
+]]
+
+def find_video_urls_in_text(text):
+    """Extract video URLs using regex patterns"""
     video_urls = set()
-    for pattern in video_patterns:
-        matches = re.findall(pattern, text)
+    for pattern in VIDEO_URL_PATTERNS:
+        matches = pattern.findall(text)
         for match in matches:
             clean = clean_url(match)
             if clean:
@@ -44,46 +141,148 @@ def find_video_urls_in_text(text):
     
     return list(video_urls)
 
+# A video variant found in page JSON; metadata fields are None when the page omits them
+StreamRecord = namedtuple('StreamRecord', ['url', 'codec', 'width', 'height', 'bitrate', 'fps', 'size'])
+
+# Where the note's stream map usually sits, relative to the JSON block being searched
+STREAM_PATHS = [
+    ('note', 'video', 'media', 'stream'),
+    ('video', 'media', 'stream'),
+    ('media', 'stream'),
+    ('stream',),
+]
+
+# Keys whose string values are checked for video URLs during a full traversal
+URL_KEYS = ('masterUrl', 'url', 'originUrl')
+
+def normalize_codec(codec):
+    """Map the codec names used on Xiaohongshu pages to h264/h265/h266/av1"""
+    if not codec:
+        return None
+    codec = str(codec).lower()
+    if codec in ('h264', 'avc', 'avc1'):
+        return 'h264'
+    if codec in ('h265', 'hevc', 'hev1', 'hvc1'):
+        return 'h265'
+    return codec
+
+def _as_int(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def _variant_records(variant, codec_key=None):
+    """Build stream records for the master and backup URLs of one variant"""
+    codec = normalize_codec(variant.get('videoCodec') or variant.get('codec') or codec_key)
+    metadata = (
+        codec,
+        _as_int(variant.get('width')),
+        _as_int(variant.get('height')),
+        _as_int(variant.get('avgBitrate') or variant.get('videoBitrate')),
+        _as_int(variant.get('fps')),
+        _as_int(variant.get('size')),
+    )
+    
+    records = []
+    urls = [variant.get('masterUrl')] + list(variant.get('backupUrls') or [])
+    for url in urls:
+        if isinstance(url, str):
+            url = clean_url(url)
+            if url:
+                records.append(StreamRecord(url, *metadata))
+    return records
+
+def _stream_map_records(stream):
+    """Build stream records for every variant in a {codec: [variant, ...]} stream map"""
+    records = []
+    for codec_key, variants in stream.items():
+        if isinstance(variants, list):
+            for variant in variants:
+                if isinstance(variant, dict):
+                    records.extend(_variant_records(variant, codec_key))
+    return records
+
+def _follow(data, path):
+    """Walk a fixed key path, returning None as soon as a step is missing"""
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+def _find_known_streams(json_data):
+    """Look for the stream map at the known note -> video -> media -> stream locations"""
+    if not isinstance(json_data, dict):
+        return []
+    
+    records = []
+    # Full page state: note.noteDetailMap.<id>.note.video.media.stream
+    detail_map = _follow(json_data, ('note', 'noteDetailMap'))
+    if isinstance(detail_map, dict):
+        for detail in detail_map.values():
+            stream = _follow(detail, STREAM_PATHS[0])
+            if isinstance(stream, dict):
+                records.extend(_stream_map_records(stream))
+    
+    if not records:
+        for path in STREAM_PATHS:
+            stream = _follow(json_data, path)
+            if isinstance(stream, dict):
+                records.extend(_stream_map_records(stream))
+                break
+    return records
+
+def _walk_for_streams(json_data):
+    """Visit the whole structure with an explicit stack, collecting any video URL"""
+    records = []
+    stack = [(None, json_data)]
+    while stack:
+        parent_key, node = stack.pop()
+        
+        if isinstance(node, list):
+            for item in reversed(node):
+                if isinstance(item, (dict, list)):
+                    stack.append((parent_key, item))
+            continue
+        
+        if not isinstance(node, dict):
+            continue
+        
+        # A stream variant carries its own metadata
+        if 'masterUrl' in node or 'backupUrls' in node:
+            records.extend(record for record in _variant_records(node, parent_key) if record.url.endswith('.mp4'))
+            continue
+        
+        children = []
+        for key, value in node.items():
+            if isinstance(value, str):
+                # Cheap substring checks before running clean_url
+                if key in URL_KEYS or '.mp4' in value or 'xhscdn.com/stream' in value:
+                    url = clean_url(value)
+                    if url.endswith('.mp4'):
+                        records.append(StreamRecord(url, None, None, None, None, None, None))
+            elif isinstance(value, (dict, list)):
+                children.append((key, value))
+        stack.extend(reversed(children))
+    return records
+
 def find_video_urls_in_json(json_data):
-    """Search through JSON structure for video URLs"""
-    video_urls = set()
+    """
+    Search through JSON structure for video streams
     
-    def search_dict(d):
-        """Recursively search through dictionary for video URLs"""
-        nonlocal video_urls
-        if not isinstance(d, dict):
-            return
-            
-        for key, value in d.items():
-            if isinstance(value, str) and any(x in value for x in ['.mp4', 'xhscdn.com/stream']):
-                clean_url_value = clean_url(value)
-                if clean_url_value.endswith('.mp4'):
-                    video_urls.add(clean_url_value)
-            
-            elif key == 'masterUrl' or key == 'url' or key == 'originUrl':
-                if isinstance(value, str):
-                    clean_url_value = clean_url(value)
-                    if clean_url_value.endswith('.mp4'):
-                        video_urls.add(clean_url_value)
-            
-            elif key == 'backupUrls' and isinstance(value, list):
-                for url in value:
-                    if isinstance(url, str):
-                        clean_url_value = clean_url(url)
-                        if clean_url_value.endswith('.mp4'):
-                            video_urls.add(clean_url_value)
-            
-            elif isinstance(value, dict):
-                search_dict(value)
-                
-            elif isinstance(value, list):
-                for item in value:
-                    if isinstance(item, dict):
-                        search_dict(item)
+    The known note -> video -> media -> stream locations are checked first and the
+    full traversal only runs when none of them exist.
     
+    Returns:
+        list: One StreamRecord per unique URL
+    """
     try:
-        search_dict(json_data)
-        return list(video_urls)
+        records = _find_known_streams(json_data) or _walk_for_streams(json_data)
+        unique = {}
+        for record in records:
+            unique.setdefault(record.url, record)
+        return list(unique.values())
     except Exception as e:
         logging.error(f"Error searching JSON: {e}")
-        return []
\ No newline at end of file
+        return []
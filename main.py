@@ -4,17 +4,35 @@ import sys
 import time
 import logging
 import argparse
-from datetime import datetime
 import re
-import subprocess
 import random
+import itertools
 
 # Add the project directory to the path so we can import modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-# Import our modules
-from downloader.download import download_video_from_url
-from uploader.upload import upload_reel
+# Import our modules. downloader.download (requests) and uploader.upload
+# (instagrapi, pydantic, dotenv) are imported where they are first used, so a
+# run that finds no URLs to process starts without them.
+from downloader.streams import remux_expected
+from downloader.hosts import get_host_scheduler
+from media.convert import convert_video_format, convert_video_stream
+from media.mp4 import probe_faststart
+from media.scheduler import TranscodeScheduler, DEFAULT_NICE
+from media.segments import convert_video_segmented
+from pipeline.stages import Stage, StagedPipeline
+from pipeline.jobs import get_job_store, Job, TRANSCODING, UPLOADING
+from pipeline.dedup import get_dedup_index, file_digest, NOTE, CONTENT
+from pipeline.watch import create_watcher
+from pipeline.metrics import timed, track, file_size, run_finished, write_textfile, start_http_server
+from uploader.ledger import get_upload_ledger, UPLOAD_LOG_FILE
+from uploader.scheduler import get_upload_scheduler
+from uploader.accounts import get_roster
+
+# Upload slots this close are waited for; further away, the job is deferred instead
+MAX_UPLOAD_WAIT = 120
+# Bytes of a streamed source read to find its moov box before it is saved to disk instead
+STREAM_PROBE_BYTES = 1024 * 1024
 
 # Set up logging with proper encoding
 LOG_FILE = "video_processor.log"
@@ -51,66 +69,6 @@ def sanitize_filename(filename):
     
     return f"{sanitized}{ext}"
 
-def convert_video_format(input_path, output_path=None):
-    """
-    Convert video to Instagram-compatible format using ffmpeg
-    """
-    if output_path is None:
-        output_path = input_path.replace('.mp4', '_converted.mp4')
-    
-    try:
-        # FFmpeg command to convert video to Instagram-compatible format
-        # -c:v libx264: Use H.264 codec
-        # -preset medium: Balance between quality and encoding speed
-        # -crf 23: Constant Rate Factor (18-28 is good, lower is better quality)
-        # -c:a aac: Use AAC audio codec
-        # -b:a 128k: Audio bitrate
-        # -movflags +faststart: Enable fast start for web playback
-        # -vf scale=1080:1920:force_original_aspect_ratio=decrease: Add padding to maintain aspect ratio
-        # -pix_fmt yuv420p: Ensure pixel format compatibility
-        # -r 30: Set frame rate to 30fps
-        # -b:v 2M: Set video bitrate to 2Mbps
-        cmd = [
-            'ffmpeg', '-y',
-            '-i', input_path,
-            '-c:v', 'libx264',
-            '-preset', 'medium',
-            '-crf', '23',
-            '-c:a', 'aac',
-            '-b:a', '128k',
-            '-movflags', '+faststart',
-            '-vf', 'scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2',
-            '-pix_fmt', 'yuv420p',
-            '-r', '30',
-            '-b:v', '2M',
-            output_path
-        ]
-        
-        logging.info(f"Converting video format: {input_path} -> {output_path}")
-        
-        # Use subprocess.Popen to handle Unicode output properly
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            encoding='utf-8',
-            errors='replace'
-        )
-        
-        stdout, stderr = process.communicate()
-        
-        if process.returncode != 0:
-            logging.error(f"FFmpeg conversion failed: {stderr}")
-            return None
-        
-        logging.info("Video conversion successful")
-        return output_path
-        
-    except Exception as e:
-        logging.error(f"Error converting video: {e}")
-        return None
-
 def get_random_hashtags(num_tags=2):
     """
     Get random hashtags from tags.txt
@@ -126,164 +84,728 @@ def get_random_hashtags(num_tags=2):
         logging.error(f"Error reading tags.txt: {e}")
         return "#reels #trending"
 
-def process_url_file(url_file="urls.txt", downloads_dir="downloads", debug=False):
+def build_caption(video_path):
+    """
+    Build the Instagram caption from the downloaded video filename
+    """
+    filename = os.path.basename(video_path)
+    # Convert underscores back to spaces for the caption
+    caption = os.path.splitext(filename)[0].replace('_', ' ')
+    
+    # Check if the caption is the default "hs_www.xiaohongshu.com"
+    if caption == "hs_www.xiaohongshu.com":
+        # Use random hashtags from tags.txt
+        caption = get_random_hashtags()
+    # If no hashtags are present, add random hashtags
+    elif not any(tag in caption for tag in ['#', 'hashtag']):
+        # If caption is empty or just whitespace, use only random hashtags
+        if not caption.strip():
+            caption = get_random_hashtags()
+        else:
+            caption = f"{caption} {get_random_hashtags()}"
+    
+    # Clean up the caption
+    caption = caption.strip()
+    # Remove any duplicate hashtags
+    hashtags = set(re.findall(r'#\w+', caption))
+    caption = re.sub(r'#\w+\s*', '', caption).strip()  # Remove all hashtags
+    caption = f"{caption} {' '.join(sorted(hashtags))}".strip()  # Add back unique hashtags
+    
+    return caption
+
+def job_prefix(job):
+    """
+    Filename prefix that keeps the files of concurrent jobs apart
+    """
+    return f"job{job.id}_"
+
+@timed('fetch', size=lambda fetched: file_size(fetched[0]))
+def fetch_video(url, downloads_dir="downloads", debug=False, prefix=''):
+    """
+    Download the video behind a URL and prepare its caption and filename
+    
+    Args:
+        prefix (str): Put before the filename but left out of the caption, see job_prefix()
+    
+    Returns:
+        tuple/None: (video_path, caption) if successful, None otherwise
+    """
+    from downloader.download import download_video_from_url
+    
+    logging.info(f"Processing URL: {url}")
+    
+    # Download the video and get caption
+    video_path = download_video_from_url(url, downloads_dir, debug=debug, prefix=prefix)
+    
+    if not video_path:
+        logging.error("Failed to download video")
+        return None
+    
+    # Get the caption from the video filename
+    caption = build_caption(os.path.basename(video_path)[len(prefix):])
+    logging.info(f"Using caption: {caption}")
+    
+    # Sanitize the video filename before upload
+    sanitized_path = os.path.join(os.path.dirname(video_path), sanitize_filename(os.path.basename(video_path)))
+    if video_path != sanitized_path:
+        os.rename(video_path, sanitized_path)
+        video_path = sanitized_path
+        logging.info(f"Renamed video file to: {video_path}")
+    
+    return video_path, caption
+
+def replay_chunks(head, chunks):
+    """
+    Yield the bytes already read from a response and then the rest of it
+    
+    Unlike itertools.chain this can be closed, which closes the response too.
+    """
+    try:
+        yield bytes(head)
+        yield from chunks
+    finally:
+        chunks.close()
+
+@timed('stream', size=lambda fetched: file_size(fetched[0]))
+def stream_video(url, downloads_dir="downloads", debug=False, scheduler=None, prefix='', segmented=False):
+    """
+    Download and convert a video in one pass by piping the CDN response into ffmpeg
+    
+    Only the converted file is written to disk. Streams known to pass remux_plan
+    still take the download-and-remux path, and sources whose moov box sits after
+    the media data are saved to disk and converted normally, since ffmpeg cannot
+    seek back in a pipe.
+    
+    Args:
+        scheduler (TranscodeScheduler): Runs ffmpeg within its worker cap, thread and priority limits
+        prefix (str): Put before the filename but left out of the caption, see job_prefix()
+        segmented (bool): Encode long videos that take the download path as parallel
+                          segments (without a scheduler)
+    
+    Returns:
+        tuple/None: (video_path, caption) of the converted video, None on failure
+    """
+    from downloader.download import prepare_video_source, iter_video_chunks, make_video_filename, forget_note
+    
+    logging.info(f"Processing URL in streaming mode: {url}")
+    
+    source = prepare_video_source(url, debug=debug)
+    if not source:
+        return None
+    candidates, filename, note_id, cached = source
+    
+    filename = make_video_filename(filename)
+    caption = build_caption(filename)
+    logging.info(f"Using caption: {caption}")
+    
+    # Only a stream that will pass remux_plan is worth downloading whole, everything else is encoded anyway
+    if remux_expected(candidates[0]):
+        logging.info("Selected stream is already compliant, downloading for a remux instead")
+        fetched = fetch_video(url, downloads_dir, debug=debug, prefix=prefix)
+        return (transcode_video(fetched[0], scheduler, segmented), fetched[1]) if fetched else None
+    
+    raw_path = os.path.join(downloads_dir, sanitize_filename(f"{prefix}{filename}"))
+    output_path = raw_path.replace('.mp4', '_converted.mp4')
+    
+    for stream in candidates:
+        chunks = iter_video_chunks(stream.url)
+        try:
+            # Read just enough of the response to see how the MP4 is laid out
+            head = bytearray()
+            faststart, needed = None, 8
+            try:
+                for chunk in chunks:
+                    head += chunk
+                    if len(head) >= needed:
+                        faststart, needed = probe_faststart(head)
+                    if needed is None or len(head) >= STREAM_PROBE_BYTES:
+                        break
+            except Exception as e:
+                logging.error(f"Download failed: {e}")
+                continue
+            
+            if faststart:
+                stream_chunks = replay_chunks(head, chunks)
+                if scheduler:
+                    # Counts towards the scheduler's ffmpeg cap like any other transcode
+                    converted = scheduler.convert_stream(stream_chunks, output_path)
+                else:
+                    converted = convert_video_stream(stream_chunks, output_path)
+                if converted:
+                    return output_path, caption
+                continue
+            
+            # Not streamable, keep reading the same response into a file instead
+            logging.info("Source is not faststart, saving it before conversion")
+            try:
+                with open(raw_path, 'wb') as f:
+                    f.write(head)
+                    for chunk in chunks:
+                        f.write(chunk)
+            except Exception as e:
+                logging.error(f"Download failed: {e}")
+                if os.path.exists(raw_path):
+                    os.remove(raw_path)
+                continue
+            return transcode_video(raw_path, scheduler, segmented), caption
+        finally:
+            # Release the HTTP connection whichever way this candidate ended
+            chunks.close()
+    
+    if cached:
+        forget_note(note_id)
+    return None
+
+def transcode_video(video_path, scheduler=None, segmented=False):
+    """
+    Convert a downloaded video for Instagram, falling back to the original on failure
+    
+    Args:
+        scheduler (TranscodeScheduler): Pool to run the conversion in, if several run at once
+        segmented (bool): Encode long videos as parallel segments (without a scheduler)
+    
+    Returns:
+        str: Path of the video to upload
+    """
+    with track('transcode') as timer:
+        if scheduler:
+            converted_path = scheduler.convert(video_path)
+        elif segmented:
+            converted_path = convert_video_segmented(video_path)
+        else:
+            converted_path = convert_video_format(video_path)
+        if converted_path:
+            timer.add_bytes(file_size(converted_path))
+        else:
+            timer.fail()
+    if converted_path:
+        # Delete original video
+        os.remove(video_path)
+        video_path = converted_path
+        logging.info(f"Using converted video: {video_path}")
+    
+    return video_path
+
+@timed('publish')
+def publish_video(url, video_path, caption, debug=False, note_id=None, account=None):
+    """
+    Upload a prepared video and record it in the upload ledger
+    
+    Args:
+        note_id (str): Note the video came from, recorded for deduplication
+        account (Account): Roster account taken with take_upload_slot(), handed back afterwards
+    
+    Returns:
+        str/None: Media ID if successful, None otherwise
+    """
+    from uploader.upload import upload_reel
+    
+    try:
+        upload_result = upload_reel(video_path, caption, debug=debug, account=account)
+    finally:
+        if account:
+            get_roster().release(account)
+    
+    if not upload_result:
+        logging.error(f"Upload failed: {url}")
+        return None
+    
+    # Log the successful upload
+    log_upload(url, video_path, upload_result, note_id, account=account.username if account else None)
+    
+    # Delete the downloaded video file
+    os.remove(video_path)
+    logging.info(f"Deleted downloaded video: {video_path}")
+    
+    return upload_result
+
+def ingest_sources(store, url_file, drop_dir=None):
+    """
+    Queue the new URLs from the url file and from every .txt file in the drop directory
+    """
+    store.ingest(url_file)
+    if drop_dir and os.path.isdir(drop_dir):
+        for name in sorted(os.listdir(drop_dir)):
+            if name.endswith('.txt'):
+                store.ingest(os.path.join(drop_dir, name))
+
+def claim_next_job(store, url_file, drop_dir=None):
+    """
+    Queue any new URLs from the url file and drop directory and claim the next due job
+    
+    Returns:
+        Job/None: The claimed job, or None if nothing is due
+    """
+    if not os.path.exists(url_file):
+        logging.warning(f"URL file not found: {url_file}")
+    ingest_sources(store, url_file, drop_dir)
+    return store.claim()
+
+def reserve_note(dedup, job):
     """
-    Process URLs from the url file one by one, downloading and uploading each video
+    Reserve the note behind a job's URL in the dedup index before anything is fetched
+    
+    The upload ledger is checked too, so uploads made before the index existed
+    (or imported from uploads.log) are not posted again.
+    
+    Returns:
+        tuple: (is_new, note_id) where is_new is False if the note was already
+               posted or another job is processing it
+    """
+    from downloader.download import resolve_note_id
+    
+    note_id = resolve_note_id(job.url)
+    if get_upload_ledger().posted(url=job.url, note_id=note_id):
+        logging.info(f"Skipping job {job.id}: {job.url} is in the upload ledger")
+        return False, note_id
+    if note_id and not dedup.reserve(job.id, NOTE, note_id):
+        logging.info(f"Skipping job {job.id}: note {note_id} was already posted or is in progress")
+        return False, note_id
+    return True, note_id
+
+def is_new_content(dedup, job, video_path):
+    """
+    Reserve the hash of a downloaded video before it is transcoded, deleting it if it is a duplicate
+    
+    Returns:
+        bool: False if the same video was already posted or is being processed
+    """
+    if not dedup.reserve(job.id, CONTENT, file_digest(video_path)):
+        logging.info(f"Skipping job {job.id}: the same video was already posted or is in progress")
+        os.remove(video_path)
+        return False
+    return True
+
+def skip_duplicate(store, dedup, job):
+    """
+    Finish a job whose note or video was already posted
+    """
+    dedup.release(job.id)
+    store.complete(job.id)
+
+def defer_job(store, dedup, job, video_path, wait):
+    """
+    Put a job back in the queue for wait seconds without counting the attempt
+    """
+    store.defer(job.id, time.time() + wait)
+    dedup.release(job.id)
+    if video_path and os.path.exists(video_path):
+        os.remove(video_path)
+
+def take_upload_slot(store, dedup, job, video_path):
+    """
+    Take an account with upload budget, the job's pinned one if it has one
+    
+    The job is deferred if no account frees up within MAX_UPLOAD_WAIT.
+    
+    Returns:
+        Account/None: The account to upload with, None if the job was deferred
+    """
+    account, wait = get_roster().acquire(pinned=job.account, max_wait=MAX_UPLOAD_WAIT)
+    if account:
+        return account
+    if wait == float('inf'):
+        store.fail(job.id, f"unknown account {job.account}")
+        dedup.release(job.id)
+        return None
+    logging.info(f"Upload budget used up, deferring job {job.id} by {wait / 60:.0f} minutes")
+    defer_job(store, dedup, job, video_path, wait)
+    return None
+
+def upload_failed(store, dedup, job, video_path, account):
+    """
+    Handle a failed upload: defer the job while its account is throttled or out of rotation,
+    count a failed attempt otherwise
+    
+    A job that is not pinned to the account is only deferred until another account has budget.
+    """
+    roster = get_roster()
+    unavailable_until = max(get_upload_scheduler().throttled_until(account.username), account.disabled_until)
+    if unavailable_until > time.time():
+        wait = unavailable_until - time.time() if job.account else roster.wait_time()
+        defer_job(store, dedup, job, video_path, wait)
+    else:
+        store.fail(job.id, "upload failed")
+        dedup.release(job.id)
+
+def upload_budget_exhausted():
+    """
+    Check whether the next upload slot of any account is too far away to start new jobs
+    """
+    wait = get_roster().wait_time()
+    if wait > MAX_UPLOAD_WAIT:
+        logging.info(f"Upload budget used up or throttled, next upload in {wait / 60:.0f} minutes")
+        return True
+    return False
+
+def tracked_stage(store, dedup, name, func):
+    """
+    Wrap a pipeline stage so a job it drops is handed back to the store for a retry
+    
+    Stage items are a Job or a tuple starting with one. A job that was completed
+    as a duplicate is left as it is.
+    """
+    def run(item):
+        job = item if isinstance(item, Job) else item[0]
+        try:
+            result = func(item)
+        except Exception as e:
+            store.fail(job.id, f"{name}: {e}")
+            dedup.release(job.id)
+            raise
+        if result is None:
+            store.fail(job.id, f"{name} failed")
+            dedup.release(job.id)
+        return result
+    return run
+
+def process_url_file(url_file="urls.txt", downloads_dir="downloads", debug=False, stream=False, segmented=False,
+                     drop_dir=None):
+    """
+    Process the next queued job, downloading and uploading its video
+    
+    New lines of the url file are queued first. A job that fails is retried on
+    a later run after a backoff delay, and notes or videos that were already
+    posted are skipped. With stream=True the video is converted while it
+    downloads (see stream_video); with segmented=True long videos are encoded
+    as parallel segments, which in streaming mode applies to the videos that
+    are downloaded first. Nothing is processed while no account has upload
+    budget left.
     """
     # Create downloads directory if it doesn't exist
     if not os.path.exists(downloads_dir):
         os.makedirs(downloads_dir)
     
-    if not os.path.exists(url_file):
-        logging.error(f"URL file not found: {url_file}")
+    store = get_job_store()
+    dedup = get_dedup_index()
+    job = None
+    
+    def fail(reason):
+        store.fail(job.id, reason)
+        dedup.release(job.id)
         return False
     
     try:
-        with open(url_file, "r", encoding='utf-8') as f:
-            urls = [line.strip() for line in f if line.strip()]
+        if upload_budget_exhausted():
+            return False
         
-        if not urls:
-            logging.warning(f"No URLs found in {url_file}")
+        store.recover()
+        job = claim_next_job(store, url_file, drop_dir)
+        if job is None:
+            logging.warning(f"No URLs to process in {url_file}")
             return False
         
-        logging.info(f"Found {len(urls)} URLs to process")
+        logging.info(f"Processing job {job.id} (attempt {job.attempts}/{store.max_attempts})")
+        url = job.url
         
-        # Process the first URL in the file
-        url = urls[0]
-        logging.info(f"Processing URL: {url}")
+        is_new, note_id = reserve_note(dedup, job)
+        if not is_new:
+            skip_duplicate(store, dedup, job)
+            return False
+        
+        if stream:
+            fetched = stream_video(url, downloads_dir, debug=debug, prefix=job_prefix(job), segmented=segmented)
+            if not fetched:
+                return fail("stream failed")
+            video_path, caption = fetched
+        else:
+            fetched = fetch_video(url, downloads_dir, debug=debug, prefix=job_prefix(job))
+            if not fetched:
+                return fail("download failed")
+            video_path, caption = fetched
+            
+            if not is_new_content(dedup, job, video_path):
+                skip_duplicate(store, dedup, job)
+                return False
+            store.advance(job.id, TRANSCODING, video_path, caption)
+            
+            # Convert video to Instagram-compatible format
+            video_path = transcode_video(video_path, segmented=segmented)
         
-        # Download the video and get caption
-        video_path = download_video_from_url(url, downloads_dir, debug=debug)
+        # Upload the video
+        store.advance(job.id, UPLOADING, video_path, caption)
+        account = take_upload_slot(store, dedup, job, video_path)
+        if account is None:
+            return False
+        media_id = publish_video(url, video_path, caption, debug=debug, note_id=note_id, account=account)
+        if media_id is None:
+            upload_failed(store, dedup, job, video_path, account)
+            return False
+        store.complete(job.id, media_id)
+        dedup.commit(job.id)
+        return True
+            
+    except Exception as e:
+        logging.error(f"Error processing URL file: {e}")
+        if job:
+            fail(str(e))
+        return False
+
+def process_url_file_pipelined(url_file="urls.txt", downloads_dir="downloads", debug=False,
+                               download_workers=2, transcode_workers=None, upload_workers=None,
+                               queue_size=4, stream=False, ffmpeg_nice=DEFAULT_NICE, segmented=False,
+                               drop_dir=None):
+    """
+    Drain every due job through concurrent download, transcode and upload stages
+    
+    Downloads are network-bound, ffmpeg is CPU-bound and uploads are rate-limited, so
+    each stage gets its own worker pool and the stages are connected by bounded queues.
+    Jobs are claimed only as the first stage has room, and every stage records
+    its progress in the job store.
+    
+    Args:
+        url_file (str): File containing URLs to process
+        downloads_dir (str): Directory for downloaded videos
+        debug (bool): Enable debug mode
+        download_workers (int): Concurrent downloads
+        transcode_workers (int): Concurrent ffmpeg processes (sized from the available cores by default)
+        upload_workers (int): Concurrent uploads (one per roster account by default)
+        queue_size (int): Maximum items waiting between two stages
+        stream (bool): Convert while downloading, with at most transcode_workers streams at once
+        ffmpeg_nice (int): Niceness for ffmpeg processes
+        segmented (bool): Split long videos into segments encoded in parallel within each job
+        drop_dir (str): Directory whose .txt files are queued like the url file
+    
+    Returns:
+        bool: True if at least one video was uploaded, False otherwise
+    """
+    if not os.path.exists(downloads_dir):
+        os.makedirs(downloads_dir)
+    
+    try:
+        if upload_budget_exhausted():
+            return False
         
-        if not video_path:
-            logging.error("Failed to download video")
+        store = get_job_store()
+        dedup = get_dedup_index()
+        store.recover()
+        job = claim_next_job(store, url_file, drop_dir)
+        if job is None:
+            logging.warning(f"No URLs to process in {url_file}")
             return False
         
-        # Get the caption from the video filename
-        filename = os.path.basename(video_path)
-        # Convert underscores back to spaces for the caption
-        caption = os.path.splitext(filename)[0].replace('_', ' ')
+        logging.info(f"Found {store.due() + 1} jobs to process in pipeline mode")
         
-        # Check if the caption is the default "hs_www.xiaohongshu.com"
-        if caption == "hs_www.xiaohongshu.com":
-            # Use random hashtags from tags.txt
-            caption = get_random_hashtags()
-        # If no hashtags are present, add random hashtags
-        elif not any(tag in caption for tag in ['#', 'hashtag']):
-            # If caption is empty or just whitespace, use only random hashtags
-            if not caption.strip():
-                caption = get_random_hashtags()
-            else:
-                caption = f"{caption} {get_random_hashtags()}"
+        # Each account uploads one video at a time, so one upload worker per account posts in parallel
+        roster = get_roster()
+        upload_workers = upload_workers or len(roster)
         
-        # Clean up the caption
-        caption = caption.strip()
-        # Remove any duplicate hashtags
-        hashtags = set(re.findall(r'#\w+', caption))
-        caption = re.sub(r'#\w+\s*', '', caption).strip()  # Remove all hashtags
-        caption = f"{caption} {' '.join(sorted(hashtags))}".strip()  # Add back unique hashtags
+        # Caps concurrent ffmpeg processes and splits the cores between them
+        scheduler = TranscodeScheduler(workers=transcode_workers, nice=ffmpeg_nice, segmented=segmented)
         
-        logging.info(f"Using caption: {caption}")
+        def download_stage(job):
+            is_new, note_id = reserve_note(dedup, job)
+            if not is_new:
+                skip_duplicate(store, dedup, job)
+                return None
+            fetched = fetch_video(job.url, downloads_dir, debug=debug, prefix=job_prefix(job))
+            if not fetched:
+                return None
+            video_path, caption = fetched
+            if not is_new_content(dedup, job, video_path):
+                skip_duplicate(store, dedup, job)
+                return None
+            store.advance(job.id, TRANSCODING, video_path, caption)
+            return job, note_id, video_path, caption
         
-        # Sanitize the video filename before upload
-        sanitized_path = os.path.join(os.path.dirname(video_path), sanitize_filename(os.path.basename(video_path)))
-        if video_path != sanitized_path:
-            os.rename(video_path, sanitized_path)
-            video_path = sanitized_path
-            logging.info(f"Renamed video file to: {video_path}")
+        def transcode_stage(item):
+            job, note_id, video_path, caption = item
+            video_path = transcode_video(video_path, scheduler)
+            store.advance(job.id, UPLOADING, video_path)
+            return job, note_id, video_path, caption
         
-        # Convert video to Instagram-compatible format
-        converted_path = convert_video_format(video_path)
-        if converted_path:
-            # Delete original video
-            os.remove(video_path)
-            video_path = converted_path
-            logging.info(f"Using converted video: {video_path}")
+        def upload_stage(item):
+            job, note_id, video_path, caption = item
+            # The budget may have run out while this job was in flight, it is then deferred
+            account = take_upload_slot(store, dedup, job, video_path)
+            if account is None:
+                return None
+            media_id = publish_video(job.url, video_path, caption, debug=debug, note_id=note_id, account=account)
+            if media_id is None:
+                upload_failed(store, dedup, job, video_path, account)
+                return None
+            store.complete(job.id, media_id)
+            dedup.commit(job.id)
+            return media_id
         
-        # Upload the video
-        upload_result = upload_reel(video_path, caption, debug=debug)
+        def stream_stage(job):
+            is_new, note_id = reserve_note(dedup, job)
+            if not is_new:
+                skip_duplicate(store, dedup, job)
+                return None
+            fetched = stream_video(job.url, downloads_dir, debug=debug, scheduler=scheduler,
+                                   prefix=job_prefix(job))
+            if not fetched:
+                return None
+            video_path, caption = fetched
+            store.advance(job.id, UPLOADING, video_path, caption)
+            return job, note_id, video_path, caption
         
-        if upload_result:
-            # Log the successful upload
-            log_upload(url, video_path, upload_result)
-            
-            # Remove the processed URL from the file
-            remove_url_from_file(url_file, url)
-            
-            # Delete the downloaded video file
-            os.remove(video_path)
-            logging.info(f"Deleted downloaded video: {video_path}")
-            
-            return True
+        if stream:
+            # Every streamed download feeds an ffmpeg slot, more workers would only hold connections open
+            stream_workers = min(download_workers, scheduler.workers)
+            stages = [Stage('stream', tracked_stage(store, dedup, 'stream', stream_stage), stream_workers)]
         else:
-            logging.error("Upload failed")
-            return False
-            
+            stages = [
+                Stage('download', tracked_stage(store, dedup, 'download', download_stage), download_workers),
+                Stage('transcode', tracked_stage(store, dedup, 'transcode', transcode_stage), scheduler.workers),
+            ]
+        stages.append(Stage('upload', tracked_stage(store, dedup, 'upload', upload_stage), upload_workers))
+        
+        pipeline = StagedPipeline(stages, queue_size=queue_size)
+        
+        def claim():
+            return None if upload_budget_exhausted() else store.claim()
+        
+        # Further jobs are claimed lazily as the first stage takes them, until the budget is used up
+        results, stage_stats = pipeline.run(itertools.chain([job], iter(claim, None)))
+        scheduler.shutdown()
+        stats = scheduler.stats()
+        claimed = sum(stage_stats[stages[0].name].values())
+        logging.info(f"Pipeline finished: {len(results)}/{claimed} videos uploaded")
+        logging.info("Jobs: " + ", ".join(f"{count} {state}" for state, count in store.counts().items()))
+        if len(roster) > 1:
+            logging.info("Accounts: " + ", ".join(
+                f"{name} {info['uploads']} uploads" + ("" if info['healthy'] else f" (out: {info['reason']})")
+                for name, info in roster.stats().items()
+            ))
+        logging.info(
+            f"Transcodes: {stats['completed']} completed, {stats['failed']} failed, "
+            f"mean encode speed {stats['encode_fps']:.1f} fps"
+        )
+        for host, pacing in get_host_scheduler().stats().items():
+            if pacing['delayed']:
+                logging.info(
+                    f"Host {host}: {pacing['requests']} requests, {pacing['delayed']} paced, "
+                    f"{pacing['total_delay']:.1f}s waited in total, longest {pacing['max_delay']:.1f}s"
+                )
+        log_cache_stats()
+        return len(results) > 0
+        
     except Exception as e:
         logging.error(f"Error processing URL file: {e}")
         return False
 
-def log_upload(url, video_path, upload_info):
+def log_cache_stats():
     """
-    Log the upload details to a separate log file
+    Log the hits and misses of the downloader caches during this run
     """
-    upload_log_file = "uploads.log"
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    log_entry = (
-        f"TIME: {timestamp}\n"
-        f"URL: {url}\n"
-        f"VIDEO: {video_path}\n"
-        f"UPLOAD_ID: {upload_info}\n"
-        f"{'-' * 50}\n"
-    )
-    
-    with open(upload_log_file, "a", encoding='utf-8') as f:
-        f.write(log_entry)
+    from downloader.cache import get_short_link_cache, get_note_cache
     
-    logging.info(f"Upload logged to {upload_log_file}")
+    for name, cache in (('Short-link', get_short_link_cache()), ('Note', get_note_cache())):
+        if cache:
+            logging.info(f"{name} cache: " + ", ".join(
+                f"{count} {kind.replace('_', ' ')}" for kind, count in cache.stats().items()
+            ))
 
-def remove_url_from_file(url_file, processed_url):
+def log_upload(url, video_path, upload_info, note_id=None, account=None):
     """
-    Remove the processed URL from the url file
+    Record the upload in the upload ledger
     """
+    ledger = get_upload_ledger()
+    ledger.record(url, upload_info, video_path=video_path, note_id=note_id, account=account)
+    logging.info(f"Upload logged to {ledger.path}")
+
+def parse_host_delay(spec):
+    """
+    Parse a --host-delay value of the form HOST=MIN[:MAX]
+    """
+    host, _, gap = spec.partition('=')
+    low, _, high = gap.partition(':')
     try:
-        with open(url_file, "r", encoding='utf-8') as f:
-            urls = [line.strip() for line in f]
-        
-        with open(url_file, "w", encoding='utf-8') as f:
-            for url in urls:
-                if url.strip() != processed_url:
-                    f.write(f"{url}\n")
-        
-        logging.info(f"Removed processed URL from {url_file}")
-    except Exception as e:
-        logging.error(f"Error removing URL from file: {e}")
+        return host.strip().lower(), float(low), float(high) if high else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected HOST=MIN[:MAX], got {spec!r}")
 
 def main():
     parser = argparse.ArgumentParser(description='Download and upload videos from URLs')
     parser.add_argument('-u', '--url-file', default='urls.txt', help='File containing URLs to process')
     parser.add_argument('-d', '--downloads-dir', default='downloads', help='Directory for downloaded videos')
     parser.add_argument('-c', '--continuous', action='store_true', help='Run continuously, checking for new URLs')
-    parser.add_argument('-i', '--interval', type=int, default=3600, help='Interval in seconds between checks in continuous mode')
+    parser.add_argument('-i', '--interval', type=int, default=3600, help='Minimum seconds between runs in continuous mode; new URLs are picked up as soon as they are written')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode for detailed logging')
+    parser.add_argument('-p', '--pipeline', action='store_true', help='Drain all queued URLs with concurrent download, transcode and upload stages')
+    parser.add_argument('--download-workers', type=int, default=2, help='Concurrent downloads in pipeline mode')
+    parser.add_argument('--transcode-workers', type=int, default=None, help='Concurrent ffmpeg processes in pipeline mode (default: sized from the available cores)')
+    parser.add_argument('--upload-workers', type=int, default=None, help='Concurrent uploads in pipeline mode (default: one per account)')
+    parser.add_argument('--queue-size', type=int, default=4, help='Maximum videos waiting between two pipeline stages')
+    parser.add_argument('--ffmpeg-nice', type=int, default=DEFAULT_NICE, help='Niceness of ffmpeg processes in pipeline mode (0 to disable)')
+    parser.add_argument('--segmented', action='store_true', help='Encode long videos as keyframe-aligned segments in parallel (with --stream only videos that are saved before conversion)')
+    parser.add_argument('-s', '--stream', action='store_true', help='Pipe downloads straight into ffmpeg instead of saving them first')
+    parser.add_argument('--drop-dir', default=None, help='Directory whose .txt files of URLs are queued as they appear')
+    parser.add_argument('--hourly-limit', type=int, default=None, help='Maximum uploads per hour and account, lowered automatically while Instagram throttles (default: no limit)')
+    parser.add_argument('--daily-limit', type=int, default=None, help='Maximum uploads per account in any 24 hours (default: no limit)')
+    parser.add_argument('--metrics-port', type=int, default=None, help='Serve per-stage metrics in Prometheus format at http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-file', default=None, help='Write per-stage metrics in Prometheus format to this file after every run, for the node_exporter textfile collector (name it *.prom)')
+    parser.add_argument('--host-delay', action='append', type=parse_host_delay, default=[], metavar='HOST=MIN[:MAX]', help='Random gap in seconds between requests to a host and its subdomains, e.g. xiaohongshu.com=2:5 (0 turns pacing off); may be repeated')
     
     args = parser.parse_args()
     
+    def process():
+        if args.pipeline:
+            return process_url_file_pipelined(
+                args.url_file, args.downloads_dir, debug=args.debug,
+                download_workers=args.download_workers,
+                transcode_workers=args.transcode_workers,
+                upload_workers=args.upload_workers,
+                queue_size=args.queue_size,
+                stream=args.stream,
+                ffmpeg_nice=args.ffmpeg_nice,
+                segmented=args.segmented,
+                drop_dir=args.drop_dir
+            )
+        return process_url_file(args.url_file, args.downloads_dir, debug=args.debug,
+                                stream=args.stream, segmented=args.segmented, drop_dir=args.drop_dir)
+    
+    def run():
+        try:
+            return process()
+        finally:
+            run_finished()
+            if args.metrics_file:
+                write_textfile(args.metrics_file)
+    
+    if args.metrics_port is not None:
+        start_http_server(args.metrics_port)
+    for host, low, high in args.host_delay:
+        get_host_scheduler().configure(host, low, high)
+    
+    # Bring the free-text log of earlier versions into the ledger, once
+    get_upload_ledger().import_log(UPLOAD_LOG_FILE)
+    get_upload_scheduler(hourly_limit=args.hourly_limit, daily_limit=args.daily_limit)
+    
     if args.continuous:
-        logging.info(f"Starting continuous mode, checking every {args.interval} seconds")
+        logging.info(f"Starting continuous mode, runs at least {args.interval} seconds apart")
         
-        while True:
-            if os.path.exists(args.url_file) and os.path.getsize(args.url_file) > 0:
-                process_url_file(args.url_file, args.downloads_dir, debug=args.debug)
-            else:
-                logging.info(f"No URLs to process. Waiting for next check.")
-            
-            logging.info(f"Sleeping for {args.interval} seconds")
-            time.sleep(args.interval)
+        store = get_job_store()
+        # Wakes up as soon as the url file or drop directory changes instead of sleeping blindly
+        watcher = create_watcher(args.url_file, args.drop_dir)
+        last_run = None
+        try:
+            while True:
+                ingest_sources(store, args.url_file, args.drop_dir)
+                now = time.time()
+                next_due = store.next_due()
+                
+                if next_due is not None and next_due <= now:
+                    # Jobs are waiting, but runs (and so uploads) stay at least the interval apart
+                    wait = last_run + args.interval - now if last_run else 0
+                    if wait <= 0:
+                        last_run = now
+                        run()
+                        continue
+                    logging.info(f"Next run allowed in {wait:.0f} seconds")
+                else:
+                    # Nothing due: wait for new URLs, the next retry, or the interval as a safety net
+                    wait = args.interval if next_due is None else min(args.interval, next_due - now)
+                    logging.info(f"No URLs to process. Waiting for new URLs.")
+                
+                watcher.wait(wait)
+        finally:
+            watcher.close()
     else:
         # Run once
-        process_url_file(args.url_file, args.downloads_dir, debug=args.debug)
+        run()
 
 if __name__ == "__main__":
     logging.info("Starting video processor")
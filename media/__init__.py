@@ -0,0 +1,6 @@
+#!/usr/bin/env python3
+"""
+Media package for probing and converting videos with ffmpeg
+"""
+
+# Package initialization
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Convert module for making videos Instagram-compatible with ffmpeg
+"""
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+import subprocess
+from .probe import probe_media
+
+# Limits a source must already meet to be remuxed instead of re-encoded
+MAX_WIDTH = 1080
+MAX_HEIGHT = 1920
+MAX_FPS = 30.5
+MAX_VIDEO_BITRATE = 3500000
+ASPECT_RATIO = 9 / 16
+ASPECT_TOLERANCE = 0.02
+# Encode seconds per second of video, used until real encodes have been measured
+DEFAULT_ENCODE_RATIO = 0.6
+# ffmpeg progress lines look like "frame= 1234 fps= 56 q=28.0 ..."
+FRAME_PATTERN = re.compile(r'frame=\s*(\d+)')
+
+_stats_lock = threading.Lock()
+_stats = {
+    'remux': 0,
+    'encode': 0,
+    'remux_seconds': 0.0,
+    'encode_seconds': 0.0,
+    'encoded_media_seconds': 0.0,
+    'saved_seconds': 0.0,
+}
+
+def get_conversion_stats():
+    """
+    Get counters for the conversion paths taken by this process
+    
+    Returns:
+        dict: Remux/encode counts and times, estimated time saved and remux hit rate
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    total = stats['remux'] + stats['encode']
+    stats['remux_hit_rate'] = stats['remux'] / total if total else 0.0
+    return stats
+
+def _estimated_encode_seconds(duration):
+    """Estimate how long a full encode of `duration` seconds of video would take"""
+    with _stats_lock:
+        if _stats['encoded_media_seconds'] > 0:
+            ratio = _stats['encode_seconds'] / _stats['encoded_media_seconds']
+        else:
+            ratio = DEFAULT_ENCODE_RATIO
+    return (duration or 0) * ratio
+
+def remux_plan(info):
+    """
+    Decide whether a probed video can skip re-encoding
+    
+    Args:
+        info (MediaInfo): Result of probe_media
+    
+    Returns:
+        tuple: (can_remux, copy_audio, reason)
+    """
+    if not info:
+        return False, False, "probe unavailable"
+    if info.video_codec != 'h264':
+        return False, False, f"video codec {info.video_codec}"
+    if info.pix_fmt != 'yuv420p':
+        return False, False, f"pixel format {info.pix_fmt}"
+    if not info.width or not info.height or info.width > MAX_WIDTH or info.height > MAX_HEIGHT:
+        return False, False, f"resolution {info.width}x{info.height}"
+    if abs(info.width / info.height - ASPECT_RATIO) > ASPECT_RATIO * ASPECT_TOLERANCE:
+        return False, False, f"aspect ratio {info.width}x{info.height}"
+    if not info.fps or info.fps > MAX_FPS:
+        return False, False, f"frame rate {info.fps}"
+    bitrate = info.video_bit_rate or info.bit_rate
+    if bitrate and bitrate > MAX_VIDEO_BITRATE:
+        return False, False, f"bitrate {bitrate}"
+    
+    # AAC audio (or no audio) is copied, anything else gets a cheap audio-only encode
+    copy_audio = info.audio_codec in (None, 'aac')
+    return True, copy_audio, "already compliant"
+
+# -c:v libx264: Use H.264 codec
+# -preset medium: Balance between quality and encoding speed
+# -crf 23: Constant Rate Factor (18-28 is good, lower is better quality)
+# -vf scale=1080:1920:force_original_aspect_ratio=decrease: Add padding to maintain aspect ratio
+# -pix_fmt yuv420p: Ensure pixel format compatibility
+# -r 30: Set frame rate to 30fps
+# -b:v 2M: Set video bitrate to 2Mbps
+VIDEO_ENCODE_ARGS = [
+    '-c:v', 'libx264',
+    '-preset', 'medium',
+    '-crf', '23',
+    '-vf', 'scale=1080:1920:force_original_aspect_ratio=decrease,pad=1080:1920:(ow-iw)/2:(oh-ih)/2',
+    '-pix_fmt', 'yuv420p',
+    '-r', '30',
+    '-b:v', '2M',
+]
+
+# -c:a aac: Use AAC audio codec
+# -b:a 128k: Audio bitrate
+AUDIO_ENCODE_ARGS = [
+    '-c:a', 'aac',
+    '-b:a', '128k',
+]
+
+def build_encode_command(input_path, output_path):
+    """
+    Build the full re-encode command
+    
+    -movflags +faststart: Enable fast start for web playback
+    """
+    return ['ffmpeg', '-y', '-i', input_path] + VIDEO_ENCODE_ARGS + AUDIO_ENCODE_ARGS + [
+        '-movflags', '+faststart',
+        output_path
+    ]
+
+def build_remux_command(input_path, output_path, copy_audio=True):
+    """
+    Build a stream-copy command that only rewrites the container with the moov atom first
+    """
+    return [
+        'ffmpeg', '-y',
+        '-i', input_path,
+        '-map', '0:v:0',
+        '-map', '0:a:0?',
+        '-c:v', 'copy',
+        '-c:a', 'copy' if copy_audio else 'aac',
+    ] + ([] if copy_audio else ['-b:a', '128k']) + [
+        '-movflags', '+faststart',
+        output_path
+    ]
+
+def with_priority(cmd, nice=None):
+    """
+    Prefix a command so it runs at a lower CPU priority
+    
+    Args:
+        cmd (list): Command to run
+        nice (int): POSIX niceness (0-19), ignored when None or 0
+    """
+    if nice and os.name == 'posix' and shutil.which('nice'):
+        return ['nice', '-n', str(nice)] + cmd
+    return cmd
+
+def with_threads(cmd, threads=None):
+    """
+    Limit the encoder threads of an ffmpeg command (placed right before the output path)
+    """
+    if not threads:
+        return cmd
+    return cmd[:-1] + ['-threads', str(threads), cmd[-1]]
+
+def encoded_frames(stderr):
+    """Get the number of frames ffmpeg reported as written, from its final progress line"""
+    matches = FRAME_PATTERN.findall(stderr or '')
+    return int(matches[-1]) if matches else None
+
+def run_ffmpeg(cmd, nice=None):
+    """
+    Run an ffmpeg command
+    
+    Returns:
+        tuple: (success, stderr)
+    """
+    creationflags = 0
+    if nice and os.name == 'nt':
+        creationflags = subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    
+    # Use subprocess.Popen to handle Unicode output properly
+    process = subprocess.Popen(
+        with_priority(cmd, nice),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        encoding='utf-8',
+        errors='replace',
+        creationflags=creationflags
+    )
+    
+    stdout, stderr = process.communicate()
+    
+    if process.returncode != 0:
+        logging.error(f"FFmpeg conversion failed: {stderr}")
+        return False, stderr
+    return True, stderr
+
+def convert_video_format(input_path, output_path=None, threads=None, nice=None, job_stats=None):
+    """
+    Convert video to Instagram-compatible format using ffmpeg
+    
+    The input is probed first. Sources that are already H.264 yuv420p within the
+    resolution, frame rate and bitrate limits are only remuxed with stream copy and
+    +faststart; everything else gets a full re-encode.
+    
+    Args:
+        input_path (str): Source video
+        output_path (str): Destination (defaults to <input>_converted.mp4)
+        threads (int): Encoder threads, None lets ffmpeg use every core
+        nice (int): Run ffmpeg at this niceness
+        job_stats (dict): Filled with the path taken, elapsed seconds and frames encoded
+    """
+    if job_stats is None:
+        job_stats = {}
+    if output_path is None:
+        output_path = input_path.replace('.mp4', '_converted.mp4')
+    
+    try:
+        info = probe_media(input_path)
+        can_remux, copy_audio, reason = remux_plan(info)
+        
+        if can_remux:
+            logging.info(f"Remuxing video ({reason}): {input_path} -> {output_path}")
+            start = time.monotonic()
+            if run_ffmpeg(build_remux_command(input_path, output_path, copy_audio), nice)[0]:
+                elapsed = time.monotonic() - start
+                job_stats.update({'path': 'remux', 'seconds': elapsed, 'frames': None})
+                saved = max(0.0, _estimated_encode_seconds(info.duration) - elapsed)
+                with _stats_lock:
+                    _stats['remux'] += 1
+                    _stats['remux_seconds'] += elapsed
+                    _stats['saved_seconds'] += saved
+                stats = get_conversion_stats()
+                logging.info(
+                    f"Video remux successful in {elapsed:.1f}s (saved ~{saved:.1f}s), "
+                    f"remux hit rate {stats['remux']}/{stats['remux'] + stats['encode']} "
+                    f"({stats['remux_hit_rate']:.0%}), total saved ~{stats['saved_seconds']:.0f}s"
+                )
+                return output_path
+            logging.warning("Remux failed, falling back to full encode")
+        
+        logging.info(f"Converting video format ({reason}): {input_path} -> {output_path}")
+        start = time.monotonic()
+        success, stderr = run_ffmpeg(with_threads(build_encode_command(input_path, output_path), threads), nice)
+        if not success:
+            return None
+        
+        elapsed = time.monotonic() - start
+        job_stats.update({'path': 'encode', 'seconds': elapsed, 'frames': encoded_frames(stderr)})
+        with _stats_lock:
+            _stats['encode'] += 1
+            # Only measured encodes of known length feed the time-saved estimate
+            if info and info.duration:
+                _stats['encode_seconds'] += elapsed
+                _stats['encoded_media_seconds'] += info.duration
+        
+        logging.info(f"Video conversion successful in {elapsed:.1f}s")
+        return output_path
+        
+    except Exception as e:
+        logging.error(f"Error converting video: {e}")
+        return None
+
+def build_stream_encode_command(output_path):
+    """
+    Build the full re-encode command reading the source from stdin
+    """
+    cmd = build_encode_command('pipe:0', output_path)
+    # Tell ffmpeg the container up front, it cannot sniff and seek a pipe
+    cmd[cmd.index('-i'):cmd.index('-i')] = ['-f', 'mp4']
+    return cmd
+
+def convert_video_stream(chunks, output_path, threads=None, nice=None):
+    """
+    Encode a video to Instagram-compatible format while it is still downloading
+    
+    The chunks are written to ffmpeg's stdin from a separate thread, so encoding
+    starts with the first bytes and only the converted file touches disk. The
+    source must be a faststart MP4 (moov before mdat).
+    
+    Args:
+        chunks (iterable): Source video bytes, e.g. from iter_video_chunks
+        output_path (str): Where the converted video is written
+        threads (int): Encoder threads, None lets ffmpeg use every core
+        nice (int): Run ffmpeg at this niceness
+    
+    Returns:
+        str/None: output_path if successful, None otherwise
+    """
+    cmd = with_threads(build_stream_encode_command(output_path), threads)
+    logging.info(f"Converting video stream -> {output_path}")
+    
+    try:
+        process = subprocess.Popen(
+            with_priority(cmd, nice),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            creationflags=subprocess.BELOW_NORMAL_PRIORITY_CLASS if nice and os.name == 'nt' else 0
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.error(f"Error converting video: {e}")
+        return None
+    
+    feed_error = []
+    
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except BrokenPipeError:
+            # ffmpeg exited early, its stderr explains why
+            pass
+        except Exception as e:
+            feed_error.append(e)
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            # Release the HTTP connection even if ffmpeg stopped reading early
+            if hasattr(chunks, 'close'):
+                chunks.close()
+    
+    start = time.monotonic()
+    feeder = threading.Thread(target=feed, name='ffmpeg-feed', daemon=True)
+    feeder.start()
+    stderr = process.stderr.read().decode('utf-8', errors='replace')
+    process.wait()
+    feeder.join()
+    
+    if feed_error:
+        # A truncated source can still produce a "valid" short output, so discard it
+        logging.error(f"Video stream failed during conversion: {feed_error[0]}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return None
+    
+    if process.returncode != 0:
+        logging.error(f"FFmpeg conversion failed: {stderr}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return None
+    
+    logging.info(f"Streamed video conversion successful in {time.monotonic() - start:.1f}s")
+    return output_path
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+MP4 (ISO-BMFF) box helpers
+"""
+import os
+import mmap
+import struct
+from collections import namedtuple
+
+def probe_faststart(data):
+    """
+    Check from the first bytes of an MP4 whether its moov box precedes mdat
+    
+    ffmpeg can only decode an MP4 from a pipe when the moov index comes first
+    (a "faststart" file), because it cannot seek back to read it. The number of
+    bytes needed for an answer is returned too, so a caller that reads a stream
+    chunk by chunk can skip parsing until the next box header has arrived.
+    
+    Args:
+        data (bytes): Leading bytes of the file
+    
+    Returns:
+        tuple: (verdict, needed) where verdict is True if moov comes first, False
+               if mdat does, None if the bytes are not enough to tell or not an
+               MP4, and needed is the length data must reach before the verdict
+               can change, or None once it is final
+    """
+    offset = 0
+    while offset + 8 <= len(data):
+        size, box_type = struct.unpack('>I4s', data[offset:offset + 8])
+        if box_type == b'moov':
+            return True, None
+        if box_type == b'mdat':
+            return False, None
+        if size == 1:
+            if offset + 16 > len(data):
+                return None, offset + 16
+            size = struct.unpack('>Q', data[offset + 8:offset + 16])[0]
+        if size < 8:
+            # size 0 means "to end of file", anything else below 8 is corrupt
+            return None, None
+        offset += size
+    return None, offset + 8
+
+# Summary of the boxes read by read_mp4_info
+Mp4Info = namedtuple('Mp4Info', [
+    'brand', 'duration', 'width', 'height', 'video_codec', 'audio_codec',
+    'faststart', 'has_moov', 'truncated',
+])
+
+# Containers walked on the way from moov to the sample descriptions
+CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+def _iter_boxes(buf, start, end):
+    """
+    Yield (box_type, payload_start, box_end, overrun) for the boxes in buf[start:end]
+    
+    overrun is True for a box whose declared size runs past end, which is
+    always the last box yielded.
+    """
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', buf, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                yield box_type, offset + 16, end, True
+                return
+            size = struct.unpack_from('>Q', buf, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            # Corrupt size field, nothing after it can be trusted
+            yield box_type, offset + header, end, True
+            return
+        box_end = offset + size
+        if box_end > end:
+            yield box_type, offset + header, end, True
+            return
+        yield box_type, offset + header, box_end, False
+        offset = box_end
+
+def _read_mvhd(buf, start, end):
+    """Movie duration in seconds from an mvhd payload"""
+    version = buf[start]
+    if version == 1:
+        if start + 32 > end:
+            return None
+        timescale, duration = struct.unpack_from('>IQ', buf, start + 20)
+    else:
+        if start + 20 > end:
+            return None
+        timescale, duration = struct.unpack_from('>II', buf, start + 12)
+    return duration / timescale if timescale else None
+
+def _read_trak(buf, start, end):
+    """(handler, width, height, fourcc) of one trak box"""
+    handler = width = height = fourcc = None
+    stack = [(start, end)]
+    while stack:
+        box_start, box_end = stack.pop()
+        for box_type, payload, payload_end, overrun in _iter_boxes(buf, box_start, box_end):
+            if overrun:
+                break
+            if box_type == b'tkhd' and payload_end - payload >= 84:
+                # Width and height are 16.16 fixed point in the last 8 bytes
+                width, height = struct.unpack_from('>II', buf, payload_end - 8)
+                width, height = width >> 16, height >> 16
+            elif box_type == b'hdlr' and payload_end - payload >= 12:
+                handler = bytes(buf[payload + 8:payload + 12])
+            elif box_type == b'stsd' and payload_end - payload >= 16:
+                # Skip version/flags and entry count to the first sample entry
+                fourcc = bytes(buf[payload + 12:payload + 16]).decode('latin-1')
+            elif box_type in CONTAINER_BOXES:
+                stack.append((payload, payload_end))
+    return handler, width, height, fourcc
+
+def parse_mp4(buf):
+    """
+    Read the ftyp, moov/mvhd, trak/tkhd and stsd boxes of an MP4 held in buf
+    
+    Args:
+        buf: Any buffer supporting struct.unpack_from, e.g. an mmap
+    
+    Returns:
+        Mp4Info/None: Parsed summary, or None if buf does not start like an MP4
+    """
+    end = len(buf)
+    if end < 8 or bytes(buf[4:8]) not in (b'ftyp', b'styp', b'moov', b'free', b'skip', b'wide', b'mdat'):
+        return None
+    
+    brand = duration = width = height = video_codec = audio_codec = None
+    has_moov = truncated = False
+    faststart = None
+    for box_type, payload, payload_end, overrun in _iter_boxes(buf, 0, end):
+        if overrun:
+            truncated = True
+            if box_type == b'mdat' and faststart is None:
+                faststart = False
+            break
+        if box_type == b'ftyp' and payload_end - payload >= 4:
+            brand = bytes(buf[payload:payload + 4]).decode('latin-1').strip()
+        elif box_type == b'mdat' and faststart is None:
+            faststart = False
+        elif box_type == b'moov':
+            has_moov = True
+            if faststart is None:
+                faststart = True
+            for child, child_start, child_end, child_overrun in _iter_boxes(buf, payload, payload_end):
+                if child_overrun:
+                    truncated = True
+                    break
+                if child == b'mvhd':
+                    duration = _read_mvhd(buf, child_start, child_end)
+                elif child == b'trak':
+                    handler, track_width, track_height, fourcc = _read_trak(buf, child_start, child_end)
+                    if handler == b'vide' and video_codec is None:
+                        video_codec, width, height = fourcc, track_width, track_height
+                    elif handler == b'soun' and audio_codec is None:
+                        audio_codec = fourcc
+    
+    return Mp4Info(brand, duration, width, height, video_codec, audio_codec, faststart, has_moov, truncated)
+
+def read_mp4_info(path):
+    """
+    Parse an MP4 file's boxes through a read-only memory map
+    
+    Nothing is copied besides the few header fields read and no process is
+    spawned, so this is cheap enough to run on every download.
+    
+    Returns:
+        Mp4Info/None: Parsed summary, or None if the file is not an MP4 or
+                      cannot be read
+    """
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < 8:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return parse_mp4(buf)
+    except (OSError, ValueError):
+        return None
+
+def mp4_verdict(path):
+    """
+    Decide from the box structure alone whether an MP4 is complete and playable
+    
+    Returns:
+        bool/None: True if complete, False if truncated or missing its moov
+                   index, None if the parser cannot decide (not an MP4, or a
+                   fragmented file without a duration in mvhd)
+    """
+    return info_verdict(read_mp4_info(path))
+
+def info_verdict(info):
+    """
+    Like mp4_verdict, for an Mp4Info that was already read
+    """
+    if info is None:
+        return None
+    if info.truncated or not info.has_moov:
+        return False
+    if not info.duration or not info.video_codec:
+        return None
+    return True
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Probe module for reading video metadata with ffprobe
+"""
+import os
+import json
+import shutil
+import logging
+import threading
+import subprocess
+from collections import OrderedDict, namedtuple
+
+# Everything validation, logging and conversion decisions need about a file
+MediaInfo = namedtuple('MediaInfo', [
+    'path', 'size', 'format_name', 'duration', 'bit_rate',
+    'video_codec', 'pix_fmt', 'width', 'height', 'fps', 'video_bit_rate',
+    'audio_codec',
+])
+
+# Probed files remembered per process
+CACHE_SIZE = 256
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _parse_rate(rate):
+    """Parse an ffprobe frame rate such as '30000/1001'"""
+    try:
+        num, _, den = str(rate).partition('/')
+        return float(num) / float(den or 1) if float(den or 1) else None
+    except (TypeError, ValueError):
+        return None
+
+def _as_number(value, cast=float):
+    try:
+        return cast(value) if value not in (None, 'N/A') else None
+    except (TypeError, ValueError):
+        return None
+
+def ffprobe_available():
+    """
+    Check whether ffprobe is installed
+    """
+    return shutil.which('ffprobe') is not None
+
+def parse_ffprobe_output(video_path, size, output):
+    """
+    Build a MediaInfo from `ffprobe -show_streams -show_format -of json` output
+    
+    Returns:
+        MediaInfo/None: Parsed metadata, or None if the output is not valid JSON
+    """
+    try:
+        data = json.loads(output)
+    except ValueError:
+        return None
+    
+    streams = data.get('streams') or []
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    fmt = data.get('format') or {}
+    
+    return MediaInfo(
+        path=video_path,
+        size=size,
+        format_name=fmt.get('format_name'),
+        duration=_as_number(fmt.get('duration')),
+        bit_rate=_as_number(fmt.get('bit_rate'), int),
+        video_codec=video.get('codec_name'),
+        pix_fmt=video.get('pix_fmt'),
+        width=_as_number(video.get('width'), int),
+        height=_as_number(video.get('height'), int),
+        fps=_parse_rate(video.get('avg_frame_rate')) or _parse_rate(video.get('r_frame_rate')),
+        video_bit_rate=_as_number(video.get('bit_rate'), int),
+        audio_codec=audio.get('codec_name'),
+    )
+
+def probe_media(video_path):
+    """
+    Read codec, format and stream details of a video with one cached ffprobe call
+    
+    Results are cached by path, size and modification time, so validation, upload
+    logging and conversion decisions share a single ffprobe run per file version.
+    
+    Args:
+        video_path (str): Path to the video file
+    
+    Returns:
+        MediaInfo/None: Video details, or None if ffprobe is missing or fails
+    """
+    try:
+        stat = os.stat(video_path)
+    except OSError:
+        return None
+    
+    key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_streams', '-show_format', '-of', 'json', video_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            errors='replace'
+        )
+    except (subprocess.SubprocessError, FileNotFoundError):
+        logging.debug("ffprobe not available, skipping probe")
+        return None
+    
+    if result.returncode != 0:
+        logging.warning(f"ffprobe failed for {video_path}: {result.stderr.strip()}")
+        return None
+    
+    info = parse_ffprobe_output(video_path, stat.st_size, result.stdout)
+    if info is None:
+        return None
+    
+    with _cache_lock:
+        _cache[key] = info
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
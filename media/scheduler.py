@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Transcode scheduler running ffmpeg jobs in a bounded, CPU-aware worker pool
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .convert import convert_video_format, convert_video_stream
+from .segments import convert_video_segmented
+from .utils import available_cores
+
+# Default niceness so transcodes yield to downloads, uploads and the rest of the box
+DEFAULT_NICE = 10
+
+class TranscodeScheduler:
+    """
+    Accept many conversion jobs and run them without oversubscribing the CPU
+    
+    At most `workers` ffmpeg processes run at once and each is limited to
+    `threads_per_job` encoder threads, so together they match the available cores.
+    Each worker thread only waits on its ffmpeg process, so threads are enough.
+    Streamed encodes from convert_stream() take the same slots, so they count
+    towards the cap too.
+    """
+    def __init__(self, workers=None, threads_per_job=None, nice=DEFAULT_NICE, segmented=False):
+        cores = available_cores()
+        # Long videos are split into one single-threaded segment per thread of the job
+        self.segmented = segmented
+        # x264 scales well up to a few threads, beyond that parallel jobs win
+        self.workers = max(1, workers or max(1, cores // 4))
+        self.threads_per_job = max(1, threads_per_job or cores // self.workers)
+        self.nice = nice
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transcode')
+        # One slot per running ffmpeg, shared by queued conversions and streamed encodes
+        self._slots = threading.BoundedSemaphore(self.workers)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._frames = 0
+        self._encode_seconds = 0.0
+        logging.info(
+            f"Transcode scheduler: {self.workers} workers x {self.threads_per_job} threads "
+            f"on {cores} cores, nice {self.nice}"
+        )
+
+    def submit(self, input_path, output_path=None):
+        """
+        Queue a conversion
+        
+        Returns:
+            concurrent.futures.Future: Resolves to the converted path, or None on failure
+        """
+        with self._lock:
+            self._queued += 1
+            depth = self._queued
+        logging.debug(f"Transcode queued: {input_path} (queue depth {depth})")
+        return self._executor.submit(self._run, input_path, output_path)
+
+    def convert(self, input_path, output_path=None):
+        """
+        Queue a conversion and wait for it
+        
+        Returns:
+            str/None: Converted path if successful, None otherwise
+        """
+        return self.submit(input_path, output_path).result()
+
+    def convert_stream(self, chunks, output_path):
+        """
+        Encode a downloading video in the calling thread once an ffmpeg slot is free
+        
+        Returns:
+            str/None: output_path if successful, None otherwise
+        """
+        with self._slots:
+            with self._lock:
+                self._running += 1
+            result = None
+            try:
+                result = convert_video_stream(chunks, output_path, self.threads_per_job, self.nice)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    if result:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+        return result
+
+    def map(self, input_paths):
+        """
+        Convert a batch of videos in parallel
+        
+        Returns:
+            list: Converted path (or None) for each input, in input order
+        """
+        futures = [self.submit(path) for path in input_paths]
+        return [future.result() for future in futures]
+
+    def _run(self, input_path, output_path):
+        with self._slots:
+            return self._convert(input_path, output_path)
+
+    def _convert(self, input_path, output_path):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        
+        job_stats = {}
+        result = None
+        try:
+            if self.segmented:
+                result = convert_video_segmented(
+                    input_path, output_path, segments=self.threads_per_job, threads_per_segment=1,
+                    nice=self.nice, job_stats=job_stats
+                )
+            else:
+                result = convert_video_format(
+                    input_path, output_path, threads=self.threads_per_job, nice=self.nice, job_stats=job_stats
+                )
+        finally:
+            with self._lock:
+                self._running -= 1
+                if result:
+                    self._completed += 1
+                else:
+                    self._failed += 1
+                encoded = job_stats.get('path') in ('encode', 'segmented')
+                if encoded and job_stats.get('frames'):
+                    self._frames += job_stats['frames']
+                    self._encode_seconds += job_stats['seconds']
+                depth = self._queued
+        
+        if encoded and job_stats.get('frames') and job_stats['seconds'] > 0:
+            logging.info(
+                f"Encoded {job_stats['frames']} frames at {job_stats['frames'] / job_stats['seconds']:.1f} fps "
+                f"(queue depth {depth})"
+            )
+        return result
+
+    def stats(self):
+        """
+        Get the current queue depth, job counters and mean encode speed
+        """
+        with self._lock:
+            return {
+                'queued': self._queued,
+                'running': self._running,
+                'completed': self._completed,
+                'failed': self._failed,
+                'encode_fps': self._frames / self._encode_seconds if self._encode_seconds else 0.0,
+            }
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting jobs and optionally wait for running ones
+        """
+        self._executor.shutdown(wait=wait)
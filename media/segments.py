@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Parallel segment transcoding for long videos
+"""
+import os
+import glob
+import time
+import shutil
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from .probe import probe_media
+from .utils import available_cores
+from .convert import (
+    VIDEO_ENCODE_ARGS, AUDIO_ENCODE_ARGS, remux_plan, run_ffmpeg, with_threads, encoded_frames,
+    convert_video_format
+)
+
+# Shorter clips gain little from splitting and take the single-pass encode
+SEGMENT_MIN_DURATION = 120
+# Segments shorter than this spend more time on setup than on encoding
+MIN_SEGMENT_SECONDS = 10
+
+def segment_video_args():
+    """
+    VIDEO_ENCODE_ARGS with the frame rate conversion done by an fps filter instead of -r
+    
+    The segments keep their source timestamps, so the filter snaps every segment
+    to the same 30 fps grid of the whole video. Resampling each segment on its own
+    would round each one's duration to a frame and the video would drift away
+    from the audio, which is encoded in one piece, a little more at every join.
+    """
+    args = []
+    pairs = zip(VIDEO_ENCODE_ARGS[::2], VIDEO_ENCODE_ARGS[1::2])
+    for option, value in pairs:
+        if option == '-r':
+            continue
+        if option == '-vf':
+            # Start the encoded segment at zero again once its frames are on the grid
+            value = f"fps=30,setpts=PTS-STARTPTS,{value}"
+        args += [option, value]
+    return args
+
+def convert_video_segmented(input_path, output_path=None, segments=None, threads_per_segment=1,
+                            nice=None, min_duration=SEGMENT_MIN_DURATION, job_stats=None):
+    """
+    Convert a long video by encoding keyframe-aligned segments in parallel
+    
+    The video stream is split at keyframes with stream copy, the segments are
+    encoded concurrently with the same settings as convert_video_format (see
+    segment_video_args for the frame rate), and the
+    results are joined with the concat demuxer without re-encoding. The audio is
+    encoded once from the source as a whole, so it cannot drift at segment
+    boundaries. Short or already-compliant videos take convert_video_format.
+    
+    Args:
+        input_path (str): Source video
+        output_path (str): Destination (defaults to <input>_converted.mp4)
+        segments (int): Number of segments (defaults to the available cores)
+        threads_per_segment (int): Encoder threads per segment
+        nice (int): Run ffmpeg at this niceness
+        min_duration (float): Videos shorter than this are encoded in one pass
+        job_stats (dict): Filled with the path taken, elapsed seconds, frames encoded and segment count
+    
+    Returns:
+        str/None: output_path if successful, None otherwise
+    """
+    if output_path is None:
+        output_path = input_path.replace('.mp4', '_converted.mp4')
+    if job_stats is None:
+        job_stats = {}
+    
+    info = probe_media(input_path)
+    duration = info.duration if info else None
+    requested = segments or available_cores()
+    segments = min(requested, int((duration or 0) // MIN_SEGMENT_SECONDS))
+    # Fewer segments than asked for still get all the threads the job was given
+    threads = threads_per_segment * requested
+    
+    if not duration or duration < min_duration or segments < 2 or remux_plan(info)[0]:
+        return convert_video_format(input_path, output_path, threads=threads, nice=nice, job_stats=job_stats)
+    threads_per_segment = max(threads_per_segment, threads // segments)
+    
+    work_dir = tempfile.mkdtemp(prefix='segments_', dir=os.path.dirname(os.path.abspath(output_path)))
+    start = time.monotonic()
+    try:
+        # 1. Split the video stream at keyframes without re-encoding
+        split_cmd = [
+            'ffmpeg', '-y', '-i', input_path,
+            '-map', '0:v:0', '-c', 'copy',
+            '-f', 'segment', '-segment_time', f"{duration / segments:.3f}",
+            '-segment_format', 'matroska',
+            os.path.join(work_dir, 'source_%04d.mkv')
+        ]
+        if not run_ffmpeg(split_cmd, nice)[0]:
+            return None
+        sources = sorted(glob.glob(os.path.join(work_dir, 'source_*.mkv')))
+        logging.info(f"Split {input_path} into {len(sources)} segments")
+        
+        # 2. Encode every segment, plus the whole audio track, in parallel
+        def encode_segment(source):
+            target = source.replace('source_', 'encoded_').replace('.mkv', '.mp4')
+            cmd = ['ffmpeg', '-y', '-copyts', '-i', source] + segment_video_args() + ['-an', target]
+            success, stderr = run_ffmpeg(with_threads(cmd, threads_per_segment), nice)
+            return (target, encoded_frames(stderr)) if success else None
+        
+        def encode_audio():
+            if info.audio_codec is None:
+                return ''
+            target = os.path.join(work_dir, 'audio.m4a')
+            cmd = ['ffmpeg', '-y', '-i', input_path, '-vn', '-map', '0:a:0'] + AUDIO_ENCODE_ARGS + [target]
+            return target if run_ffmpeg(cmd, nice)[0] else None
+        
+        with ThreadPoolExecutor(max_workers=len(sources) + 1) as executor:
+            audio_future = executor.submit(encode_audio)
+            encoded = list(executor.map(encode_segment, sources))
+            audio = audio_future.result()
+        
+        if not all(encoded) or audio is None:
+            logging.error("Segment encoding failed")
+            return None
+        
+        # 3. Join the segments losslessly and mux the audio back in
+        list_file = os.path.join(work_dir, 'segments.txt')
+        with open(list_file, 'w', encoding='utf-8') as f:
+            for path, _ in encoded:
+                f.write(f"file '{os.path.basename(path)}'\n")
+        
+        concat_cmd = ['ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', list_file]
+        if audio:
+            concat_cmd += ['-i', audio, '-map', '0:v:0', '-map', '1:a:0']
+        concat_cmd += ['-c', 'copy', '-movflags', '+faststart', output_path]
+        if not run_ffmpeg(concat_cmd, nice)[0]:
+            return None
+        
+        elapsed = time.monotonic() - start
+        frames = [count for _, count in encoded]
+        job_stats.update({
+            'path': 'segmented', 'seconds': elapsed, 'segments': len(sources),
+            'frames': sum(frames) if all(frames) else None,
+        })
+        logging.info(f"Segmented conversion of {len(sources)} segments successful in {elapsed:.1f}s")
+        return output_path
+    except Exception as e:
+        logging.error(f"Error converting video in segments: {e}")
+        return None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
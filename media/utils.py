@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Utility functions for the media module
+"""
+import os
+import math
+
+# cgroup v2 exposes "<quota> <period>", v1 splits them over two files
+CGROUP_V2_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+CGROUP_V1_QUOTA = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+CGROUP_V1_PERIOD = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+
+def _read_first_line(path):
+    try:
+        with open(path, 'r', encoding='ascii') as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+def cgroup_cpu_limit():
+    """
+    Get the CPU quota of this process's cgroup in cores, rounded up
+
+    Returns:
+        int/None: Cores allowed by the quota, or None without a quota
+    """
+    quota = period = None
+    line = _read_first_line(CGROUP_V2_CPU_MAX)
+    if line:
+        parts = line.split()
+        if len(parts) == 2 and parts[0] != 'max':
+            quota, period = parts
+    else:
+        quota, period = _read_first_line(CGROUP_V1_QUOTA), _read_first_line(CGROUP_V1_PERIOD)
+    try:
+        quota, period = int(quota), int(period)
+    except (TypeError, ValueError):
+        return None
+    if quota <= 0 or period <= 0:
+        # -1 means no quota in cgroup v1
+        return None
+    return max(1, math.ceil(quota / period))
+
+def available_cores():
+    """
+    Get the number of cores this process may run on (respects CPU affinity and cgroup CPU quotas)
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    if limit:
+        cores = min(cores, limit)
+    return max(1, cores)
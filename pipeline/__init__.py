@@ -0,0 +1,6 @@
+#!/usr/bin/env python3
+"""
+Pipeline package for running the download, transcode and upload stages concurrently
+"""
+
+# Package initialization
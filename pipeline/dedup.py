@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Deduplication index of the notes and video contents already posted
+"""
+import sqlite3
+import hashlib
+import threading
+
+DEDUP_FILE = 'dedup.db'
+
+# Kinds of keys in the index
+NOTE = 0
+CONTENT = 1
+
+# Bytes read at a time when hashing a video file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def _key(value):
+    """64-bit signed integer key of a note ID or content digest"""
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+def file_digest(path):
+    """
+    Hash the contents of a video file
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class DedupIndex:
+    """
+    Persistent set of posted note IDs and content hashes
+
+    Keys are stored as 64-bit hashes in a WITHOUT ROWID table, about 16 bytes
+    per entry on disk, so a million entries take about 15 MB of disk and
+    only SQLite's page cache in memory, and opening the index reads nothing up
+    front. A 64-bit key makes a false "already posted" practically impossible
+    at this size.
+
+    Keys are reserved while their job is in flight so concurrent jobs for the
+    same note cannot both pass the check, and only written to disk by commit()
+    once the job has been posted.
+    """
+    def __init__(self, path=DEDUP_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reserved = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS seen ('
+            'kind INTEGER NOT NULL, key INTEGER NOT NULL, PRIMARY KEY (kind, key)) WITHOUT ROWID'
+        )
+        self._conn.commit()
+
+    def _seen(self, kind, key):
+        return self._conn.execute('SELECT 1 FROM seen WHERE kind = ? AND key = ?', (kind, key)).fetchone() is not None
+
+    def reserve(self, owner, kind, value):
+        """
+        Claim a note ID or content digest for a job
+
+        Args:
+            owner: Identifier of the job, e.g. its job ID
+
+        Returns:
+            bool: True if the key is new, False if it was posted or another job holds it
+        """
+        key = (kind, _key(value))
+        with self._lock:
+            holder = next((o for o, keys in self._reserved.items() if key in keys), None)
+            if (holder is not None and holder != owner) or self._seen(*key):
+                return False
+            self._reserved.setdefault(owner, set()).add(key)
+            return True
+
+    def commit(self, owner):
+        """
+        Record every key reserved by a job as posted
+        """
+        with self._lock:
+            keys = self._reserved.pop(owner, ())
+            if keys:
+                self._conn.executemany('INSERT OR IGNORE INTO seen (kind, key) VALUES (?, ?)', list(keys))
+                self._conn.commit()
+
+    def release(self, owner):
+        """
+        Drop a job's reservations without recording them, e.g. after it failed
+        """
+        with self._lock:
+            self._reserved.pop(owner, None)
+
+_dedup_index = None
+_index_lock = threading.Lock()
+
+def get_dedup_index(path=DEDUP_FILE):
+    """
+    Get the process-wide dedup index
+    """
+    global _dedup_index
+    with _index_lock:
+        if _dedup_index is None:
+            _dedup_index = DedupIndex(path)
+        return _dedup_index
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Durable SQLite job queue for the URLs being processed
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+
+JOBS_FILE = 'jobs.db'
+
+# Job states, in the order a job normally moves through them
+QUEUED = 'queued'
+DOWNLOADING = 'downloading'
+TRANSCODING = 'transcoding'
+UPLOADING = 'uploading'
+DONE = 'done'
+FAILED = 'failed'
+STATES = (QUEUED, DOWNLOADING, TRANSCODING, UPLOADING, DONE, FAILED)
+ACTIVE_STATES = (DOWNLOADING, TRANSCODING, UPLOADING)
+
+# Claims made per job before it is marked failed for good
+MAX_ATTEMPTS = 3
+# Delay before the first retry, doubled for every further attempt
+RETRY_DELAY = 300
+# Active jobs not updated for this long belong to a process that died
+STALE_AFTER = 6 * 3600
+# Leading bytes of the url file remembered to notice it was replaced
+FINGERPRINT_BYTES = 256
+# A last line without a newline is taken as complete once the file is this old
+SETTLE_SECONDS = 2.0
+
+Job = namedtuple('Job', ['id', 'url', 'state', 'attempts', 'video_path', 'caption', 'account'])
+
+def parse_line(line):
+    """
+    Split a url file line into the URL and the account it is pinned to
+
+    A line is a URL optionally followed by an account name, e.g.
+    "https://xhslink.com/abc @travel_account"; the @ is optional.
+
+    Returns:
+        tuple: (url, account or None)
+    """
+    parts = line.split()
+    if not parts:
+        return None, None
+    account = parts[1].lstrip('@') if len(parts) > 1 else None
+    return parts[0], account or None
+
+class JobStore:
+    """
+    Persistent queue of URL jobs with states, attempt counts and retry times
+
+    Every URL is stored once. Workers claim due jobs with claim(), report
+    progress with advance() and finish them with complete() or fail(); failed
+    jobs are retried with exponential backoff until MAX_ATTEMPTS claims were
+    used. The url file is only read as an import source, from the byte offset
+    reached by the previous ingest().
+    """
+    def __init__(self, path=JOBS_FILE, max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        # Autocommit, transactions are opened explicitly where several statements must agree
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL UNIQUE, '
+            "state TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0, "
+            'next_attempt_at REAL NOT NULL DEFAULT 0, video_path TEXT, caption TEXT, media_id TEXT, '
+            'last_error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, account TEXT)'
+        )
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}
+        if 'account' not in columns:
+            # Queues created before jobs could be pinned to an account
+            self._conn.execute('ALTER TABLE jobs ADD COLUMN account TEXT')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, next_attempt_at, id)')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS ingest_offsets ('
+            'path TEXT PRIMARY KEY, offset INTEGER NOT NULL, inode INTEGER, fingerprint TEXT)'
+        )
+
+    def add(self, url, account=None):
+        """
+        Queue a URL, optionally pinned to the account that should upload it
+
+        Returns:
+            bool: True if it was added, False if the URL is already known
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT OR IGNORE INTO jobs (url, account, created_at, updated_at) VALUES (?, ?, ?, ?)',
+                (url, account, now, now)
+            )
+            return cursor.rowcount > 0
+
+    def _fingerprint(self, f, length):
+        f.seek(0)
+        return hashlib.sha1(f.read(min(length, FINGERPRINT_BYTES))).hexdigest()
+
+    def ingest(self, url_file):
+        """
+        Queue the URLs appended to a url file since the last call
+
+        Only complete lines are consumed, so a line still being written is
+        picked up next time; a last line without a newline counts as complete
+        once the file has not changed for SETTLE_SECONDS. If the file was
+        replaced or truncated it is read again from the start; URLs already
+        known are skipped. See parse_line() for the line format.
+
+        Returns:
+            int: Number of new jobs
+        """
+        try:
+            f = open(url_file, 'rb')
+        except FileNotFoundError:
+            return 0
+
+        with f, self._lock:
+            info = os.fstat(f.fileno())
+            key = os.path.abspath(url_file)
+            row = self._conn.execute(
+                'SELECT offset, inode, fingerprint FROM ingest_offsets WHERE path = ?', (key,)
+            ).fetchone()
+
+            offset = 0
+            if row and row[1] == info.st_ino and row[0] <= info.st_size and row[2] == self._fingerprint(f, row[0]):
+                offset = row[0]
+            if offset == info.st_size:
+                return 0
+
+            f.seek(offset)
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data) and time.time() - info.st_mtime >= SETTLE_SECONDS:
+                end = len(data)
+            if end == 0:
+                return 0
+
+            now = time.time()
+            lines = [parse_line(line) for line in data[:end].decode('utf-8', errors='replace').splitlines()]
+            offset += end
+
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                added = 0
+                for url, account in lines:
+                    if url:
+                        added += self._conn.execute(
+                            'INSERT OR IGNORE INTO jobs (url, account, created_at, updated_at) VALUES (?, ?, ?, ?)',
+                            (url, account, now, now)
+                        ).rowcount
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO ingest_offsets (path, offset, inode, fingerprint) VALUES (?, ?, ?, ?)',
+                    (key, offset, info.st_ino, self._fingerprint(f, offset))
+                )
+                self._conn.execute('COMMIT')
+            except sqlite3.Error:
+                self._conn.execute('ROLLBACK')
+                raise
+
+        if added:
+            logging.info(f"Queued {added} new URLs from {url_file}")
+        return added
+
+    def claim(self, state=DOWNLOADING):
+        """
+        Take the oldest due queued job and move it to state
+
+        Returns:
+            Job/None: The claimed job, or None if nothing is due
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT id, url, attempts, video_path, caption, account FROM jobs '
+                    'WHERE state = ? AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT 1',
+                    (QUEUED, now)
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        'UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                        (state, now, row[0])
+                    )
+                self._conn.execute('COMMIT')
+            except sqlite3.Error:
+                self._conn.execute('ROLLBACK')
+                raise
+
+        if row is None:
+            return None
+        return Job(row[0], row[1], state, row[2] + 1, row[3], row[4], row[5])
+
+    def advance(self, job_id, state, video_path=None, caption=None):
+        """
+        Record that a job moved to another state, with its current file and caption
+        """
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, video_path = COALESCE(?, video_path), '
+                'caption = COALESCE(?, caption), updated_at = ? WHERE id = ?',
+                (state, video_path, caption, time.time(), job_id)
+            )
+
+    def complete(self, job_id, media_id=None):
+        """
+        Mark a job done
+        """
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, media_id = ?, last_error = NULL, updated_at = ? WHERE id = ?',
+                (DONE, media_id, time.time(), job_id)
+            )
+
+    def defer(self, job_id, until):
+        """
+        Put a job back in the queue until a timestamp without counting the attempt
+        """
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, attempts = MAX(attempts - 1, 0), next_attempt_at = ?, updated_at = ? '
+                'WHERE id = ?',
+                (QUEUED, until, time.time(), job_id)
+            )
+
+    def fail(self, job_id, error=None):
+        """
+        Put a job back in the queue with a backoff delay, or fail it for good
+
+        Jobs that are no longer active, e.g. completed as a duplicate, are left alone.
+
+        Returns:
+            bool: True if the job will be retried
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT attempts, state FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None or row[1] not in ACTIVE_STATES:
+                return False
+            attempts = row[0]
+            retry = attempts < self.max_attempts
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, next_attempt_at = ?, last_error = ?, updated_at = ? WHERE id = ?',
+                (QUEUED if retry else FAILED, now + self.retry_delay * 2 ** max(0, attempts - 1),
+                 error, now, job_id)
+            )
+        return retry
+
+    def recover(self, stale_after=STALE_AFTER):
+        """
+        Requeue active jobs that have not been updated for stale_after seconds
+
+        Returns:
+            int: Number of jobs requeued
+        """
+        placeholders = ', '.join('?' for _ in ACTIVE_STATES)
+        with self._lock:
+            cursor = self._conn.execute(
+                f'UPDATE jobs SET state = ?, updated_at = ? WHERE state IN ({placeholders}) AND updated_at < ?',
+                (QUEUED, time.time(), *ACTIVE_STATES, time.time() - stale_after)
+            )
+        if cursor.rowcount:
+            logging.warning(f"Requeued {cursor.rowcount} jobs left active by an earlier run")
+        return cursor.rowcount
+
+    def due(self):
+        """
+        Count queued jobs whose retry time has come
+        """
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM jobs WHERE state = ? AND next_attempt_at <= ?', (QUEUED, time.time())
+            ).fetchone()[0]
+
+    def next_due(self):
+        """
+        Get when the next queued job becomes due
+
+        Returns:
+            float/None: Timestamp (possibly in the past), or None if nothing is queued
+        """
+        with self._lock:
+            return self._conn.execute(
+                'SELECT MIN(next_attempt_at) FROM jobs WHERE state = ?', (QUEUED,)
+            ).fetchone()[0]
+
+    def counts(self):
+        """
+        Get the number of jobs in each state
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(rows)
+        return counts
+
+_job_store = None
+_store_lock = threading.Lock()
+
+def get_job_store(path=JOBS_FILE):
+    """
+    Get the process-wide job store
+    """
+    global _job_store
+    with _store_lock:
+        if _job_store is None:
+            _job_store = JobStore(path)
+        return _job_store
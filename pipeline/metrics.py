@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Per-stage latency, throughput and byte metrics in the Prometheus text format
+"""
+import os
+import time
+import inspect
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+
+PREFIX = 'rednote'
+# Stage latencies range from cache hits to long encodes and uploads
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+DELAY_BUCKETS = (0.1, 0.5, 1, 2, 3, 5, 10, 30, 60, 300)
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = f"{PREFIX}_{name}"
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. calls or bytes"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """A value that is set, e.g. a timestamp"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with their sum and count"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def _render_value(self, key, value):
+        counts, total = value
+        lines = [
+            f"{self.name}_bucket{_format_labels(self.labels, key, [('le', _format_value(bound))])} {count}"
+            for bound, count in zip(self.buckets, counts)
+        ]
+        lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {counts[-1]}")
+        return lines
+
+class Registry:
+    """
+    The metrics of this process, rendered together
+    """
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    'stage_duration_seconds', 'Time spent in one call of a processing stage', ['stage']
+))
+STAGE_CALLS = REGISTRY.register(Counter(
+    'stage_calls_total', 'Calls of a processing stage by result', ['stage', 'result']
+))
+STAGE_BYTES = REGISTRY.register(Counter(
+    'stage_bytes_total', 'Bytes fetched, written or uploaded by a processing stage', ['stage']
+))
+HOST_DELAY = REGISTRY.register(Histogram(
+    'host_delay_seconds', 'Politeness wait before a request to a paced host', ['host'], DELAY_BUCKETS
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'cache_lookups_total', 'Lookups in the downloader caches by result', ['cache', 'result']
+))
+LAST_RUN = REGISTRY.register(Gauge(
+    'last_run_timestamp_seconds', 'Unix time at which the last processing run finished'
+))
+
+class StageTimer:
+    """
+    Handle of a running stage measurement, see track()
+    """
+    def __init__(self, stage):
+        self.stage = stage
+        self.failed = False
+        self.bytes = 0
+
+    def fail(self):
+        self.failed = True
+
+    def add_bytes(self, count):
+        self.bytes += count
+
+@contextmanager
+def track(stage):
+    """
+    Time a block as one call of a stage
+
+    The call counts as failed if the block raises or calls fail() on the
+    yielded StageTimer; bytes reported with add_bytes() are added to the
+    stage's byte counter.
+    """
+    timer = StageTimer(stage)
+    start = time.perf_counter()
+    try:
+        yield timer
+    except BaseException:
+        timer.failed = True
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+        STAGE_CALLS.inc(stage=stage, result='failure' if timer.failed else 'success')
+        if timer.bytes:
+            STAGE_BYTES.inc(timer.bytes, stage=stage)
+
+def file_size(path):
+    """Size of a file in bytes, 0 if it does not exist"""
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+def timed(stage, ok=bool, size=None):
+    """
+    Decorate a function (or coroutine function) so every call is tracked as a stage
+
+    Args:
+        stage (str): Stage name
+        ok (callable): Decides from the return value whether the call succeeded
+        size (callable): Bytes handled, from the return value; 'file' for the size of a returned path
+    """
+    if size == 'file':
+        size = file_size
+
+    def finish(timer, result):
+        if not ok(result):
+            timer.fail()
+        elif size:
+            timer.add_bytes(size(result))
+        return result
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with track(stage) as timer:
+                    return finish(timer, await func(*args, **kwargs))
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(stage) as timer:
+                return finish(timer, func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+def run_finished():
+    LAST_RUN.set(time.time())
+
+def write_textfile(path):
+    """
+    Write the metrics to a file for node_exporter's textfile collector
+
+    The file is replaced atomically, so the collector never reads half of it.
+    node_exporter only picks up files ending in .prom.
+    """
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_file, path)
+
+def start_http_server(port, addr='127.0.0.1'):
+    """
+    Serve the metrics at http://addr:port/metrics from a background thread
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f"Serving metrics at http://{addr}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Staged pipeline connecting worker pools with bounded queues
+"""
+import queue
+import logging
+import threading
+
+# Marker telling a worker that no more items will arrive on its queue
+_STOP = object()
+
+class Stage:
+    """
+    A single pipeline stage: a function applied to every item by a pool of worker threads
+
+    The function receives the item produced by the previous stage and returns the
+    item for the next one. Returning None (or raising) drops the item.
+    """
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+
+class StagedPipeline:
+    """
+    Run items through a chain of stages, each with its own worker pool
+
+    Stages are connected by bounded queues, so a slow stage applies back-pressure
+    to the stages before it instead of letting work pile up in memory. Network-bound,
+    CPU-bound and rate-limited stages therefore overlap and the whole batch drains
+    at the speed of the slowest stage.
+    """
+    def __init__(self, stages, queue_size=4):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = list(stages)
+        self.queue_size = max(1, int(queue_size))
+
+    def run(self, items):
+        """
+        Feed items through every stage and block until all queues are drained
+
+        Args:
+            items (iterable): Items for the first stage
+
+        Returns:
+            tuple: (results, stats) where results lists the outputs of the last stage
+                   and stats maps each stage name to its processed/failed counts
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        stats = {stage.name: {'processed': 0, 'failed': 0} for stage in self.stages}
+        remaining = [stage.workers for stage in self.stages]
+        results = []
+        lock = threading.Lock()
+
+        def worker(index):
+            stage = self.stages[index]
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+
+            while True:
+                item = inbox.get()
+                if item is _STOP:
+                    break
+
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    logging.error(f"[{stage.name}] Unhandled error: {e}")
+                    result = None
+
+                with lock:
+                    stats[stage.name]['failed' if result is None else 'processed'] += 1
+
+                if result is None:
+                    continue
+                if outbox is not None:
+                    outbox.put(result)
+                else:
+                    with lock:
+                        results.append(result)
+
+            # The last worker to leave a stage closes the next stage's queue
+            with lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last and outbox is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    outbox.put(_STOP)
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(target=worker, args=(index,), name=f"{stage.name}-{n + 1}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            # Even if items raised, let the workers finish what they have and stop
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_STOP)
+            for thread in threads:
+                thread.join()
+
+        for stage in self.stages:
+            logging.info(
+                f"Stage {stage.name}: {stats[stage.name]['processed']} processed, "
+                f"{stats[stage.name]['failed']} failed"
+            )
+
+        return results, stats
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Wait for changes to the url file and the drop directory
+"""
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+# A burst of events ends once nothing happened for this long
+COALESCE_WINDOW = 0.5
+# A burst is cut off after this long even if events keep coming
+MAX_COALESCE = 5.0
+# Stat polling starts at MIN_POLL and backs off to MAX_POLL while nothing changes
+MIN_POLL = 1.0
+MAX_POLL = 60.0
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+class InotifyWatcher:
+    """
+    Block until the url file or a file in the drop directory changes, using inotify
+
+    The url file's directory is watched rather than the file itself, so
+    editors that save by writing a new file and renaming it are noticed too.
+    """
+    def __init__(self, url_file, drop_dir=None):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        # Watch descriptor -> file name of interest in that directory, None for any
+        self._watches = {}
+        targets = [(os.path.dirname(os.path.abspath(url_file)), os.path.basename(url_file))]
+        if drop_dir:
+            targets.append((os.path.abspath(drop_dir), None))
+        for directory, name in targets:
+            wd = libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                os.close(self._fd)
+                raise OSError(error, f'inotify_add_watch failed for {directory}')
+            if wd in self._watches and self._watches[wd] != name:
+                # Drop directory and url file share a directory, any change counts
+                name = None
+            self._watches[wd] = name
+
+    def _drain(self, timeout):
+        """Read pending events for up to timeout seconds, True if a relevant one arrived"""
+        readable, _, _ = select.select([self._fd], [], [], max(0, timeout))
+        if not readable:
+            return False
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return False
+            raise
+
+        relevant = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                relevant = True
+            elif wd in self._watches:
+                wanted = self._watches[wd]
+                relevant = relevant or wanted is None or os.fsdecode(name) == wanted
+        return relevant
+
+    def wait(self, timeout):
+        """
+        Wait for a change, then keep collecting events until the burst is over
+
+        Returns:
+            bool: True if something changed, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while not self._drain(deadline - time.monotonic()):
+            if time.monotonic() >= deadline:
+                return False
+
+        burst_end = time.monotonic() + MAX_COALESCE
+        while time.monotonic() < burst_end and self._drain(min(COALESCE_WINDOW, burst_end - time.monotonic())):
+            pass
+        return True
+
+    def close(self):
+        os.close(self._fd)
+
+class PollingWatcher:
+    """
+    Block until the url file or the drop directory changes, by polling their stat data
+
+    The poll interval doubles from MIN_POLL up to MAX_POLL while nothing
+    changes and drops back after a change.
+    """
+    def __init__(self, url_file, drop_dir=None):
+        self.url_file = url_file
+        self.drop_dir = drop_dir
+        self.interval = MIN_POLL
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        paths = [self.url_file]
+        if self.drop_dir and os.path.isdir(self.drop_dir):
+            paths.extend(os.path.join(self.drop_dir, name) for name in os.listdir(self.drop_dir))
+        snapshot = {}
+        for path in paths:
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (info.st_mtime_ns, info.st_size, info.st_ino)
+        return snapshot
+
+    def wait(self, timeout):
+        """
+        Wait for a change, then keep polling until the files stop changing
+
+        Returns:
+            bool: True if something changed, False on timeout
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.interval, remaining))
+            snapshot = self._take_snapshot()
+            if snapshot != self._snapshot:
+                break
+            self.interval = min(self.interval * 2, MAX_POLL)
+
+        burst_end = time.monotonic() + MAX_COALESCE
+        while time.monotonic() < burst_end:
+            self._snapshot = snapshot
+            time.sleep(COALESCE_WINDOW)
+            snapshot = self._take_snapshot()
+            if snapshot == self._snapshot:
+                break
+        self._snapshot = snapshot
+        self.interval = MIN_POLL
+        return True
+
+    def close(self):
+        pass
+
+def create_watcher(url_file, drop_dir=None):
+    """
+    Get an inotify watcher where the platform supports it, a polling watcher otherwise
+    """
+    try:
+        return InotifyWatcher(url_file, drop_dir)
+    except (OSError, AttributeError) as e:
+        logging.info(f"inotify unavailable ({e}), polling for URL file changes instead")
+        return PollingWatcher(url_file, drop_dir)
@@ -4,7 +4,6 @@ Main module for uploader package, providing command-line interface
 """
 import sys
 import argparse
-from .upload import upload_reel
 
 def main():
     """
@@ -17,6 +16,9 @@ def main():
     
     args = parser.parse_args()
     
+    # Imported after parsing so --help and usage errors skip the instagrapi import
+    from .upload import upload_reel
+    
     # Upload the video
     upload_result = upload_reel(args.video, args.caption, debug=args.debug)
     
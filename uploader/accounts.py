@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Roster of Instagram accounts that uploads are spread across
+"""
+import os
+import json
+import time
+import logging
+import threading
+from .scheduler import get_upload_scheduler
+
+# JSON list of accounts, overridden by INSTAGRAM_ACCOUNTS_FILE; without it the single INSTAGRAM_USERNAME account is used
+ACCOUNTS_FILE = 'accounts.json'
+# An account that failed to log in rests this long, doubled for every further failure in a row
+LOGIN_FAILURE_COOLDOWN = 1800
+# An account that hit a challenge or checkpoint needs a human, so it rests much longer
+CHALLENGE_COOLDOWN = 24 * 3600
+
+# instagrapi exceptions that mean the account itself needs attention, matched by name
+ACCOUNT_ERRORS = {
+    'ChallengeRequired', 'ChallengeUnknownStep', 'ChallengeError', 'SelectContactPointRecoveryForm',
+    'RecaptchaChallengeForm', 'SubmitPhoneNumberForm', 'BadPassword', 'UserNotFound',
+    'AccountSuspended', 'TwoFactorRequired', 'ConsentRequired',
+}
+
+def is_account_error(error):
+    """
+    Check whether an upload error means the account is locked out rather than the upload failing
+    """
+    return bool(ACCOUNT_ERRORS & {cls.__name__ for cls in type(error).__mro__})
+
+class Account:
+    """
+    One Instagram account with its session file, budgets and health
+
+    A session_file of None means the default session.pkl of uploader.auth.
+    """
+    def __init__(self, username, password, session_file=None, hourly_limit=None, daily_limit=None):
+        self.username = username
+        self.password = password
+        self.session_file = session_file
+        self.hourly_limit = hourly_limit
+        self.daily_limit = daily_limit
+        self.busy = False
+        self.login_failures = 0
+        self.disabled_until = 0.0
+        self.disabled_reason = None
+        self.uploads = 0
+
+    def available(self, now=None):
+        return not self.busy and self.disabled_until <= (now or time.time())
+
+    def __repr__(self):
+        return f"Account({self.username})"
+
+class AccountRoster:
+    """
+    Route uploads to accounts with spare budget and keep unhealthy accounts out of rotation
+
+    Each account has its own session file, client and upload budget, and
+    each takes one upload at a time, so with several upload workers the
+    accounts post in parallel. An account that fails to log in or hits a
+    challenge is rested while the others carry on.
+    """
+    def __init__(self, accounts):
+        if not accounts:
+            raise ValueError("The account roster is empty")
+        self.accounts = {account.username: account for account in accounts}
+        self._lock = threading.Lock()
+        scheduler = get_upload_scheduler()
+        for account in accounts:
+            scheduler.configure(account.username, account.hourly_limit, account.daily_limit)
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def acquire(self, pinned=None, max_wait=0):
+        """
+        Take an account that may upload now, waiting up to max_wait seconds for one
+
+        Args:
+            pinned (str): Only consider this account
+
+        Returns:
+            tuple: (account, 0) on success, or (None, seconds until an account may be free)
+        """
+        scheduler = get_upload_scheduler()
+        deadline = time.time() + max_wait
+        while True:
+            with self._lock:
+                now = time.time()
+                candidates = [self.accounts[pinned]] if pinned in self.accounts else (
+                    [] if pinned else list(self.accounts.values()))
+                if not candidates:
+                    logging.error(f"Account {pinned} is not in the roster")
+                    return None, float('inf')
+
+                waits = []
+                # Least used first, so the load spreads evenly
+                for account in sorted(candidates, key=lambda a: a.uploads):
+                    if not account.available(now):
+                        if not account.busy:
+                            waits.append(account.disabled_until - now)
+                        continue
+                    wait = scheduler.acquire(account.username)
+                    if not wait:
+                        account.busy = True
+                        return account, 0.0
+                    waits.append(wait)
+
+            # Only busy accounts left: one frees up within an upload, check again shortly
+            wait = min(waits) if waits else 5.0
+            if time.time() + wait > deadline:
+                return None, wait
+            time.sleep(min(wait, 5.0))
+
+    def release(self, account):
+        """
+        Hand an account back after its upload finished
+        """
+        with self._lock:
+            account.busy = False
+
+    def wait_time(self):
+        """
+        Get how long until any account may upload, ignoring accounts busy right now
+
+        Returns:
+            float: Seconds, 0 if an account has capacity
+        """
+        scheduler = get_upload_scheduler()
+        now = time.time()
+        with self._lock:
+            waits = [
+                max(account.disabled_until - now, scheduler.wait_time(account.username))
+                for account in self.accounts.values()
+            ]
+        return max(0.0, min(waits))
+
+    def succeeded(self, account):
+        with self._lock:
+            account.uploads += 1
+            account.login_failures = 0
+
+    def login_failed(self, account):
+        """
+        Rest an account that could not log in, longer with every failure in a row
+        """
+        with self._lock:
+            account.login_failures += 1
+            cooldown = LOGIN_FAILURE_COOLDOWN * 2 ** (account.login_failures - 1)
+            self._disable(account, cooldown, "login failed")
+
+    def account_failed(self, account, error):
+        """
+        Take an account out of rotation after a challenge, checkpoint or credential error
+        """
+        with self._lock:
+            self._disable(account, CHALLENGE_COOLDOWN, type(error).__name__)
+
+    def _disable(self, account, cooldown, reason):
+        account.disabled_until = time.time() + cooldown
+        account.disabled_reason = reason
+        remaining = sum(1 for a in self.accounts.values() if a.disabled_until <= time.time())
+        logging.warning(
+            f"Account {account.username} out of rotation for {cooldown / 60:.0f} minutes ({reason}), "
+            f"{remaining} of {len(self.accounts)} accounts left"
+        )
+
+    def stats(self):
+        """
+        Get the uploads and health of each account
+        """
+        now = time.time()
+        with self._lock:
+            return {
+                account.username: {
+                    'uploads': account.uploads,
+                    'healthy': account.disabled_until <= now,
+                    'reason': account.disabled_reason if account.disabled_until > now else None,
+                }
+                for account in self.accounts.values()
+            }
+
+def load_accounts(path=None):
+    """
+    Read the account roster
+
+    The file holds a JSON list of objects with "username" and either
+    "password" or "password_env" (the name of an environment variable holding
+    it), plus optional "session_file", "hourly_limit" and "daily_limit". If it
+    does not exist, the INSTAGRAM_USERNAME/INSTAGRAM_PASSWORD account is used
+    with the usual session.pkl.
+
+    Args:
+        path (str): Roster file (defaults to INSTAGRAM_ACCOUNTS_FILE, then accounts.json)
+
+    Returns:
+        list: Accounts
+    """
+    # The roster is read before uploader.auth is imported, so .env has to be loaded here too
+    from dotenv import load_dotenv
+    load_dotenv()
+    path = path or os.getenv('INSTAGRAM_ACCOUNTS_FILE', ACCOUNTS_FILE)
+    if not os.path.exists(path):
+        return [Account(os.getenv('INSTAGRAM_USERNAME'), os.getenv('INSTAGRAM_PASSWORD'))]
+
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+
+    accounts = []
+    for entry in entries:
+        password = entry.get('password') or os.getenv(entry.get('password_env', ''))
+        if not entry.get('username') or not password:
+            logging.error(f"Skipping account without username or password in {path}")
+            continue
+        accounts.append(Account(
+            entry['username'], password, session_file=entry.get('session_file') or f"session_{entry['username']}.pkl",
+            hourly_limit=entry.get('hourly_limit'), daily_limit=entry.get('daily_limit'),
+        ))
+    return accounts
+
+_roster = None
+_roster_lock = threading.Lock()
+
+def get_roster():
+    """
+    Get the process-wide account roster
+    """
+    global _roster
+    with _roster_lock:
+        if _roster is None:
+            _roster = AccountRoster(load_accounts())
+        return _roster
@@ -5,6 +5,7 @@ Authentication module for Instagram
 import os
 import logging
 import time
+import threading
 from instagrapi import Client
 from instagrapi.exceptions import (
     LoginRequired,
@@ -17,21 +18,39 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-def create_client(debug=False, max_retries=3):
+SESSION_FILE = 'session.pkl'
+# Seconds a validated session is trusted before it is checked against the API again
+SESSION_TTL = int(os.getenv('INSTAGRAM_SESSION_TTL', '1800'))
+
+def save_session(client, session_file=SESSION_FILE):
+    """
+    Write the client session to disk atomically
+    
+    The settings are dumped to a temporary file first and then moved into place,
+    so a crash mid-write never leaves a truncated session behind.
+    """
+    tmp_file = f"{session_file}.tmp"
+    client.dump_settings(tmp_file)
+    os.replace(tmp_file, session_file)
+
+def create_client(debug=False, max_retries=3, username=None, password=None, session_file=SESSION_FILE):
     """
     Create an authenticated Instagram client with retry logic
     
     Args:
         debug (bool): Enable debug mode
         max_retries (int): Maximum number of retry attempts
+        username (str): Instagram username (defaults to INSTAGRAM_USERNAME)
+        password (str): Instagram password (defaults to INSTAGRAM_PASSWORD)
+        session_file (str): Where the session settings are stored
     
     Returns:
         Client/None: Authenticated client if successful, None otherwise
     """
     try:
         # Get credentials from environment variables
-        username = os.getenv('INSTAGRAM_USERNAME')
-        password = os.getenv('INSTAGRAM_PASSWORD')
+        username = username or os.getenv('INSTAGRAM_USERNAME')
+        password = password or os.getenv('INSTAGRAM_PASSWORD')
         
         if not username or not password:
             logging.error("Instagram credentials not found in environment variables")
@@ -45,9 +64,9 @@ def create_client(debug=False, max_retries=3):
         client.request_timeout = 30  # Increase timeout
         
         # Try to load session first
-        if os.path.exists('session.pkl'):
+        if os.path.exists(session_file):
             try:
-                client.load_settings('session.pkl')
+                client.load_settings(session_file)
                 # Test if session is still valid
                 try:
                     client.get_timeline_feed()
@@ -55,12 +74,12 @@ def create_client(debug=False, max_retries=3):
                     return client
                 except (LoginRequired, ClientError):
                     logging.warning("Session expired, attempting new login")
-                    if os.path.exists('session.pkl'):
-                        os.remove('session.pkl')
+                    if os.path.exists(session_file):
+                        os.remove(session_file)
             except Exception as e:
                 logging.warning(f"Failed to load session: {e}")
-                if os.path.exists('session.pkl'):
-                    os.remove('session.pkl')
+                if os.path.exists(session_file):
+                    os.remove(session_file)
         
         # Login with retry logic
         for attempt in range(max_retries):
@@ -69,7 +88,7 @@ def create_client(debug=False, max_retries=3):
                 client.login(username, password)
                 
                 # Save session for future use
-                client.dump_settings('session.pkl')
+                save_session(client, session_file)
                 logging.info("Login successful")
                 return client
                 
@@ -97,7 +116,7 @@ def create_client(debug=False, max_retries=3):
                     logging.info("Verification code sent")
                     
                     # Save session after successful verification
-                    client.dump_settings('session.pkl')
+                    save_session(client, session_file)
                     return client
                     
                 except Exception as challenge_error:
@@ -122,4 +141,93 @@ def create_client(debug=False, max_retries=3):
         
     except Exception as e:
         logging.error(f"Failed to create client: {e}")
-        return None
\ No newline at end of file
+        return None
+
+class ClientManager:
+    """
+    Keep one authenticated client alive across uploads
+    
+    The session is only revalidated against the API once it is older than the TTL
+    or after a request failed with LoginRequired, instead of before every upload.
+    """
+    def __init__(self, username=None, password=None, session_file=SESSION_FILE, ttl=SESSION_TTL, max_retries=3):
+        self.username = username
+        self.password = password
+        self.session_file = session_file
+        self.ttl = ttl
+        self.max_retries = max_retries
+        self._client = None
+        self._validated_at = 0.0
+        self._lock = threading.RLock()
+
+    def get_client(self, debug=False):
+        """
+        Return the authenticated client, logging in or revalidating only when needed
+        
+        Returns:
+            Client/None: Authenticated client if successful, None otherwise
+        """
+        with self._lock:
+            if self._client is not None:
+                if time.monotonic() - self._validated_at < self.ttl:
+                    return self._client
+                
+                try:
+                    self._client.get_timeline_feed()
+                    self._validated_at = time.monotonic()
+                    logging.debug("Cached session revalidated")
+                    return self._client
+                except LoginRequired:
+                    logging.warning("Cached session expired, logging in again")
+                    self.invalidate()
+                except (ClientConnectionError, ClientError) as e:
+                    # Throttling or a network error says nothing about the session, keep it and
+                    # revalidate on the next call; the upload itself backs off if it hits the same limit
+                    logging.warning(f"Could not revalidate cached session, keeping it: {e}")
+                    return self._client
+            
+            self._client = create_client(
+                debug, self.max_retries,
+                username=self.username, password=self.password, session_file=self.session_file
+            )
+            self._validated_at = time.monotonic()
+            return self._client
+
+    def invalidate(self):
+        """
+        Drop the cached client and its stored session, forcing a fresh login next time
+        """
+        with self._lock:
+            self._client = None
+            self._validated_at = 0.0
+            if os.path.exists(self.session_file):
+                os.remove(self.session_file)
+
+    def save(self):
+        """
+        Persist the current session so cookies refreshed by recent requests survive a restart
+        """
+        with self._lock:
+            if self._client is None:
+                return
+            try:
+                save_session(self._client, self.session_file)
+            except Exception as e:
+                logging.warning(f"Failed to save session: {e}")
+
+_client_managers = {}
+_client_manager_lock = threading.Lock()
+
+def get_client_manager(username=None, password=None, session_file=None):
+    """
+    Get the process-wide client manager of an account
+    
+    Without arguments this is the account configured in the environment.
+    """
+    with _client_manager_lock:
+        manager = _client_managers.get(username)
+        if manager is None:
+            manager = _client_managers[username] = ClientManager(
+                username, password, session_file=session_file or SESSION_FILE
+            )
+        return manager
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Structured ledger of the uploads made to Instagram
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from collections import namedtuple
+
+LEDGER_FILE = 'uploads.db'
+# Free-text log written by earlier versions, imported once into the ledger
+UPLOAD_LOG_FILE = 'uploads.log'
+
+UploadRecord = namedtuple('UploadRecord', [
+    'id', 'uploaded_at', 'url', 'note_id', 'media_id', 'video_path', 'account',
+])
+
+class UploadLedger:
+    """
+    Append-only record of every upload, indexed by URL, note ID, media ID and time
+
+    Rows are only ever inserted, so the ledger doubles as an audit trail. The
+    queries answer "was this posted already?" and "how many uploads in the
+    last N hours?" without scanning the whole history.
+    """
+    def __init__(self, path=LEDGER_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS uploads ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, uploaded_at REAL NOT NULL, url TEXT, note_id TEXT, '
+            'media_id TEXT, video_path TEXT, account TEXT)'
+        )
+        for column in ('url', 'note_id', 'media_id', 'uploaded_at'):
+            self._conn.execute(f'CREATE INDEX IF NOT EXISTS uploads_{column} ON uploads ({column})')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS imports (path TEXT PRIMARY KEY, size INTEGER, records INTEGER, imported_at REAL)'
+        )
+        self._conn.commit()
+
+    def record(self, url, media_id, video_path=None, note_id=None, account=None, uploaded_at=None):
+        """
+        Append an upload
+
+        Returns:
+            int: Row ID of the new record
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO uploads (uploaded_at, url, note_id, media_id, video_path, account) VALUES (?, ?, ?, ?, ?, ?)',
+                (uploaded_at or time.time(), url, note_id, media_id, video_path, account)
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def find(self, url=None, note_id=None, media_id=None):
+        """
+        Look up uploads by URL, note ID or media ID, most recent first
+
+        Returns:
+            list: UploadRecords matching any of the given keys
+        """
+        conditions = [(column, value) for column, value in
+                      (('url', url), ('note_id', note_id), ('media_id', media_id)) if value]
+        if not conditions:
+            return []
+        where = ' OR '.join(f'{column} = ?' for column, _ in conditions)
+        with self._lock:
+            rows = self._conn.execute(
+                f'SELECT id, uploaded_at, url, note_id, media_id, video_path, account FROM uploads '
+                f'WHERE {where} ORDER BY uploaded_at DESC',
+                [value for _, value in conditions]
+            ).fetchall()
+        return [UploadRecord(*row) for row in rows]
+
+    def posted(self, url=None, note_id=None):
+        """
+        Check whether a URL or note was uploaded before
+        """
+        return bool(self.find(url=url, note_id=note_id))
+
+    def count_since(self, since, account=None):
+        """
+        Count the uploads made at or after a timestamp, optionally for one account
+
+        Uploads recorded without an account (before accounts were tracked)
+        count against every account.
+        """
+        query = 'SELECT COUNT(*) FROM uploads WHERE uploaded_at >= ?'
+        params = [since]
+        if account:
+            query += ' AND (account = ? OR account IS NULL)'
+            params.append(account)
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()[0]
+
+    def import_log(self, log_file=UPLOAD_LOG_FILE):
+        """
+        Import the TIME/URL/VIDEO/UPLOAD_ID blocks of a legacy uploads.log
+
+        Each file is imported once; later calls for the same path are ignored.
+
+        Returns:
+            int: Number of records imported
+        """
+        if not os.path.exists(log_file):
+            return 0
+        key = os.path.abspath(log_file)
+        with self._lock:
+            if self._conn.execute('SELECT 1 FROM imports WHERE path = ?', (key,)).fetchone():
+                return 0
+
+        from downloader.utils import extract_note_id
+
+        records = []
+        entry = {}
+        with open(log_file, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('-----'):
+                    if entry.get('TIME'):
+                        records.append(entry)
+                    entry = {}
+                    continue
+                field, _, value = line.partition(': ')
+                if field in ('TIME', 'URL', 'VIDEO', 'UPLOAD_ID'):
+                    entry[field] = value.strip()
+        if entry.get('TIME'):
+            records.append(entry)
+
+        rows = []
+        for entry in records:
+            try:
+                uploaded_at = datetime.strptime(entry['TIME'], '%Y-%m-%d %H:%M:%S').timestamp()
+            except ValueError:
+                logging.warning(f"Skipping upload log entry with unreadable time: {entry['TIME']}")
+                continue
+            url = entry.get('URL')
+            rows.append((uploaded_at, url, extract_note_id(url) if url else None,
+                         entry.get('UPLOAD_ID'), entry.get('VIDEO'), None))
+
+        with self._lock:
+            self._conn.executemany(
+                'INSERT INTO uploads (uploaded_at, url, note_id, media_id, video_path, account) VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            self._conn.execute(
+                'INSERT INTO imports (path, size, records, imported_at) VALUES (?, ?, ?, ?)',
+                (key, os.path.getsize(log_file), len(rows), time.time())
+            )
+            self._conn.commit()
+
+        logging.info(f"Imported {len(rows)} uploads from {log_file} into the upload ledger")
+        return len(rows)
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+def get_upload_ledger(path=LEDGER_FILE):
+    """
+    Get the process-wide upload ledger
+    """
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = UploadLedger(path)
+        return _ledger
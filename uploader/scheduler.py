@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Upload scheduler pacing uploads per account with token buckets and throttle backoff
+"""
+import time
+import random
+import logging
+import threading
+from .ledger import get_upload_ledger
+
+HOUR = 3600
+DAY = 24 * 3600
+# First pause after Instagram throttles an account, doubled for every further throttle
+BASE_BACKOFF = 300
+MAX_BACKOFF = 6 * 3600
+# Backoff delays are spread by up to this fraction either way
+JITTER = 0.5
+# Each throttle halves the hourly budget, down to this fraction of it
+MIN_RATE_FACTOR = 0.125
+# Uploads in a row without a throttle before the budget is raised again one step
+RECOVERY_SUCCESSES = 3
+
+# instagrapi exceptions meaning "slow down", matched by name so instagrapi is not imported here
+THROTTLE_ERRORS = {'FeedbackRequired', 'PleaseWaitFewMinutes', 'RateLimitError', 'ClientThrottledError'}
+# A bare "429" is left out, media IDs and byte counts contain it too; the status code is checked instead
+THROTTLE_MARKERS = ('feedback_required', 'please wait a few minutes', 'too many requests')
+
+def is_throttle_error(error):
+    """
+    Check whether an upload error means Instagram is throttling the account
+    """
+    if THROTTLE_ERRORS & {cls.__name__ for cls in type(error).__mro__}:
+        return True
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) == 429 or getattr(error, 'code', None) == 429:
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+class TokenBucket:
+    """
+    Allow `capacity` events per `period` seconds, refilling continuously
+    """
+    def __init__(self, capacity, period, tokens=None):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = capacity if tokens is None else min(tokens, capacity)
+        self._updated = time.time()
+
+    def _refill(self, now, capacity):
+        self.tokens = min(capacity, self.tokens + (now - self._updated) * capacity / self.period)
+        self._updated = now
+
+    def wait_time(self, now, factor=1.0):
+        """Seconds until a token is available, with the capacity scaled by factor"""
+        capacity = max(1.0, self.capacity * factor)
+        self._refill(now, capacity)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) * self.period / capacity
+
+    def take(self):
+        self.tokens -= 1
+
+class _AccountState:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.level = 0
+        self.factor = 1.0
+        self.successes = 0
+        self.blocked_until = 0.0
+        self.throttles = 0
+        self.uploads = 0
+
+class UploadScheduler:
+    """
+    Decide when each account may upload next
+
+    Every account gets an hourly and a daily token bucket, seeded from the
+    upload ledger so a restart does not hand out a fresh budget. When Instagram
+    throttles an account (feedback_required, 429, "please wait"), it is paused
+    for an exponentially growing, jittered delay and its hourly budget is
+    halved. Each RECOVERY_SUCCESSES clean uploads undo one step, so the rate
+    climbs back to the configured budget.
+    """
+    def __init__(self, hourly_limit=None, daily_limit=None):
+        self.hourly_limit = hourly_limit
+        self.daily_limit = daily_limit
+        self._limits = {}
+        self._accounts = {}
+        self._lock = threading.Lock()
+
+    def configure(self, account, hourly_limit=None, daily_limit=None):
+        """
+        Give an account its own budgets instead of the scheduler-wide ones
+        """
+        with self._lock:
+            self._limits[account] = (hourly_limit, daily_limit)
+            self._accounts.pop(account, None)
+
+    def _state(self, account):
+        state = self._accounts.get(account)
+        if state is None:
+            ledger = get_upload_ledger()
+            now = time.time()
+            hourly_limit, daily_limit = self._limits.get(account, (None, None))
+            buckets = []
+            for limit, period in ((hourly_limit or self.hourly_limit, HOUR), (daily_limit or self.daily_limit, DAY)):
+                if limit:
+                    used = ledger.count_since(now - period, account=account)
+                    buckets.append(TokenBucket(limit, period, tokens=limit - used))
+            state = self._accounts[account] = _AccountState(buckets)
+        return state
+
+    def _wait_time(self, state, now):
+        waits = [state.blocked_until - now]
+        for bucket in state.buckets:
+            # Only the hourly budget is slowed down after throttling
+            factor = state.factor if bucket.period == HOUR else 1.0
+            waits.append(bucket.wait_time(now, factor))
+        return max(0.0, *waits)
+
+    def wait_time(self, account=None):
+        """
+        Get how long an account has to wait before its next upload
+
+        Returns:
+            float: Seconds, 0 if it may upload now
+        """
+        with self._lock:
+            return self._wait_time(self._state(account), time.time())
+
+    def acquire(self, account=None, max_wait=0):
+        """
+        Take an upload slot, sleeping up to max_wait seconds for one to free up
+
+        Returns:
+            float: 0 if a slot was taken, otherwise the seconds until one is available
+        """
+        deadline = time.time() + max_wait
+        while True:
+            with self._lock:
+                state = self._state(account)
+                now = time.time()
+                wait = self._wait_time(state, now)
+                if wait <= 0:
+                    for bucket in state.buckets:
+                        bucket.take()
+                    return 0.0
+            if now + wait > deadline:
+                return wait
+            time.sleep(wait)
+
+    def throttled_until(self, account=None):
+        """
+        Get the end of an account's throttle pause, 0 if it is not paused
+        """
+        with self._lock:
+            state = self._accounts.get(account)
+            return state.blocked_until if state and state.blocked_until > time.time() else 0.0
+
+    def throttled(self, account=None, error=None):
+        """
+        Record that Instagram throttled an account and pause it
+        """
+        with self._lock:
+            state = self._state(account)
+            state.level += 1
+            state.throttles += 1
+            state.successes = 0
+            state.factor = max(MIN_RATE_FACTOR, state.factor / 2)
+            delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (state.level - 1))
+            delay *= random.uniform(1 - JITTER, 1 + JITTER)
+            state.blocked_until = time.time() + delay
+        logging.warning(
+            f"Instagram is throttling {account or 'the account'} ({error}), pausing uploads for "
+            f"{delay / 60:.0f} minutes at {state.factor:.0%} of the hourly budget"
+        )
+
+    def succeeded(self, account=None):
+        """
+        Record a successful upload, recovering one step after RECOVERY_SUCCESSES in a row
+        """
+        with self._lock:
+            state = self._state(account)
+            state.uploads += 1
+            if state.level == 0:
+                return
+            state.successes += 1
+            if state.successes >= RECOVERY_SUCCESSES:
+                state.successes = 0
+                state.level -= 1
+                state.factor = min(1.0, state.factor * 2)
+                logging.info(f"Upload rate for {account or 'the account'} recovering, now {state.factor:.0%} of the hourly budget")
+
+    def stats(self):
+        """
+        Get the uploads, throttles and current rate factor of each account
+        """
+        with self._lock:
+            return {
+                account: {'uploads': state.uploads, 'throttles': state.throttles, 'rate_factor': state.factor}
+                for account, state in self._accounts.items()
+            }
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_upload_scheduler(hourly_limit=None, daily_limit=None):
+    """
+    Get the process-wide upload scheduler, created with the given budgets on first use
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = UploadScheduler(hourly_limit, daily_limit)
+        return _scheduler
@@ -4,10 +4,15 @@ Upload module for uploading videos to Instagram
 """
 import os
 import logging
-from .auth import create_client
+from instagrapi.exceptions import LoginRequired
+from .auth import get_client_manager
 from .utils import validate_video
+from .scheduler import get_upload_scheduler, is_throttle_error
+from .accounts import get_roster, is_account_error
+from media.probe import probe_media
+from pipeline.metrics import track
 
-def upload_reel(video_path, caption, debug=False):
+def upload_reel(video_path, caption, debug=False, account=None):
     """
     Upload a video as a reel to Instagram
     
@@ -15,6 +20,7 @@ def upload_reel(video_path, caption, debug=False):
         video_path (str): Path to the video file.
         caption (str): Caption for the reel.
         debug (bool): Enable debug mode.
+        account (Account): Roster account to upload with (defaults to the environment account).
     
     Returns:
         str/None: Media ID if successful, None otherwise
@@ -24,31 +30,54 @@ def upload_reel(video_path, caption, debug=False):
         logging.error(f"Invalid video: {video_path}")
         return None
         
-    # Get authenticated client
-    client = create_client(debug)
+    # Get authenticated client, reusing the session from previous uploads
+    if account:
+        manager = get_client_manager(account.username, account.password, account.session_file)
+    else:
+        manager = get_client_manager()
+    username = account.username if account else None
+    client = manager.get_client(debug)
     if not client:
         logging.error("Failed to create authenticated client")
+        if account:
+            get_roster().login_failed(account)
         return None
         
     try:
-        logging.info(f"Uploading reel: {video_path}")
+        logging.info(f"Uploading reel: {video_path}" + (f" as {username}" if username else ""))
         
         # Add some hashtags if not present
         if not any(tag in caption for tag in ['#', 'hashtag']):
             caption = f"{caption} #reels #trending"
             
-        # Get video details for logging
-        try:
-            from moviepy.editor import VideoFileClip
-            video = VideoFileClip(video_path)
-            logging.info(f"Video details - Duration: {video.duration:.2f}s, Size: {video.size}, FPS: {video.fps}")
-            video.close()
-        except Exception as e:
-            logging.warning(f"Could not get video details: {e}")
+        # Get video details for logging (cached from validation, no second probe)
+        info = probe_media(video_path)
+        if info:
+            logging.info(
+                f"Video details - Duration: {info.duration or 0:.2f}s, Size: [{info.width}, {info.height}], "
+                f"FPS: {info.fps or 0:.2f}"
+            )
+        else:
+            logging.warning("Could not get video details")
             
         # Upload as reel/clip
         try:
-            media = client.clip_upload(video_path, caption)
+            with track('clip_upload') as timer:
+                try:
+                    media = client.clip_upload(video_path, caption)
+                except LoginRequired:
+                    # The cached session was revoked server-side, log in again and retry once
+                    logging.warning("Session no longer valid, logging in again")
+                    manager.invalidate()
+                    client = manager.get_client(debug)
+                    if not client:
+                        raise
+                    media = client.clip_upload(video_path, caption)
+                timer.add_bytes(os.path.getsize(video_path))
+            manager.save()
+            get_upload_scheduler().succeeded(username)
+            if account:
+                get_roster().succeeded(account)
             # Extract media ID
             media_id = media.id if hasattr(media, 'id') else str(media)
             logging.info(f"Reel uploaded successfully. Media ID: {media_id}")
@@ -67,6 +96,13 @@ def upload_reel(video_path, caption, debug=False):
             logging.error("Upload failed with details:")
             for key, value in error_details.items():
                 logging.error(f"  {key}: {value}")
+            
+            # Let the scheduler back off instead of retrying into the same limit
+            if is_throttle_error(upload_error):
+                get_upload_scheduler().throttled(username, error=upload_error)
+            # A challenge or checkpoint takes this account out of rotation, the others carry on
+            elif account and is_account_error(upload_error):
+                get_roster().account_failed(account, upload_error)
                 
             # Check for specific error types
             if 'response' in str(upload_error):
@@ -4,7 +4,9 @@ Utility functions for the uploader module
 """
 import os
 import logging
-import subprocess
+from media.mp4 import read_mp4_info, info_verdict
+from media.probe import probe_media, ffprobe_available
+from pipeline.metrics import timed
 
 def setup_logging(debug=False):
     """Set up logging configuration"""
@@ -15,6 +17,7 @@ def setup_logging(debug=False):
         handlers=[logging.StreamHandler()]
     )
 
+@timed('validate')
 def validate_video(video_path):
     """
     Validate that the video file exists and is a valid video
@@ -40,35 +43,40 @@ def validate_video(video_path):
     if ext.lower() not in valid_extensions:
         logging.warning(f"File extension {ext} may not be a valid video format")
         
-    # Try to get video metadata with ffprobe if available
-    try:
-        result = subprocess.run(
-            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', video_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            logging.warning("Failed to get video metadata, file might be corrupted")
-            return False
-            
-        duration = float(result.stdout.strip())
-        if duration < 0.1:
+    # Read the MP4 boxes directly first, ffprobe is only needed when they can't decide
+    mp4_info = read_mp4_info(video_path)
+    verdict = info_verdict(mp4_info)
+    if verdict is False:
+        logging.error("Video file is truncated or missing its moov index")
+        return False
+    if verdict:
+        if mp4_info.duration < 0.1:
             logging.error("Video is too short (less than 0.1 seconds)")
             return False
-            
-        logging.debug(f"Video duration: {duration:.2f} seconds")
-        
-    except (subprocess.SubprocessError, FileNotFoundError):
+        logging.debug(f"Video duration: {mp4_info.duration:.2f} seconds")
+        return True
+    
+    # Try to get video metadata with ffprobe if available
+    if not ffprobe_available():
         # ffprobe not available, skip this check
         logging.debug("ffprobe not available, skipping video validation")
-        
+        return True
+    
+    info = probe_media(video_path)
+    if info is None or info.duration is None:
+        logging.warning("Failed to get video metadata, file might be corrupted")
+        return False
+    
+    if info.duration < 0.1:
+        logging.error("Video is too short (less than 0.1 seconds)")
+        return False
+    
+    logging.debug(f"Video duration: {info.duration:.2f} seconds")
     return True
 
 def get_video_dimensions(video_path):
     """
-    Get video dimensions using ffprobe
+    Get video dimensions from the cached ffprobe metadata
     
     Args:
         video_path (str): Path to the video file
@@ -76,25 +84,7 @@ def get_video_dimensions(video_path):
     Returns:
         tuple: (width, height) or None if unable to get dimensions
     """
-    try:
-        cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=width,height',
-            '-of', 'csv=s=x:p=0',
-            video_path
-        ]
-        
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        if result.returncode == 0:
-            dimensions = result.stdout.strip().split('x')
-            width = int(dimensions[0])
-            height = int(dimensions[1])
-            return (width, height)
-            
-    except (subprocess.SubprocessError, FileNotFoundError, ValueError, IndexError):
-        pass
-        
-    return None
\ No newline at end of file
+    info = probe_media(video_path)
+    if info and info.width and info.height:
+        return (info.width, info.height)
+    return None